@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import http.server
+import json
+import os
+import binascii
+
+LOGGER = udi_interface.LOGGER
+
+DEFAULT_HOST = '127.0.0.1'
+# most concurrent /events subscribers
+MAX_EVENT_CLIENTS = 8
+# seconds between keep-alive comments on an idle /events stream
+EVENT_KEEPALIVE = 15.0
+
+'''
+GoveeLocalStatusApi
+Optional read-only HTTP/JSON view of the fleet, so dashboards and scripts read
+the node server's state cache instead of polling the lights themselves:
+
+    GET /status            every light and group, with an ETag (a checksum of the
+                           document); a request with a matching If-None-Match
+                           gets 304 Not Modified
+    GET /status/<address>  one light or group, with its own ETag
+    GET /events            Server-Sent Events: a 'snapshot' event with the whole
+                           fleet, then a 'light' / 'group' event for each one that
+                           changes (and 'removed' for those that go away)
+
+'snapshot()' returns {'lights': {address: {...}}, 'groups': {address: {...}}}
+built from the in-memory caches; it is only called again after changed() has
+been called, so requests between two changes are served from one encoded copy.
+'''
+class GoveeLocalStatusApi:
+
+    def __init__(self, snapshot, host=DEFAULT_HOST, port=0):
+        self.snapshot = snapshot
+        self.host = host
+        self.port = int(port)
+
+        self._cond = threading.Condition()
+        self._version: int = 1
+        self._cached = None
+        self._server = None
+        self._thread = None
+        self._running: bool = False
+        self._eventClients: int = 0
+        # a fresh ETag prefix per run, so an ETag from before a restart never matches
+        self._tag = binascii.hexlify(os.urandom(4)).decode('ascii')
+
+        self.requests: int = 0
+        self.notModified: int = 0
+
+    def start(self):
+        api = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                api.handle(self)
+
+            def log_message(self, format, *args):
+                LOGGER.debug('\n\tStatus API: ' + format + '\n', *args)
+
+        server = http.server.ThreadingHTTPServer((self.host, self.port), Handler)
+        server.daemon_threads = True
+        self._server = server
+        self.port = server.server_address[1]
+        with self._cond:
+            self._running = True
+        self._thread = threading.Thread(target=server.serve_forever, name='GoveeLocalStatusApi', daemon=True)
+        self._thread.start()
+        LOGGER.warning('\n\tStatus API listening on http://{}:{}/status\n'.format(self.host, self.port))
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+
+    def isRunning(self):
+        return self._server is not None
+
+    '''
+    Called whenever a light's state (or the set of lights) changes.
+    '''
+    def changed(self):
+        with self._cond:
+            self._version += 1
+            self._cond.notify_all()
+
+    '''
+    (version, documents, encoded fleet document, {address: encoded document}) for
+    the current version, rebuilt only if something changed since the last call.
+    '''
+    def _current(self):
+        with self._cond:
+            version = self._version
+            cached = self._cached
+        if cached is not None and cached[0] == version:
+            return cached
+
+        documents = self.snapshot()
+        fleet = json.dumps(documents, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        each = {}
+        for kind in ('lights', 'groups'):
+            for address, document in documents.get(kind, {}).items():
+                each[address] = json.dumps(document, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        cached = (version, documents, fleet, each)
+        with self._cond:
+            if self._version == version:
+                self._cached = cached
+        return cached
+
+    def handle(self, request):
+        self.requests += 1
+        path = request.path.split('?', 1)[0].rstrip('/')
+        try:
+            if path == '/status':
+                version, documents, fleet, each = self._current()
+                self._reply(request, fleet, '"{}-{:08x}"'.format(self._tag, binascii.crc32(fleet)))
+            elif path.startswith('/status/'):
+                version, documents, fleet, each = self._current()
+                body = each.get(path[len('/status/'):])
+                if body is None:
+                    self._error(request, 404, 'unknown address')
+                else:
+                    self._reply(request, body, '"{}-{:08x}"'.format(self._tag, binascii.crc32(body)))
+            elif path == '/events':
+                self._events(request)
+            else:
+                self._error(request, 404, 'not found')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            LOGGER.error('\n\tStatus API request {} failed: {}\n'.format(request.path, e))
+
+    def _reply(self, request, body, etag):
+        if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            self.notModified += 1
+            request.send_response(304)
+            request.send_header('ETag', etag)
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.send_header('Cache-Control', 'no-cache')
+        request.send_header('ETag', etag)
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _error(self, request, status, message):
+        body = json.dumps({'error': message}).encode('utf-8')
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _events(self, request):
+        with self._cond:
+            if self._eventClients >= MAX_EVENT_CLIENTS:
+                full = True
+            else:
+                full = False
+                self._eventClients += 1
+        if full:
+            self._error(request, 503, 'too many event subscribers')
+            return
+
+        try:
+            request.send_response(200)
+            request.send_header('Content-Type', 'text/event-stream')
+            request.send_header('Cache-Control', 'no-cache')
+            request.send_header('Connection', 'close')
+            request.end_headers()
+            request.close_connection = True
+
+            version, documents, fleet, each = self._current()
+            self._event(request, 'snapshot', version, fleet)
+            sent = dict(each)
+            while True:
+                with self._cond:
+                    if self._running and self._version == version:
+                        self._cond.wait(EVENT_KEEPALIVE)
+                    if not(self._running):
+                        return
+                    changed = self._version != version
+                if not(changed):
+                    request.wfile.write(b': keepalive\n\n')
+                    request.wfile.flush()
+                    continue
+
+                version, documents, fleet, each = self._current()
+                for address, body in each.items():
+                    if sent.get(address) != body:
+                        self._event(request, 'light' if address in documents.get('lights', {}) else 'group', version, body)
+                for address in sent:
+                    if address not in each:
+                        self._event(request, 'removed', version, json.dumps({'address': address}).encode('utf-8'))
+                sent = dict(each)
+        finally:
+            with self._cond:
+                self._eventClients -= 1
+
+    def _event(self, request, name, version, body):
+        request.wfile.write(b'event: ' + name.encode('ascii') + b'\nid: ' + str(version).encode('ascii') + b'\ndata: ' + body + b'\n\n')
+        request.wfile.flush()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import json
+import socket
+
+from nodes import govee_local_state
+
+# largest datagram we accept from a device
+MAX_DATAGRAM = 2048
+
+# fixed requests, as sent on the wire
+SCAN_REQUEST = b'{"msg":{"cmd":"scan","data":{"account_topic":"reserve"}}}'
+STATUS_QUERY = b'{"msg":{"cmd":"devStatus","data":{}}}'
+TURN_ON = b'{"msg":{"cmd":"turn","data":{"value":1}}}'
+TURN_OFF = b'{"msg":{"cmd":"turn","data":{"value":0}}}'
+
+# every brightness command, indexed by brightness (0-100)
+BRIGHTNESS_PAYLOADS = tuple([b'{"msg":{"cmd":"brightness","data":{"value":%d}}}' % value for value in range(0, 101)])
+
+COLOR_TEMPLATE = b'{"msg":{"cmd":"colorwc","data":{"color":{"r":%d,"g":%d,"b":%d},"colorTemInKelvin":%d}}}'
+
+# accepted ranges of the devStatus fields
+MAX_KELVIN = 10000
+
+# scan reply fields kept besides the MAC and IP address
+SCAN_FIELDS = ('sku', 'bleVersionHard', 'bleVersionSoft', 'wifiVersionHard', 'wifiVersionSoft')
+
+# replies are UTF-8: decoding the text ourselves skips json.loads()' encoding detection
+_JSON_DECODER = json.JSONDecoder()
+_NO_COLOR = {}
+
+'''
+Raised for a datagram or reply that isn't a well formed Govee LAN message.
+'''
+class CodecError(ValueError):
+    pass
+
+'''
+Encoders for the control messages.  Values must already be in range (see the
+parse* helpers in govee_local_commands).
+'''
+def encodeTurn(on):
+    return TURN_ON if on else TURN_OFF
+
+def encodeBrightness(brightness):
+    return BRIGHTNESS_PAYLOADS[_byteRange(brightness, 0, 100)]
+
+def encodeColor(red, green, blue, colorTemInKelvin=0):
+    return COLOR_TEMPLATE % (_byteRange(red, 0, 255), _byteRange(green, 0, 255), _byteRange(blue, 0, 255), _byteRange(colorTemInKelvin, 0, MAX_KELVIN))
+
+def _byteRange(value, low, high):
+    value = int(value)
+    if value < low or value > high:
+        raise ValueError('{} is outside {}-{}'.format(value, low, high))
+    return value
+
+'''
+Split a datagram into (cmd, data).  Raises CodecError unless it is a JSON object
+{"msg": {"cmd": <str>, "data": <object>}}.
+'''
+def decodeDatagram(datagram):
+    if len(datagram) > MAX_DATAGRAM:
+        raise CodecError('datagram too long')
+    try:
+        message = _JSON_DECODER.decode(datagram.decode('utf-8'))
+    except (ValueError, RecursionError) as e:
+        raise CodecError('not JSON: {}'.format(e))
+    msg = message.get('msg') if isinstance(message, dict) else None
+    if not(isinstance(msg, dict)):
+        raise CodecError("no 'msg' object")
+    cmd = msg.get('cmd')
+    if not(isinstance(cmd, str)):
+        raise CodecError("no 'cmd'")
+    data = msg.get('data', {})
+    if not(isinstance(data, dict)):
+        raise CodecError("'data' is not an object")
+    return cmd, data
+
+def _field(data, name, low, high, default=None):
+    value = data.get(name, default)
+    # bool is an int, and some firmware does send true / false for onOff
+    if not(isinstance(value, int)) or value < low or value > high:
+        raise CodecError('bad {}: {!r}'.format(name, value))
+    return int(value)
+
+'''
+The 'data' of a devStatus reply as a GoveeDeviceState.  onOff and brightness are
+required; a missing color or colorTemInKelvin reads as 0.  Raises CodecError.
+'''
+def decodeStatus(data):
+    if not(isinstance(data, dict)):
+        raise CodecError('devStatus data is not an object')
+    color = data.get('color', _NO_COLOR)
+    if not(isinstance(color, dict)):
+        raise CodecError("bad color: {!r}".format(color))
+
+    # fast path: every field a plain int in range, checked inline
+    onOff = data.get('onOff')
+    brightness = data.get('brightness')
+    colorTemInKelvin = data.get('colorTemInKelvin', 0)
+    red = color.get('r', 0)
+    green = color.get('g', 0)
+    blue = color.get('b', 0)
+    if (type(onOff) is int and type(brightness) is int and type(colorTemInKelvin) is int
+            and type(red) is int and type(green) is int and type(blue) is int
+            and 0 <= onOff <= 1 and 0 <= brightness <= 100 and 0 <= colorTemInKelvin <= MAX_KELVIN
+            and 0 <= red <= 255 and 0 <= green <= 255 and 0 <= blue <= 255):
+        return govee_local_state.GoveeDeviceState(onOff, brightness, colorTemInKelvin, red, green, blue)
+
+    # anything else (bools, out of range values, other types) is checked field by field
+    return govee_local_state.GoveeDeviceState(
+        _field(data, 'onOff', 0, 1),
+        _field(data, 'brightness', 0, 100),
+        _field(data, 'colorTemInKelvin', 0, MAX_KELVIN, 0),
+        _field(color, 'r', 0, 255, 0),
+        _field(color, 'g', 0, 255, 0),
+        _field(color, 'b', 0, 255, 0))
+
+'''
+The 'data' of a scan reply as (mac, ipAddress, {field: str}); the IP address
+falls back to 'sourceIp' when the reply has none (or an invalid one).
+Raises CodecError if there is no usable 'device' (MAC) field.
+'''
+def decodeScan(data, sourceIp):
+    if not(isinstance(data, dict)):
+        raise CodecError('scan data is not an object')
+    mac = data.get('device')
+    if not(isinstance(mac, str)) or len(mac) == 0 or len(mac) > 64:
+        raise CodecError("no 'device' (MAC) field")
+    ipAddress = data.get('ip')
+    # the usual case, a reply naming the address it came from, needs no parsing
+    if ipAddress != sourceIp and (not(isinstance(ipAddress, str)) or not(_isIPv4(ipAddress))):
+        ipAddress = sourceIp
+    fields = {field: data.get(field, '') for field in SCAN_FIELDS}
+    for field, value in fields.items():
+        if type(value) is not str:
+            fields[field] = str(value)
+    return mac, ipAddress, fields
+
+def _isIPv4(address):
+    if address.count('.') != 3:
+        return False
+    try:
+        socket.inet_aton(address)
+        return True
+    except OSError:
+        return False
+
+'''
+GoveeLocalDecoder
+decodeDatagram() with a per-source cache: a light that hasn't changed sends the
+same devStatus bytes on every poll, so an identical datagram from the same
+address returns the previously decoded (cmd, data) without parsing it again.
+The returned data must be treated as read-only.
+'''
+class GoveeLocalDecoder:
+
+    def __init__(self):
+        self._last = {}
+        self.cacheHits: int = 0
+
+    def decode(self, sourceIp, datagram):
+        last = self._last.get(sourceIp)
+        if last is not None and last[0] == datagram:
+            self.cacheHits += 1
+            return last[1], last[2]
+        cmd, data = decodeDatagram(datagram)
+        self._last[sourceIp] = (bytes(datagram), cmd, data)
+        return cmd, data
+
+    def forget(self, sourceIp):
+        self._last.pop(sourceIp, None)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import threading
+import math
+
+# NumPy is optional: the *Many() batch conversions use it when it is installed
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# range covered by the Kelvin -> RGB table, and its resolution
+TABLE_MIN_KELVIN = 1000
+TABLE_MAX_KELVIN = 10000
+KELVIN_STEP = 10
+
+# color temperatures the lights (and the color_tempK editor) accept
+MIN_KELVIN = 2000
+MAX_KELVIN = 9000
+
+# resolution of the RGB -> Kelvin table (see approximateKelvin())
+RATIO_STEPS = 1024
+
+# LED output is linear in the PWM duty cycle; perceived lightness roughly follows gamma 2.2
+GAMMA = 2.2
+
+'''
+RGB of a black body at 'kelvin', scaled so the brightest channel is 255
+(Tanner Helland's fit of the CIE 1964 10 degree color matching data).  Only
+used to build the tables below.
+'''
+def _blackBody(kelvin):
+    temperature = kelvin / 100.0
+    if temperature <= 66:
+        red = 255.0
+        green = 99.4708025861 * math.log(temperature) - 161.1195681661
+        blue = 0.0 if temperature <= 19 else 138.5177312231 * math.log(temperature - 10) - 305.0447927307
+    else:
+        red = 329.698727446 * ((temperature - 60) ** -0.1332047592)
+        green = 288.1221695283 * ((temperature - 60) ** -0.0755148492)
+        blue = 255.0
+    return tuple([int(round(min(255.0, max(0.0, channel)))) for channel in (red, green, blue)])
+
+# KELVIN_RGB[(kelvin - TABLE_MIN_KELVIN) // KELVIN_STEP] = (r, g, b)
+KELVIN_RGB = tuple([_blackBody(kelvin) for kelvin in range(TABLE_MIN_KELVIN, TABLE_MAX_KELVIN + 1, KELVIN_STEP)])
+
+'''
+Along the black body curve blue / (red + blue) only ever grows with the
+temperature, so it indexes a 1-D table: RATIO_KELVIN[ratio * (RATIO_STEPS - 1)]
+is the table temperature whose ratio is nearest.  Built on first use.
+'''
+_ratioLock = threading.Lock()
+_ratioKelvin = None
+
+def _ratioTable():
+    global _ratioKelvin
+    with _ratioLock:
+        if _ratioKelvin is None:
+            ratios = [(blue / float(red + blue), TABLE_MIN_KELVIN + index * KELVIN_STEP) for index, (red, green, blue) in enumerate(KELVIN_RGB) if red + blue > 0]
+            table = []
+            position = 0
+            for step in range(0, RATIO_STEPS):
+                ratio = step / float(RATIO_STEPS - 1)
+                while position + 1 < len(ratios) and abs(ratios[position + 1][0] - ratio) <= abs(ratios[position][0] - ratio):
+                    position += 1
+                table.append(min(MAX_KELVIN, max(MIN_KELVIN, ratios[position][1])))
+            _ratioKelvin = tuple(table)
+        return _ratioKelvin
+
+'''
+BRIGHTNESS_CURVE[level] is the device brightness (0-100) that looks like 'level'
+percent of full output; any level above 0 stays at least 1.  Fades and dimming
+step through 'level' so equal steps look equal.
+'''
+BRIGHTNESS_CURVE = tuple([0] + [max(1, int(round(100.0 * ((level / 100.0) ** GAMMA)))) for level in range(1, 101)])
+
+# GAMMA_TABLE / DIM_TABLES[level] are bytes.translate() tables for R, G, B frames
+GAMMA_TABLE = bytes([int(round(255.0 * ((value / 255.0) ** GAMMA))) for value in range(0, 256)])
+DIM_TABLES = tuple([bytes([int(round(255.0 * (((value / 255.0) * (level / 100.0)) ** GAMMA))) for value in range(0, 256)]) for level in range(0, 101)])
+
+'''
+(r, g, b) for a color temperature, clamped to the table range.
+'''
+def kelvinToRGB(kelvin):
+    kelvin = min(TABLE_MAX_KELVIN, max(TABLE_MIN_KELVIN, int(kelvin)))
+    return KELVIN_RGB[(kelvin - TABLE_MIN_KELVIN + KELVIN_STEP // 2) // KELVIN_STEP]
+
+'''
+The color temperature (MIN_KELVIN - MAX_KELVIN) nearest to an RGB color, or 0 if
+the color has no red or blue at all (e.g. pure green), where it is meaningless.
+Only the red / blue balance is considered, so this is an approximation for
+display, not a colorimetric CCT.
+'''
+def approximateKelvin(red, green, blue):
+    total = red + blue
+    if total <= 0:
+        return 0
+    table = _ratioKelvin if _ratioKelvin is not None else _ratioTable()
+    return table[(blue * (RATIO_STEPS - 1) + total // 2) // total]
+
+'''
+Device brightness for a perceptual level (0-100).
+'''
+def perceivedBrightness(level):
+    return BRIGHTNESS_CURVE[min(100, max(0, int(level)))]
+
+'''
+The perceptual level (0-100) closest to a device brightness - the inverse of perceivedBrightness().
+'''
+def brightnessLevel(brightness):
+    brightness = min(100, max(0, int(brightness)))
+    if brightness == 0:
+        return 0
+    return min(100, max(1, int(round(100.0 * ((brightness / 100.0) ** (1.0 / GAMMA))))))
+
+'''
+A frame of R, G, B bytes dimmed to 'level' percent and gamma corrected (one
+bytes.translate(), so the per-frame cost is a table lookup per byte in C).
+'''
+def dimFrame(frame, level=100):
+    return bytes(frame).translate(DIM_TABLES[min(100, max(0, int(level)))])
+
+'''
+Batch forms for whole groups or frames.  With NumPy they take / return arrays
+(kelvinToRGBMany: shape (n, 3); approximateKelvinMany: shape (n,)); without it
+lists, with the same values.
+'''
+_kelvinArray = None
+
+def kelvinToRGBMany(kelvins):
+    global _kelvinArray
+    if numpy is None:
+        return [kelvinToRGB(kelvin) for kelvin in kelvins]
+    if _kelvinArray is None:
+        _kelvinArray = numpy.array(KELVIN_RGB, dtype=numpy.uint8)
+    kelvins = numpy.clip(numpy.asarray(kelvins, dtype=numpy.int64), TABLE_MIN_KELVIN, TABLE_MAX_KELVIN)
+    return _kelvinArray[(kelvins - TABLE_MIN_KELVIN + KELVIN_STEP // 2) // KELVIN_STEP]
+
+def approximateKelvinMany(colors):
+    if numpy is None:
+        return [approximateKelvin(red, green, blue) for red, green, blue in colors]
+    colors = numpy.asarray(colors, dtype=numpy.int64).reshape(-1, 3)
+    total = colors[:, 0] + colors[:, 2]
+    safeTotal = numpy.maximum(total, 1)
+    kelvins = numpy.asarray(_ratioTable(), dtype=numpy.int64)[(colors[:, 2] * (RATIO_STEPS - 1) + safeTotal // 2) // safeTotal]
+    return numpy.where(total > 0, kelvins, 0)
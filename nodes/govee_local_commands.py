@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import collections
+import time
+
+from nodes import govee_local_transitions
+
+LOGGER = udi_interface.LOGGER
+
+# minimum time between two packets to the same light, so its firmware isn't flooded
+MIN_COMMAND_GAP = 0.1
+
+'''
+Parsers for IoX command values, clamped to what the lights accept (the
+payloads themselves are built by govee_local_codec).
+'''
+def parseBrightness(value):
+    return max(1, min(100, int(float(value))))
+
+def parseColorTemperature(value):
+    return max(2000, min(9000, int(float(value))))
+
+def parseDuration(value):
+    return max(0, min(govee_local_transitions.MAX_DURATION, int(float(value))))
+
+'''
+The parameters of a multi-parameter command by id ('D.uom58' -> 'D').
+'''
+def queryValues(query):
+    return {key.split('.')[0]: query[key] for key in query}
+
+def parseRGB(query):
+    rgb = {}
+    for key in query:
+        rgb[key.split('.')[0]] = max(0, min(255, int(float(query[key]))))
+    return rgb.get('R', 0), rgb.get('G', 0), rgb.get('B', 0)
+
+'''
+Commands waiting to be sent to one light.
+'''
+class _DeviceCommands:
+    __slots__ = ('ipAddress', 'pending', 'lastSent')
+
+    def __init__(self, ipAddress):
+        self.ipAddress = ipAddress
+        self.pending = collections.OrderedDict()
+        self.lastSent = 0.0
+
+'''
+GoveeLocalCommandQueue
+One worker thread sends the control packets for every light.  Each light has its
+own queue, keyed by command kind ('turn', 'brightness', 'colorwc'): a new command
+replaces a queued one of the same kind (last write wins, e.g. for a brightness
+slider being dragged), and packets to the same light are at least MIN_COMMAND_GAP
+seconds apart.  'onSent(address)' is called after the last queued packet for a
+light has gone out, e.g. to schedule a confirming poll.
+'''
+class GoveeLocalCommandQueue:
+
+    def __init__(self, transport, onSent=None, minGap=MIN_COMMAND_GAP):
+        self.transport = transport
+        self.onSent = onSent
+        self.minGap = minGap
+
+        self._cond = threading.Condition()
+        self._devices = {}
+        self._thread = None
+        self._running: bool = False
+
+        self.sent: int = 0
+        self.superseded: int = 0
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='GoveeLocalCommandQueue', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+
+    def enqueue(self, address, ipAddress, kind, payload):
+        with self._cond:
+            device = self._devices.get(address)
+            if device is None:
+                device = _DeviceCommands(ipAddress)
+                self._devices[address] = device
+            device.ipAddress = ipAddress
+            if kind in device.pending:
+                self.superseded += 1
+                del device.pending[kind]
+            device.pending[kind] = payload
+            self._cond.notify()
+
+    '''
+    Send one already encoded command to many lights in a single tight burst (for
+    groups), bypassing the per-light gap.  Queued commands of the same kind for
+    those lights are superseded.  'targets' is [(address, ipAddress), ...].
+    '''
+    def sendNow(self, targets, kind, payload):
+        now = time.monotonic()
+        with self._cond:
+            for address, ipAddress in targets:
+                device = self._devices.get(address)
+                if device is None:
+                    device = _DeviceCommands(ipAddress)
+                    self._devices[address] = device
+                if kind in device.pending:
+                    self.superseded += 1
+                    del device.pending[kind]
+                device.lastSent = now
+
+        for address, ipAddress in targets:
+            if self.transport.send(ipAddress, payload):
+                self.sent += 1
+
+        if self.onSent is not None:
+            for address, ipAddress in targets:
+                try:
+                    self.onSent(address)
+                except Exception as e:
+                    LOGGER.error("\n\tCommand follow-up for '" + address + "' failed: %s\n", str(e))
+
+    '''
+    Drop anything still queued for a light (e.g. its node was removed).
+    '''
+    def cancel(self, address):
+        with self._cond:
+            self._devices.pop(address, None)
+
+    '''
+    True while a packet for this light is queued but not yet sent.
+    '''
+    def isPending(self, address):
+        with self._cond:
+            device = self._devices.get(address)
+            return device is not None and len(device.pending) > 0
+
+    def pendingCount(self):
+        with self._cond:
+            return sum([len(device.pending) for device in self._devices.values()])
+
+    def _run(self):
+        while True:
+            sends = []
+            with self._cond:
+                if not(self._running):
+                    return
+                now = time.monotonic()
+                nextReady = None
+                for address, device in self._devices.items():
+                    if len(device.pending) == 0:
+                        continue
+                    ready = device.lastSent + self.minGap
+                    if ready <= now:
+                        kind, payload = device.pending.popitem(last=False)
+                        device.lastSent = now
+                        sends.append((address, device.ipAddress, payload, len(device.pending) == 0))
+                    elif nextReady is None or ready < nextReady:
+                        nextReady = ready
+                if len(sends) == 0:
+                    self._cond.wait(None if nextReady is None else nextReady - now)
+                    continue
+
+            for address, ipAddress, payload, drained in sends:
+                if self.transport.send(ipAddress, payload):
+                    self.sent += 1
+                if drained and self.onSent is not None:
+                    try:
+                        self.onSent(address)
+                    except Exception as e:
+                        LOGGER.error("\n\tCommand follow-up for '" + address + "' failed: %s\n", str(e))
@@ -8,20 +8,71 @@ MIT License
 import udi_interface
 import sys
 import time
+import threading
+import logging
 import string
 import re
 
 # Standard Library
 from typing import Optional, Any, TYPE_CHECKING
 
-import math,datetime,urllib.parse,http.client,base64
+import math,datetime,urllib.parse
 
 from nodes import govee_local_device
+from nodes import govee_local_transport
+from nodes import govee_local_discovery
+from nodes import govee_local_state
+from nodes import govee_local_reporter
+from nodes import govee_local_scheduler
+from nodes import govee_local_commands
+from nodes import govee_local_metrics
+from nodes import govee_local_streaming
+from nodes import govee_local_group
+from nodes import govee_local_scenes
+from nodes import govee_local_dispatch
+from nodes import govee_local_warmstart
+from nodes import govee_local_logging
+from nodes import govee_local_profiling
+from nodes import govee_local_transitions
+from nodes import govee_local_api
+from nodes import govee_local_paths
 
 LOGGER = udi_interface.LOGGER
+HOTPATH_LOG = govee_local_logging.HOTPATH_LOG
 Custom = udi_interface.Custom
 ISY = udi_interface.ISY
 
+# overall deadline, in seconds, for the whole fleet to answer a devStatus request
+POLL_TIMEOUT = 2.0
+
+# seconds between the cheap multicast rescans that keep the device registry current
+DISCOVERY_INTERVAL = 300
+
+# how long to wait for Polyglot to finish adding a batch of child nodes
+NODE_ADD_TIMEOUT = 30.0
+# nodes left over in the Polyglot DB are only removed once discovery has had this long to find them
+DISCOVERY_GRACE = 15.0
+
+# seconds between metrics snapshots (and latency windows)
+METRICS_INTERVAL = 300
+METRICS_FILE = govee_local_paths.dataPath('govee_local_metrics.json')
+
+# the POLLTYPE debug message is logged for the first, then every Nth, poll of each type
+POLL_LOG_EVERY = 20
+
+# UDP trace dumps (controller 'Dump UDP Trace' command), suffixed with a timestamp
+TRACE_FILE_PREFIX = 'govee_local_trace_'
+
+'''
+Stable Polyglot node address for a light, derived from its identity: 'gm' plus the
+last 12 hex digits of the MAC address if known, otherwise 'gi' plus the zero
+padded IP address (both 14 characters, the Polyglot maximum).
+'''
+def deviceNodeAddress(macAddress, ipAddress):
+    if macAddress is not None:
+        return 'gm' + macAddress.replace(':', '').lower()[-12:]
+    return 'gi' + ''.join(['{:03d}'.format(int(octet)) for octet in ipAddress.split('.')])
+
 '''
 Controller
 '''
@@ -30,6 +81,9 @@ class Controller(udi_interface.Node):
     drivers = [
             {'driver': 'ST', 'value': -1, 'uom': 2},
             {'driver': 'GV0', 'value': -1, 'uom': 56},
+            {'driver': 'GV1', 'value': -1, 'uom': 56},
+            {'driver': 'GV2', 'value': -1, 'uom': 42},
+            {'driver': 'GV3', 'value': -1, 'uom': 51},
             {'driver': 'GPV', 'value': -1, 'uom': 56, 'text': 'NodeServer STARTING'}
             ]
 
@@ -43,49 +97,103 @@ class Controller(udi_interface.Node):
         self._fullyCreated: bool = False
         
         self.poly = polyglot
-        self.n_queue = []
+
+        # the one ADDNODEDONE / START subscriber, routing by address to every node we own
+        self.dispatcher = govee_local_dispatch.GoveeLocalEventDispatcher(polyglot)
+        self._reconcileLock = threading.Lock()
+
+        # last text pushed to each of our drivers
+        self.stateCache = govee_local_state.GoveeStateCache()
 
         self.Parameters = Custom(polyglot, 'customparams')
+        self.Data = Custom(polyglot, 'customdata')
 
         self.ISY = ISY(self.poly)
         self.parent = parent
 
+        # batches the driver updates of every node into a few 'set' messages
+        self.reporter = govee_local_reporter.GoveeLocalReportAggregator(polyglot)
+        # PG3 fallback for text drivers: queued, keep-alive reports to the ISY REST interface
+        self.isyReporter = govee_local_reporter.GoveeLocalISYReporter(polyglot, self.ISY)
+
+        # one shared UDP socket for every device node
+        self.transport = govee_local_transport.GoveeLocalTransport()
+
+        # MAC-keyed registry of every device found by LAN discovery
+        self.discovery = govee_local_discovery.GoveeLocalDiscovery(self.transport, self.Data, self.deviceDiscovered)
+        # unicast scan of the Sweep_Ranges CIDR ranges, for lights multicast can't reach
+        self.sweeper = govee_local_discovery.GoveeLocalSubnetSweep(self.transport, self.discovery)
+        self._childrenStale: bool = False
+
+        # last confirmed state of every light, shown (as stale) right after a restart
+        self.stateStore = govee_local_warmstart.GoveeLocalStateStore()
+        self.stateStore.load()
+        self._revalidate = set()
+
+        # per-device poll timing, with backoff for devices that stop answering
+        self.scheduler = govee_local_scheduler.GoveeLocalPollScheduler(self.pollScheduled, self.deviceOffline)
+
+        # rate limited control packets, each followed by a quick confirming poll
+        self.commandQueue = govee_local_commands.GoveeLocalCommandQueue(self.transport, self.commandSent)
+
+        # server-side fades for every light, on one shared timer wheel
+        self.transitions = govee_local_transitions.GoveeLocalTransitionEngine(self.commandQueue, self.fadeDone)
+
+        # latency / loss instrumentation, summarized in GV1-GV3 and a periodic snapshot file
+        self.metrics = govee_local_metrics.GoveeLocalMetrics()
+        self._addressByIp = {}
+        self._lastMetricsSnapshot = time.monotonic()
+        self.transport.roundTripHook = self.roundTripMeasured
+        self.transport.addListener('devStatus', self.offlineStatusReceived)
+        self.reporter.latencyHook = self.metrics.recordReportLatency
+
+        # real-time color streams fed from local UDP ports (Stream_Ports parameter)
+        self.streams = {}
+        self._streamConfig = None
+
+        # fleet snapshots: one in memory, plus named scenes on disk
+        self.snapshot = None
+        self.scenes = govee_local_scenes.GoveeLocalSceneStore()
+        self.sceneRestorer = govee_local_scenes.GoveeLocalSceneRestorer(self.transport, self.commandQueue)
+        self._restoreLock = threading.Lock()
+
+        # read-only local HTTP/JSON status API (Status_API_Port parameter); off by default
+        self.statusApi = None
+        self._statusApiConfig = None
+
+        # runtime profiling (Profiling parameter or the Profile command); off by default
+        self.profiler = govee_local_profiling.GoveeLocalProfiler()
+        self.profileHook = None
+        self._profilingParameter = None
+
         # subscribe to the events we want
         polyglot.subscribe(polyglot.CUSTOMPARAMS, self.parameterHandler)
+        polyglot.subscribe(polyglot.CUSTOMDATA, self.dataHandler)
+        polyglot.subscribe(polyglot.CONFIG, self.configHandler)
         polyglot.subscribe(polyglot.STOP, self.stop)
-        polyglot.subscribe(polyglot.START, self.start, address)
-        polyglot.subscribe(polyglot.ADDNODEDONE, self.node_queue)
         polyglot.subscribe(polyglot.POLL, self.poll)
+        self.dispatcher.register(self)
 
         # start processing events and create add our controller node
         polyglot.ready()
         self.poly.addNode(self)
 
     '''
-    node_queue() and wait_for_node_event() create a simple way to wait
-    for a node to be created.  The nodeAdd() API call is asynchronous and
-    will return before the node is fully created. Using this, we can wait
-    until it is fully created before we try to use it.
+    node_queue() is called by the dispatcher once Polyglot has finished adding the
+    controller node.  The nodeAdd() API call is asynchronous and will return
+    before the node is fully created.
     '''
     def node_queue(self, data):
         if self.address == data['address']:
-            self.n_queue.append(data['address'])
-            
-            ipAddresses = self.Parameters['IP_Addresses']
-            listOfIPAddresses = ipAddresses.split(";")
-            how_many = len(listOfIPAddresses)
+            how_many = len(self.desiredDevices())
             
             self._fullyCreated = True
+            self.stateCache.invalidate()
             self.setDriver('ST', 1, True, True)   
             self.setDriver('GV0', how_many, True, True)   
             self.setDriver('GPV', -1, True, True)        
             self.pushTextToDriver('GPV','NodeServer Running')
 
-    def wait_for_node_done(self):
-        while len(self.n_queue) == 0:
-            time.sleep(0.1)
-        self.n_queue.pop()
-
     '''
     Read the user entered custom parameters.  Here is where the user will
     configure the number of child nodes that they want created.
@@ -123,17 +231,262 @@ class Controller(udi_interface.Node):
 
         
         if validIP_Addresses and validDevice_Names:
-            self.createChildren()
+            self.reconcileChildren()
             self.poly.Notices.clear()
             self.pg3ParameterErrors = False
         else:
             if not(validIP_Addresses):
-                self.poly.Notices['IP_Addresses'] = 'Please populate the IP_Addresses parameter.'
+                self.poly.Notices['IP_Addresses'] = 'Please populate the IP_Addresses parameter (or let LAN discovery find your lights).'
             if not(validDevice_Names):
                 self.poly.Notices['Device_Names'] = 'Please populate the Device_Names parameter.'
             
             self.pushTextToDriver('GPV',ioxErrorMessage)
 
+            # lights found by LAN discovery don't need any configuration
+            if len(self.discovery.devices()) > 0:
+                self.reconcileChildren()
+
+        self.reconcileGroups()
+        self.configureStreams()
+        self.configureStatusApi()
+        self.configureSweep()
+
+        profiling = self.Parameters['Profiling']
+        if profiling != self._profilingParameter:
+            self._profilingParameter = profiling
+            self.setProfiling(profiling)
+
+    def getGroupNodes(self):
+        nodes = self.poly.getNodes()
+        return [nodes[address] for address in nodes if isinstance(nodes[address], govee_local_group.GoveeLocalGroup)]
+
+    '''
+    Bring the group nodes in line with the optional Groups parameter: ';'-separated
+    entries of '<group name>=<member>[,<member>...]', where a member is a device node
+    address, IP address or device name, e.g. 'Living Room=10.0.0.5,Couch Lamp'.
+    '''
+    def reconcileGroups(self):
+        groupsParameter = self.Parameters['Groups']
+        desired = {}
+        if groupsParameter is not None:
+            for entry in groupsParameter.split(';'):
+                if '=' not in entry:
+                    continue
+                name, members = entry.split('=', 1)
+                name = name.strip()
+                memberSpecs = [member.strip() for member in members.split(',') if len(member.strip()) > 0]
+                if len(name) > 0 and len(memberSpecs) > 0:
+                    desired[govee_local_group.groupNodeAddress(name)] = (name, memberSpecs)
+
+        existing = {group.address: group for group in self.getGroupNodes()}
+        toAdd = []
+        for address, (name, memberSpecs) in desired.items():
+            group = existing.get(address)
+            if group is None:
+                toAdd.append(govee_local_group.GoveeLocalGroup(self.poly, self.address, address, name, memberSpecs, self.reporter, self.commandQueue, self.transitions))
+                continue
+            group.memberSpecs = memberSpecs
+            if group.name != name:
+                self.poly.renameNode(address, name)
+                group.name = name
+            group.refresh()
+        self.addNodesAndWait(toAdd)
+
+        leftovers = list(existing)
+        try:
+            leftovers += [dbNode['address'] for dbNode in self.poly.getNodesFromDb() if dbNode.get('nodeDefId') == govee_local_group.GoveeLocalGroup.id and dbNode['address'] not in existing]
+        except Exception as e:
+            LOGGER.warning('\n\tUnable to read existing nodes from the Polyglot DB: {}\n'.format(e))
+        for address in leftovers:
+            if address not in desired:
+                LOGGER.warning('\n\tRemoving group node {}, which is no longer configured.\n'.format(address))
+                self.dispatcher.unregister(address)
+                self.poly.delNode(address)
+        self.stateChanged(None)
+
+    '''
+    (Re)start the real-time streams described by the optional Stream_Ports parameter:
+    ';'-separated entries of '<udpPort>[:<segments>]=<target>[,<target>...]', where a
+    target is a device node address or an IP address, e.g. '5000:10=gm1f80c5323236,10.0.0.7'.
+    Each UDP datagram received on the port is one frame of 3 * segments R, G, B bytes.
+    Stream_FPS (default 30, max 60) sets the frame rate.
+    '''
+    def configureStreams(self):
+        config = (self.Parameters['Stream_Ports'], self.Parameters['Stream_FPS'])
+        if config == self._streamConfig or not(self.transport.isRunning()):
+            return
+        self._streamConfig = config
+        self.stopStreams()
+
+        streamPorts, streamFPS = config
+        if streamPorts is None or len(streamPorts.strip()) == 0:
+            return
+        try:
+            fps = int(streamFPS) if streamFPS is not None and len(str(streamFPS).strip()) > 0 else govee_local_streaming.DEFAULT_FPS
+        except ValueError:
+            LOGGER.warning('\n\tInvalid Stream_FPS value: {}\n'.format(streamFPS))
+            fps = govee_local_streaming.DEFAULT_FPS
+
+        for entry in streamPorts.split(';'):
+            if '=' not in entry:
+                continue
+            portSpec, targets = entry.split('=', 1)
+            try:
+                port, segments = (portSpec.split(':', 1) + ['1'])[0:2]
+                port = int(port)
+                segments = int(segments)
+            except ValueError:
+                LOGGER.warning('\n\tInvalid Stream_Ports entry: {}\n'.format(entry))
+                continue
+
+            ipAddresses = []
+            for target in targets.split(','):
+                target = target.strip()
+                node = self.poly.getNode(target)
+                ipAddresses.append(node.ipAddress if isinstance(node, govee_local_device.GoveeLocalDevice) else target)
+
+            try:
+                stream = govee_local_streaming.GoveeLocalStreamSession(self.transport, ipAddresses, segments, fps, name=str(port))
+                stream.attachUdpPort(port)
+                stream.start()
+                self.streams[port] = stream
+            except (OSError, ValueError) as e:
+                LOGGER.error('\n\tUnable to start stream on port {}: {}\n'.format(port, e))
+
+    def stopStreams(self):
+        for port in list(self.streams):
+            self.streams.pop(port).stop()
+
+    '''
+    Apply the optional Sweep_Ranges (';'-separated CIDR ranges, e.g.
+    '192.168.20.0/22;10.0.5.0/24') and Sweep_Rate (packets per second, default
+    200) parameters; a change of ranges starts a full sweep.
+    '''
+    def configureSweep(self):
+        networks = govee_local_discovery.parseSweepRanges(self.Parameters['Sweep_Ranges'])
+        sweepRate = self.Parameters['Sweep_Rate']
+        try:
+            rate = int(sweepRate) if sweepRate is not None and len(str(sweepRate).strip()) > 0 else govee_local_discovery.SWEEP_RATE
+        except ValueError:
+            LOGGER.warning('\n\tInvalid Sweep_Rate value: {}\n'.format(sweepRate))
+            rate = govee_local_discovery.SWEEP_RATE
+        self.sweeper.configure(networks, rate)
+        self.sweeper.sweepIfDue(DISCOVERY_INTERVAL)
+
+    '''
+    (Re)start the optional status API on Status_API_Port (empty or 0 = off), bound
+    to Status_API_Host (default 127.0.0.1, i.e. this machine only).
+    '''
+    def configureStatusApi(self):
+        config = (self.Parameters['Status_API_Port'], self.Parameters['Status_API_Host'])
+        if config == self._statusApiConfig:
+            return
+        self._statusApiConfig = config
+        self.stopStatusApi()
+
+        portParameter, hostParameter = config
+        try:
+            port = int(portParameter) if portParameter is not None and len(str(portParameter).strip()) > 0 else 0
+        except ValueError:
+            LOGGER.warning('\n\tInvalid Status_API_Port value: {}\n'.format(portParameter))
+            return
+        if port <= 0:
+            return
+        host = hostParameter.strip() if hostParameter is not None and len(hostParameter.strip()) > 0 else govee_local_api.DEFAULT_HOST
+
+        statusApi = govee_local_api.GoveeLocalStatusApi(self.statusSnapshot, host, port)
+        try:
+            statusApi.start()
+        except OSError as e:
+            LOGGER.error('\n\tUnable to start the status API on {}:{}: {}\n'.format(host, port, e))
+            self.pushTextToDriver('GPV','Status API Port {} Unavailable'.format(port))
+            return
+        self.statusApi = statusApi
+
+    def stopStatusApi(self):
+        statusApi = self.statusApi
+        self.statusApi = None
+        if statusApi is not None:
+            statusApi.stop()
+
+    '''
+    Every light and group as served by the status API, from the nodes' caches.
+    '''
+    def statusSnapshot(self):
+        lights = {}
+        for device in self.getDeviceNodes():
+            state = device.stateCache.state
+            entry = self.discovery.get(device.macAddress) if device.macAddress is not None else None
+            document = {
+                'address': device.address,
+                'name': device.name,
+                'ip': device.ipAddress,
+                'mac': device.macAddress,
+                'sku': entry.get('sku') if entry is not None else None,
+                'online': not(self.scheduler.isOffline(device.address)) and state is not None,
+                'stale': device.stale,
+                'fading': self.transitions.isActive(device.address)
+            }
+            if state is not None:
+                onOff, brightness, colorTemInKelvin, red, green, blue = state.driverValues()
+                document.update({
+                    'on': bool(state.onOff),
+                    'brightness': brightness,
+                    'mode': 'colorTemperature' if state.colorTemInKelvin > 0 else 'rgb',
+                    'colorTemInKelvin': colorTemInKelvin,
+                    'rgb': [red, green, blue]
+                })
+            lights[device.address] = document
+
+        groups = {}
+        for group in self.getGroupNodes():
+            groups[group.address] = {
+                'address': group.address,
+                'name': group.name,
+                'members': [member.address for member in group.members()]
+            }
+        return {'lights': lights, 'groups': groups}
+
+    '''
+    Called by a device node whenever its cached state changes.
+    '''
+    def stateChanged(self, address):
+        statusApi = self.statusApi
+        if statusApi is not None:
+            statusApi.changed()
+
+    '''
+    The configured shortPoll becomes the scheduler's normal per-device poll interval.
+    '''
+    def configHandler(self, config):
+        if 'shortPoll' in config:
+            try:
+                self.scheduler.setInterval(float(config['shortPoll']))
+            except (ValueError, TypeError):
+                LOGGER.warning('\n\tIgnoring invalid shortPoll value: {}\n'.format(config['shortPoll']))
+
+    '''
+    Load the Polyglot custom data, which holds the saved device registry.
+    '''
+    def dataHandler(self, data):
+        self.Data.load(data)
+        # the scan replies will match the saved registry, so discovery won't report
+        # these lights again: bring their nodes (and MAC bindings) in on the next shortPoll
+        if self.discovery.loadRegistry() > 0:
+            self._childrenStale = True
+
+    '''
+    Called by discovery (on the transport's receive thread) when a device is first
+    seen or moves to a new IP address.  Known nodes are re-pointed right away; new
+    devices get their node on the next shortPoll, so we never block the receive thread.
+    '''
+    def deviceDiscovered(self, mac, entry, previousIp):
+        for device in self.getDeviceNodes():
+            if device.macAddress == mac or (device.macAddress is None and device.ipAddress in (entry['ip'], previousIp)):
+                device.updateAddress(entry['ip'], mac)
+                return
+        self._childrenStale = True
+
     '''
     This is called when the node is added to the interface module. It is
     run in a separate thread.  This is only run once so you should do any
@@ -146,6 +499,22 @@ class Controller(udi_interface.Node):
     def start(self):
         # set the initlized flag to allow setDriver to work
         self._initialized = True
+
+        if not(self.poly.pg3init.get('isPG3x', False)):
+            self.isyReporter.start()
+
+        try:
+            self.transport.start()
+        except OSError as e:
+            LOGGER.error('\n\tUnable to open UDP transport on port {}: {}\n'.format(self.transport.listenPort, e))
+            self.pushTextToDriver('GPV','UDP Port {} Unavailable'.format(self.transport.listenPort))
+
+        self.discovery.scan()
+        self.sweeper.sweepIfDue(DISCOVERY_INTERVAL)
+        self.scheduler.start()
+        self.commandQueue.start()
+        self.transitions.start()
+        self.configureStreams()
         
         self.poly.setCustomParamsDoc()
         # Not necessary to call this since profile_version is used from server.json
@@ -158,43 +527,331 @@ class Controller(udi_interface.Node):
     the user defined value in GV1. Then display a notice on the dashboard.
     '''
     def poll(self, polltype):
-        LOGGER.warning('\n\tPOLLTYPE: ' + polltype + ' received by ' + self.address + '.\n')
+        HOTPATH_LOG.sample(logging.DEBUG, ('pollType', polltype), POLL_LOG_EVERY, '\n\tPOLLTYPE: %s received by %s.\n', polltype, self.address)
         if 'shortPoll' in polltype:
             nowEpoch = int(time.time())
             nowDT = datetime.datetime.fromtimestamp(nowEpoch)
             self.pushTextToDriver('GPV',"Last Short Poll Date / Time: " + nowDT.strftime("%m/%d/%Y %I:%M:%S %p"))
-        
+            if self._childrenStale:
+                self._childrenStale = False
+                self.reconcileChildren()
+            self.scheduler.sync([device.address for device in self.getDeviceNodes()])
+            self.discovery.scanIfDue(DISCOVERY_INTERVAL)
+            self.sweeper.sweepIfDue(DISCOVERY_INTERVAL)
+            self.updateMetricsDrivers()
+        elif 'longPoll' in polltype:
+            # full resync: re-report every driver even if our cache says it's unchanged
+            self.pollDevices(True)
+            self.discovery.scan()
+            if not(self.poly.pg3init.get('isPG3x', False)):
+                LOGGER.info('\n\tISY REST reporter: {}\n'.format(self.isyReporter.stats()))
+            for device in self.getDeviceNodes():
+                device.poll(polltype)
+            if self.profiler.mode == 'memory':
+                self.pushTextToDriver('GPV', self.profiler.snapshotMemory(self.getDeviceNodes() + self.getGroupNodes()))
+
     '''
-    Create the children nodes.  Since this will be called anytime the
-    user changes the number of nodes and the new number may be less
-    than the previous number, we need to make sure we create the right
-    number of nodes.  Because this is just a simple example, we'll first
-    delete any existing nodes then create the number requested.
+    Return the child device nodes currently known to Polyglot.
     '''
-    def createChildren(self):
+    def getDeviceNodes(self):
+        nodes = self.poly.getNodes()
+        return [nodes[address] for address in nodes if isinstance(nodes[address], govee_local_device.GoveeLocalDevice)]
 
-        ipAddresses = self.Parameters['IP_Addresses']
-        deviceNames = self.Parameters['Device_Names']
+    '''
+    Query the given devices (all of them by default) at once over the shared
+    transport, hand each reply (or None, if the device missed the deadline) back to
+    its node, and let the scheduler plan each device's next poll from the result.
+    With 'forceReport', every driver is re-sent instead of only the changed ones.
 
-        listOfIPAddresses = ipAddresses.split(";")
-        listOfDeviceNames = deviceNames.split(";")
-        how_many = len(listOfIPAddresses)
+    Lights the scheduler considers offline are only probed: nothing waits for them,
+    so one dead light can't hold the batch (and the scheduler thread) for the full
+    POLL_TIMEOUT.  A late answer is picked up by offlineStatusReceived().
+    '''
+    def pollDevices(self, forceReport=False, addresses=None):
+        if not(self.transport.isRunning()):
+            HOTPATH_LOG.warning('transportDown', '\n\tUDP transport is not running; skipping device poll.\n')
+            return
 
-        LOGGER.warning('\n\tCreating {} Govee Locally Controlled Devices...'.format(how_many))
-        for i in range(0, how_many):
-            address = 'gvld_{}'.format(i)
-            current_IPaddress = listOfIPAddresses[i]
-            current_DeviceName = listOfDeviceNames[i]
-            
+        devices = self.getDeviceNodes()
+        if addresses is not None:
+            devices = [device for device in devices if device.address in addresses]
+        if len(devices) == 0:
+            return
+
+        polled = []
+        probed = []
+        for device in devices:
+            self._addressByIp[device.ipAddress] = device.address
+            if self.scheduler.isOffline(device.address):
+                probed.append(device)
+            else:
+                polled.append(device)
+
+        self.transport.probeStatus([device.ipAddress for device in probed])
+        for device in probed:
+            self.metrics.recordPoll(device.address, False, False)
+            self.scheduler.recordResult(device.address, False)
+
+        replies = self.transport.queryStatus([device.ipAddress for device in polled], POLL_TIMEOUT)
+        for device in polled:
+            reply = replies.get(device.ipAddress)
+            valid = device.processStatus(reply, forceReport)
+            if valid:
+                self.recordState(device)
+            self.metrics.recordPoll(device.address, reply is not None, valid)
+            self.scheduler.recordResult(device.address, reply is not None)
+        self.reporter.flush()
+        self.stateStore.flush()
+
+        for group in self.getGroupNodes():
+            group.refresh()
+
+    '''
+    Keep a light's confirmed state for the next warm start.
+    '''
+    def recordState(self, device):
+        entry = self.discovery.get(device.macAddress) if device.macAddress is not None else None
+        self.stateStore.record(device.address, device.ipAddress, device.macAddress, entry.get('sku') if entry is not None else None, device.stateCache.state)
+
+    '''
+    transport 'devStatus' listener, called on the receive thread for every status
+    reply.  Replies to polls are handled by pollDevices(); this only picks up the
+    answer to a probe of an offline light, which brings it back online.
+    '''
+    def offlineStatusReceived(self, ipAddress, cmd, data):
+        address = self._addressByIp.get(ipAddress)
+        if address is None or not(self.scheduler.isOffline(address)):
+            return
+        device = self.poly.getNode(address)
+        if not(isinstance(device, govee_local_device.GoveeLocalDevice)):
+            return
+        valid = device.processStatus(data, False)
+        # the probe was counted as a timeout when it was sent
+        self.metrics.recordLateReply(address, valid)
+        if valid:
+            self.recordState(device)
+            self.scheduler.recordResult(address, True)
+
+    '''
+    transport.roundTripHook: called on the receive thread for every answered request.
+    '''
+    def roundTripMeasured(self, ipAddress, cmd, seconds):
+        address = self._addressByIp.get(ipAddress)
+        if address is not None:
+            self.metrics.recordRoundTrip(address, seconds)
+
+    '''
+    Called by the command queue once the last queued packet for a light is sent.
+    '''
+    def commandSent(self, address):
+        # a fade's steps aren't confirmed one by one - only its end is (fadeDone())
+        if self.transitions.isActive(address):
+            return
+        self.metrics.recordCommand(address)
+        self.scheduler.pollSoon(address)
+
+    '''
+    Called by the fade engine when a fade completes: confirm the final state, and
+    bring the groups up to date.
+    '''
+    def fadeDone(self, address):
+        self.scheduler.pollSoon(address)
+        for group in self.getGroupNodes():
+            group.refresh()
+
+    '''
+    GV1 = devices online, GV2 = worst device p99 round trip (ms), GV3 = % of polls
+    answered; every METRICS_INTERVAL the full metrics snapshot is written to
+    METRICS_FILE and a new latency window is started.
+    '''
+    def updateMetricsDrivers(self):
+        self.setDriver('GV1', self.scheduler.onlineCount(), True, False)
+        self.setDriver('GV2', int(self.metrics.worstP99()), True, False)
+        self.setDriver('GV3', self.metrics.replyRate(), True, False)
+
+        if time.monotonic() - self._lastMetricsSnapshot >= METRICS_INTERVAL:
+            self._lastMetricsSnapshot = time.monotonic()
+            extra = {
+                'online': self.scheduler.onlineCount(),
+                'transportMalformed': self.transport.malformed,
+                'reportMessages': self.reporter.messagesSent,
+                'reportUpdates': self.reporter.updatesSent,
+                'isyReporter': self.isyReporter.stats()
+            }
+            self.metrics.writeSnapshot(METRICS_FILE, extra)
+            self.metrics.rotate()
+
+    '''
+    Called on the scheduler thread with the devices that are due.
+    '''
+    def pollScheduled(self, addresses):
+        if self.profileHook is not None:
+            self.profileHook('poll', self.pollDevices, False, addresses)
+        else:
+            self.pollDevices(False, addresses)
+
+    '''
+    Called by the scheduler once a device has missed enough polls to be considered offline.
+    '''
+    def deviceOffline(self, address):
+        node = self.poly.getNode(address)
+        if node is not None:
+            node.markOffline()
+
+    '''
+    Bring the child nodes in line with desiredDevices(), touching only what changed:
+    a light keeps the node already bound to its MAC or IP (or, for nodes from the
+    Polyglot DB, its name); that node is re-pointed / renamed if needed, new lights
+    are added all at once, and nodes for lights that are gone are removed.
+    '''
+    def reconcileChildren(self):
+        with self._reconcileLock:
+            desired = self.desiredDevices()
+            existing = {device.address: device for device in self.getDeviceNodes()}
+
+            dbNodes = {}
+            try:
+                for dbNode in self.poly.getNodesFromDb():
+                    if dbNode.get('nodeDefId') == govee_local_device.GoveeLocalDevice.id and dbNode['address'] not in existing:
+                        dbNodes[dbNode['address']] = dbNode.get('name')
+            except Exception as e:
+                LOGGER.warning('\n\tUnable to read existing nodes from the Polyglot DB: {}\n'.format(e))
+
+            byMAC = {device.macAddress: address for address, device in existing.items() if device.macAddress is not None}
+            byIP = {device.ipAddress: address for address, device in existing.items()}
+            byName = {dbNodes[address]: address for address in dbNodes}
+
+            claimed = set()
+            toAdd = []
+            for ipAddress, name, mac in desired:
+                address = byMAC.get(mac) if mac is not None else None
+                if address is None or address in claimed:
+                    address = byIP.get(ipAddress)
+                if address is None or address in claimed:
+                    address = byName.get(name)
+                if address is None or address in claimed:
+                    address = deviceNodeAddress(mac, ipAddress)
+                if address in claimed:
+                    LOGGER.warning('\n\tSkipping duplicate device {} at {}.\n'.format(name, ipAddress))
+                    continue
+                claimed.add(address)
+
+                node = existing.get(address)
+                if node is None:
+                    toAdd.append((address, ipAddress, name, mac))
+                    continue
+                if node.ipAddress != ipAddress or node.macAddress != mac:
+                    node.updateAddress(ipAddress, mac)
+                if node.name != name:
+                    LOGGER.warning('\n\tRenaming {} to {}.\n'.format(address, name))
+                    self.poly.renameNode(address, name)
+                    node.name = name
+
+            self.addChildren(toAdd)
+
+            # lights that are no longer configured or discovered
+            settled = self.discovery.lastScanAge() is not None and self.discovery.lastScanAge() >= DISCOVERY_GRACE
+            for address in list(existing) + list(dbNodes):
+                if address in claimed:
+                    continue
+                if address in dbNodes and not(settled):
+                    self._childrenStale = True
+                    continue
+                LOGGER.warning('\n\tRemoving node {}, which no longer matches a configured or discovered device.\n'.format(address))
+                self.transitions.cancel(address)
+                self.commandQueue.cancel(address)
+                self.metrics.forget(address)
+                self.stateStore.forget(address)
+                self.dispatcher.unregister(address)
+                self.poly.delNode(address)
+
+            how_many = len(claimed)
+            self.setDriver('GV0', how_many, True, True)
+            self.scheduler.sync([device.address for device in self.getDeviceNodes()])
+            self.stateStore.flush()
+
+            # confirm the warm-started states in one round, instead of over a poll interval
+            for address in self._revalidate:
+                self.scheduler.pollSoon(address, 0)
+            self._revalidate.clear()
+            self.stateChanged(None)
+
+    '''
+    Add [(address, ipAddress, name, macAddress), ...] concurrently and wait until
+    Polyglot reports every one of them done (ADDNODEDONE), or NODE_ADD_TIMEOUT.
+    '''
+    def addChildren(self, devices):
+        if len(devices) == 0:
+            return
+
+        LOGGER.warning('\n\tAdding {} Govee Locally Controlled Device(s)...'.format(len(devices)))
+        nodes = []
+        for address, ipAddress, name, mac in devices:
+            try:
+                LOGGER.warning('\n\t\t Device {}: {} at {}...'.format(address,name,ipAddress))
+                node = govee_local_device.GoveeLocalDevice(self.poly, self.address, address, name, ipAddress, mac, self.reporter, self.isyReporter, self.commandQueue, self.Parameters, self.ISY, self.transitions)
+                node.warmState = self.stateStore.warmState(address, ipAddress, mac)
+                node.changeHook = self.stateChanged
+                if node.warmState is not None:
+                    self._revalidate.add(address)
+                nodes.append(node)
+            except Exception as e:
+                LOGGER.error('Failed to create {}: {}'.format(name, e))
+        self.addNodesAndWait(nodes)
+
+    '''
+    Register the given nodes with the dispatcher, add them concurrently and wait
+    for all of their ADDNODEDONE events.
+    '''
+    def addNodesAndWait(self, nodes):
+        events = {}
+        for node in nodes:
+            self.dispatcher.register(node)
+            events[node.address] = self.dispatcher.expect(node.address)
             try:
-                LOGGER.warning('\n\t\t Device # {}: {} at {}...'.format(how_many,current_DeviceName,current_IPaddress))
-                node = govee_local_device.GoveeLocalDevice(self.poly, self.address, address, current_DeviceName, current_IPaddress)
                 self.poly.addNode(node)
-                self.wait_for_node_done()
             except Exception as e:
-                LOGGER.error('Failed to create {}: {}'.format(current_DeviceName, e))
+                LOGGER.error('Failed to add {}: {}'.format(node.name, e))
+                self.dispatcher.unregister(node.address)
+                events.pop(node.address, None)
+
+        deadline = time.monotonic() + NODE_ADD_TIMEOUT
+        for address in events:
+            if not(events[address].wait(max(0, deadline - time.monotonic()))):
+                LOGGER.error('\n\tTimed out waiting for Polyglot to add {}.\n'.format(address))
+            self.dispatcher.forget(address)
+
+    '''
+    The devices we want nodes for, as a list of (ipAddress, name, macAddress):
+    every IP_Addresses / Device_Names entry, followed by any device found by LAN
+    discovery that isn't one of them.  When the registry knows a device's MAC, its
+    current IP comes from the registry, so a DHCP change doesn't break the node.
+    '''
+    def desiredDevices(self):
+        ipAddresses = self.Parameters['IP_Addresses']
+        deviceNames = self.Parameters['Device_Names']
+
+        listOfIPAddresses = [ip.strip() for ip in ipAddresses.split(";") if len(ip.strip()) > 0] if ipAddresses is not None else []
+        listOfDeviceNames = [name.strip() for name in deviceNames.split(";")] if deviceNames is not None else []
 
-        self.setDriver('GV0', how_many, True, True)
+        devices = []
+        boundMACs = set()
+        for i in range(0, len(listOfIPAddresses)):
+            ipAddress = listOfIPAddresses[i]
+            name = listOfDeviceNames[i] if i < len(listOfDeviceNames) and len(listOfDeviceNames[i]) > 0 else 'Govee Light ' + ipAddress
+            mac = self.discovery.macForIp(ipAddress)
+            if mac is not None:
+                boundMACs.add(mac)
+                ipAddress = self.discovery.ipForMac(mac)
+            devices.append((ipAddress, name, mac))
+
+        discovered = self.discovery.devices()
+        for mac in sorted(discovered):
+            if mac not in boundMACs:
+                entry = discovered[mac]
+                devices.append((entry['ip'], 'Govee {} {}'.format(entry['sku'], mac[-5:]), mac))
+
+        return devices
 
     '''
     Change all the child node status drivers to unknown
@@ -204,20 +861,35 @@ class Controller(udi_interface.Node):
         nodes = self.poly.getNodes()
         for node in nodes:
             if node != 'controller':   # but not the controller node
-                nodes[node].setDriver('ST', 101, True, True)
+                # groups have no 101 in their ST editor (groupState); -1 is their unknown
+                nodes[node].setDriver('ST', -1 if isinstance(nodes[node], govee_local_group.GoveeLocalGroup) else 101, True, True)
 
+        self.stopStreams()
+        self.stopStatusApi()
+        self.sweeper.stop()
+        self.setProfiling(None)
+        self.transitions.stop()
+        self.commandQueue.stop()
+        self.scheduler.stop()
+        self.transport.stop()
+        self.reporter.flush()
+        self.stateStore.flush(True)
+        self.isyReporter.stop()
         self.poly.stop()
 
     '''
     Handling for <text /> attribute.
     Note that to be reported to IoX, the value has to change; this is why we flip from 0 to 1 or 1 to 0.
     -1 is reserved for initializing.
+    Text identical to what was last pushed to the driver is skipped, unless 'force' is set.
     '''
-    def pushTextToDriver(self,driver,stringToPublish):
+    def pushTextToDriver(self,driver,stringToPublish,force=False):
         if not(self._fullyCreated) or not(self._initialized):
-            LOGGER.warning("\n\tPUSHING REPORT ERROR - self._fullyCreated = " + format(self._fullyCreated) + "; self._initialized = " + format(self._initialized) + ".\n")
+            HOTPATH_LOG.warning(('notReady', self.address), "\n\tPUSHING REPORT ERROR on '%s' - self._fullyCreated = %s; self._initialized = %s.\n", self.address, self._fullyCreated, self._initialized)
             return
         stringToPublish = stringToPublish.replace('.','')
+        if not(self.stateCache.textChanged(driver, stringToPublish, force)):
+            return
         if len(str(self.getDriver(driver))) <= 0:
             LOGGER.warning("\n\tPUSHING REPORT ERROR - a (correct) Driver was not passed for '" + self.address + "' trying to update driver " + driver + ".\n")
             return
@@ -254,49 +926,143 @@ class Controller(udi_interface.Node):
 
         if 'isPG3x' in self.poly.pg3init and self.poly.pg3init['isPG3x'] is True:
             #PG3x can use this, but PG3 doesn't have the necessary 'text' handling within message, set above, so we have the 'else' below
-            LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3x via self.poly.send('" + encodedStringToPublish + "','status') with a value of '" + str(newValue) + "'.\n")
-            self.poly.send(message, 'status')
-        elif not(self.ISY.unauthorized):
-            userpassword = self.ISY._isy_user + ":" + self.ISY._isy_pass
-            userpasswordAsBytes = userpassword.encode("ascii")
-            userpasswordAsBase64Bytes = base64.b64encode(userpasswordAsBytes)
-            userpasswordAsBase64String = userpasswordAsBase64Bytes.decode("ascii")
-
-            if len(self.ISY._isy_ip) > 0 and len(userpasswordAsBase64String) > 3:
-                localConnection = http.client.HTTPConnection(self.ISY._isy_ip, self.ISY._isy_port)
-                payload = ''
-                headers = {
-                    "Authorization": "Basic " + userpasswordAsBase64String
-                }
-                
-                LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3 via " + self.ISY._isy_ip + ":" + str(self.ISY._isy_port) + ", with a value of " + str(newValue) + ", and a text attribute (encoded) of '" + encodedStringToPublish + "'.\n")
-        
-                prefixN = str(self.poly.profileNum)
-                if len(prefixN) < 2:
-                    prefixN = 'n00' + prefixN + '_'
-                elif len(prefixN) < 3:
-                    prefixN = 'n0' + prefixN + '_'
-                
-                suffixURL = '/rest/ns/' + str(self.poly.profileNum) + '/nodes/' + prefixN + self.address + '/report/status/' + driver + '/' + str(newValue) + '/56/text/' + encodedStringToPublish
-                
-                LOGGER.debug("\n\t\tPUSHING REPORT Details - this is the 'suffixURL':\n\t\t\t" + suffixURL + "\n")
-
-                try:
-                    localConnection.request("GET", suffixURL, payload, headers)
-                    localResponse = localConnection.getresponse()
-
-                    localResponseData = localResponse.read()
-                    localResponseData = localResponseData.decode("utf-8")
-                
-                    if '<status>200</status>' not in localResponseData:
-                        LOGGER.warning("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + ": RESPONSE from report was not '<status>200</status>' as expected:\n\t\t\t" + localResponseData + "\n")
-                    else:
-                        LOGGER.debug("\n\t\tPUSHING REPORT on '" + self.address + "' for driver " + driver + ": RESPONSE from report:\n\t\t\t" + localResponseData + "\n")
-                except http.client.HTTPException:
-                    LOGGER.error("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + " had an ERROR.\n")
-                except:
-                    LOGGER.error("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + " had an ERROR.\n")
-                finally:
-                    localConnection.close()  
+            LOGGER.debug("\n\tPUSHING REPORT TO '%s' for driver %s, with PG3x via self.poly.send('%s','status') with a value of '%s'.\n", self.address, driver, encodedStringToPublish, newValue)
+            if self.reporter is not None:
+                self.reporter.add(self.address, driver, newValue, 56, encodedStringToPublish)
+            else:
+                self.poly.send(message, 'status')
+        elif self.isyReporter is not None:
+            # PG3: handed to the shared ISY REST reporter, so polling never waits on the ISY
+            LOGGER.debug("\n\tQUEUEING REPORT TO '%s' for driver %s, with PG3 via the ISY REST reporter, with a text attribute (encoded) of '%s'.\n", self.address, driver, encodedStringToPublish)
+            self.isyReporter.enqueue(self.address, driver, newValue, encodedStringToPublish)
         else:
-            LOGGER.warning("\n\t\PUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + ": looks like this is a PG3 install but the ISY authorization state seems to currently be 'Unauthorized': 'True'.\n")
+            LOGGER.warning("\n\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + ": this is a PG3 install but there is no ISY REST reporter.\n")
+
+    '''
+    Name of scene slot 'number': from the optional Scene_Names parameter
+    ('1=Evening;2=Movie Night'), otherwise 'Scene <number>'.
+    '''
+    def sceneName(self, number):
+        sceneNames = self.Parameters['Scene_Names']
+        if sceneNames is not None:
+            for entry in sceneNames.split(';'):
+                if '=' in entry:
+                    slot, name = entry.split('=', 1)
+                    if slot.strip() == str(number) and len(name.strip()) > 0:
+                        return name.strip()
+        return 'Scene {}'.format(number)
+
+    '''
+    Send 'snapshot' back to the lights on a worker thread (one restore at a time).
+    '''
+    def restoreSnapshot(self, snapshot, label):
+        if not(self._restoreLock.acquire(False)):
+            self.pushTextToDriver('GPV', 'Restore already running')
+            return
+        nodes = self.poly.getNodes()
+        lights = []
+        for address, target in snapshot.items():
+            device = nodes.get(address)
+            if isinstance(device, govee_local_device.GoveeLocalDevice):
+                self.transitions.cancel(address)
+                lights.append((address, device.ipAddress, target, device.stateCache.state))
+        LOGGER.warning("\n\tRestoring '{}' to {} light(s).\n".format(label, len(lights)))
+        threading.Thread(target=self._restoreWorker, args=(lights, label), name='GoveeLocalRestore', daemon=True).start()
+
+    def _restoreWorker(self, lights, label):
+        try:
+            nodes = self.poly.getNodes()
+            def onStatus(address, data):
+                if data is not None and address in nodes:
+                    nodes[address].processStatus(data)
+            failed = self.sceneRestorer.restore(lights, onStatus)
+            self.reporter.flush()
+            for group in self.getGroupNodes():
+                group.refresh()
+            if len(failed) > 0:
+                LOGGER.warning("\n\tRestore of '{}': {} light(s) did not match: {}\n".format(label, len(failed), ', '.join(failed)))
+            self.pushTextToDriver('GPV', "Restored '{}': {} of {} lights".format(label, len(lights) - len(failed), len(lights)))
+        except Exception as e:
+            LOGGER.error("\n\tRestore of '{}' failed: {}\n".format(label, e))
+        finally:
+            self._restoreLock.release()
+
+    def cmdSnapshot(self, command):
+        self.snapshot = govee_local_scenes.captureSnapshot(self.getDeviceNodes())
+        self.pushTextToDriver('GPV', 'Snapshot of {} lights taken'.format(len(self.snapshot)))
+
+    def cmdRestore(self, command):
+        if self.snapshot is None:
+            self.pushTextToDriver('GPV', 'No snapshot to restore')
+            return
+        self.restoreSnapshot(self.snapshot, 'snapshot')
+
+    def cmdSaveScene(self, command):
+        name = self.sceneName(int(float(command.get('value', 1))))
+        snapshot = govee_local_scenes.captureSnapshot(self.getDeviceNodes())
+        if self.scenes.put(name, snapshot):
+            self.pushTextToDriver('GPV', "Scene '{}' saved ({} lights)".format(name, len(snapshot)))
+        else:
+            self.pushTextToDriver('GPV', "Unable to save scene '{}'".format(name))
+
+    def cmdLoadScene(self, command):
+        name = self.sceneName(int(float(command.get('value', 1))))
+        snapshot = self.scenes.get(name)
+        if snapshot is None:
+            self.pushTextToDriver('GPV', "No scene '{}'".format(name))
+            return
+        self.restoreSnapshot(snapshot, name)
+
+    '''
+    Write the UDP trace buffer (the recent datagrams to and from every light) to a
+    timestamped file in the NodeServer's data directory.
+    '''
+    def cmdDumpTrace(self, command):
+        path = govee_local_paths.dataPath(TRACE_FILE_PREFIX + datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + '.txt')
+        try:
+            count = self.transport.trace.dump(path, self._addressByIp)
+        except OSError as e:
+            LOGGER.error('\n\tUnable to write UDP trace to {}: {}\n'.format(path, e))
+            self.pushTextToDriver('GPV', 'Unable to write UDP trace')
+            return
+        LOGGER.warning('\n\tWrote {} UDP datagram(s) to {}.\n'.format(count, path))
+        self.pushTextToDriver('GPV', 'UDP trace written ({} datagrams)'.format(count))
+
+    '''
+    Start profiling in 'mode' (see govee_local_profiling.PROFILE_MODES), or stop
+    it - writing the results and showing their summary in GPV - for None / 'off'.
+    The poll, parse and report paths only get a profile hook while cProfile runs.
+    '''
+    def setProfiling(self, mode):
+        mode = mode.strip().lower() if mode is not None else None
+        if mode in (None, '', 'off', 'none'):
+            self.profileHook = None
+            self.transport.profileHook = None
+            self.reporter.profileHook = None
+            summary = self.profiler.stop(self.getDeviceNodes() + self.getGroupNodes())
+            if len(summary) > 0:
+                self.pushTextToDriver('GPV', summary)
+            return
+        if mode not in govee_local_profiling.PROFILE_MODES:
+            LOGGER.warning('\n\tInvalid Profiling value: {} (use off, {})\n'.format(mode, ', '.join(govee_local_profiling.PROFILE_MODES)))
+            return
+        self.profiler.start(mode)
+        hook = self.profiler.call if mode == 'cprofile' else None
+        self.profileHook = hook
+        self.transport.profileHook = hook
+        self.reporter.profileHook = hook
+        self.pushTextToDriver('GPV', 'Profiling ({}) started'.format(mode))
+
+    def cmdProfile(self, command):
+        index = int(float(command.get('value', 0)))
+        modes = (None,) + govee_local_profiling.PROFILE_MODES
+        self.setProfiling(modes[index] if 0 <= index < len(modes) else None)
+
+    commands = {
+                'PROFILE': cmdProfile,
+                'DUMPTRACE': cmdDumpTrace,
+                'SNAPSHOT': cmdSnapshot,
+                'RESTORE': cmdRestore,
+                'SAVESCENE': cmdSaveScene,
+                'LOADSCENE': cmdLoadScene
+               }
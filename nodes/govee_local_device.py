@@ -10,14 +10,19 @@ import sys
 import time
 import string
 import re
-import socket
 
 # Standard Library
 from typing import Optional, Any, TYPE_CHECKING
 
-import math,datetime,urllib.parse,http.client,base64
+import math,datetime,urllib.parse
+
+from nodes import govee_local_state
+from nodes import govee_local_commands
+from nodes import govee_local_codec
+from nodes import govee_local_logging
 
 LOGGER = udi_interface.LOGGER
+HOTPATH_LOG = govee_local_logging.HOTPATH_LOG
 Custom = udi_interface.Custom
 
 ISY = udi_interface.ISY
@@ -40,7 +45,7 @@ class GoveeLocalDevice(udi_interface.Node):
             {'driver': 'GPV', 'value': -1, 'uom': 56}
             ]
 
-    def __init__(self, polyglot, parent, address, name, ipAddress):
+    def __init__(self, polyglot, parent, address, name, ipAddress, macAddress=None, reporter=None, isyReporter=None, commandQueue=None, parameters=None, isy=None, transitions=None):
         super(GoveeLocalDevice, self).__init__(polyglot, parent, address, name)
         
         # set a flag to short circuit setDriver() until the node has been fully
@@ -51,28 +56,45 @@ class GoveeLocalDevice(udi_interface.Node):
         
         self.poly = polyglot
         self.ipAddress = ipAddress
+        self.macAddress = macAddress
 
-        self.Parameters = Custom(polyglot, 'customparams')
-        
-        self.ISY = ISY(self.poly)
+        # shared batching reporter owned by the Controller (None = report directly)
+        self.reporter = reporter
+        # shared PG3 (non-PG3x) ISY REST reporter owned by the Controller
+        self.isyReporter = isyReporter
+        # shared, rate limited control packet queue owned by the Controller
+        self.commandQueue = commandQueue
+        # shared fade engine owned by the Controller
+        self.transitions = transitions
+
+        # last state / text reported to IoX, so unchanged values aren't re-sent
+        self.stateCache = govee_local_state.GoveeStateCache()
+
+        # called with our address whenever the cached state changes (set by the Controller)
+        self.changeHook = None
+
+        # (GoveeDeviceState, confirmed epoch) saved before a restart, shown until the first reply
+        self.warmState = None
+        self.warmConfirmed: int = 0
+        self.stale: bool = False
+
+        # the Controller's parameters and ISY client, shared by every device node
+        self.Parameters = parameters
+        self.ISY = isy
         self.parent = parent
 
-        # subscribe to the events we want
-        polyglot.subscribe(polyglot.CUSTOMPARAMS, self.parameterHandler)
-        polyglot.subscribe(polyglot.POLL, self.poll)
-        polyglot.subscribe(polyglot.START, self.start, address)
-        polyglot.subscribe(polyglot.ADDNODEDONE, self.node_queue)
+        # no subscriptions of our own: the Controller's dispatcher routes ADDNODEDONE
+        # and START here by address, and the Controller calls poll() on long polls
 
     '''
-    node_queue() and wait_for_node_event() create a simple way to wait
-    for a node to be created.  The nodeAdd() API call is asynchronous and
-    will return before the node is fully created. Using this, we can wait
-    until it is fully created before we try to use it.
+    node_queue() is called by the Controller's dispatcher when Polyglot has
+    finished adding this node, so its drivers can be initialized.
     '''
     def node_queue(self, data):
         if self.address == data['address']:
             
             self._fullyCreated = True
+            self.stateCache.invalidate()
         
             self.setDriver('ST', -1, True, True)
             self.setDriver('OL', -1, True, True)
@@ -87,11 +109,43 @@ class GoveeLocalDevice(udi_interface.Node):
             self.setDriver('GPV', -1, True, True)
             
             self.pushTextToDriver('FREQ',self.ipAddress.replace('.','-'))
+            if self.macAddress is not None:
+                self.pushTextToDriver('PULSCNT',self.macAddress.replace(':','-'))
+
+            if self.warmState is not None:
+                state, self.warmConfirmed = self.warmState
+                self.warmState = None
+                self.stale = True
+                for driver, value in self.stateCache.changedDrivers(state, True):
+                    self.queueDriver(driver, value, True)
+                if self.reporter is not None:
+                    self.reporter.flush()
+                self.announceStale()
+                self.stateChanged()
 
-    def wait_for_node_done(self):
-        while len(self.n_queue) == 0:
-            time.sleep(0.1)
-        self.n_queue.pop()
+    '''
+    Tell IoX that the status shown is the last known state from before a restart,
+    once the node can take text updates (after both ADDNODEDONE and START).
+    '''
+    def announceStale(self):
+        if not(self.stale) or not(self._fullyCreated) or not(self._initialized):
+            return
+        confirmedDT = datetime.datetime.fromtimestamp(self.warmConfirmed)
+        self.pushTextToDriver('TIME',confirmedDT.strftime("%m/%d/%Y %I:%M:%S %p"))
+        self.pushTextToDriver('GPV','Last known state - not yet confirmed')
+
+    '''
+    Called by the Controller when LAN discovery finds this device (by MAC) at a new IP.
+    '''
+    def updateAddress(self, ipAddress, macAddress):
+        ipChanged = ipAddress != self.ipAddress
+        macChanged = macAddress != self.macAddress
+        self.ipAddress = ipAddress
+        self.macAddress = macAddress
+        if ipChanged:
+            self.pushTextToDriver('FREQ',self.ipAddress.replace('.','-'))
+        if macChanged:
+            self.pushTextToDriver('PULSCNT',self.macAddress.replace(':','-'))
 
     # called by the interface after the node data has been put in the Polyglot DB
     # and the node created/updated in the ISY
@@ -99,54 +153,170 @@ class GoveeLocalDevice(udi_interface.Node):
         # set the initlized flag to allow setDriver to work
         self._initialized = True
         self.setDriver('GPV', -1, True, True)
+        self.announceStale()
 
     '''
-    Read the user entered custom parameters.  
-    '''
-    def parameterHandler(self, params):
-        self.Parameters.load(params)
-
-    '''
-    This is where the real work happens.  When we get a shortPoll, increment the
-    count, report the current count in GV0 and the current count multiplied by
-    the user defined value in GV1. Then display a notice on the dashboard.
+    The devStatus query itself is sent by the Controller for the whole fleet at
+    once (see Controller.pollDevices()); on long polls the Controller calls this
+    to keep FREQ / PULSCNT populated.
     '''
     def poll(self, polltype):
-        LOGGER.info('\n\tPOLLTYPE: ' + polltype + ' received by ' + self.address + '.\n')
         if int(self.getDriver('FREQ')) < 0:
             self.pushTextToDriver('FREQ',self.ipAddress.replace('.','-'))
-        
-        if 'shortPoll' in polltype:
-            queryCmd = "{" + chr(34) + "msg" + chr(34) + ":{" + chr(34) + "cmd" + chr(34) + ":" + chr(34) + "devStatus" + chr(34) + "," + chr(34) + "data" + chr(34) + ":{}}}"
-            udpPort = 4003
-            LOGGER.warning("\n\tUDP Request about to be sent...\n")
-            try:
-                sockSend = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                sockSend.connect((self.ipAddress, udpPort))
-                sockSend.send(queryCmd.encode())
-                data = ""
-                while True:
-                    data = data + sockSend.recv(256)
-                    if data != "":
-                        break
-                sockSend.close()
-                LOGGER.warning("\n\t\tUDP Reponse Received:\n\t\t\t%s\n" + data.decode())
-            except Exception as e:
-                LOGGER.error("\n\tUDP Send / Receive error for shortPoll of '" + self.address + "':\n\t\t%s\n",str(e))
-            nowEpoch = int(time.time())
-            nowDT = datetime.datetime.fromtimestamp(nowEpoch)
-            self.pushTextToDriver('TIME',nowDT.strftime("%m/%d/%Y %I:%M:%S %p"))
+        if self.macAddress is not None and int(self.getDriver('PULSCNT')) < 0:
+            self.pushTextToDriver('PULSCNT',self.macAddress.replace(':','-'))
+
+    '''
+    Called by the Controller with this device's devStatus reply from the shared
+    transport, or None if the device did not answer before the deadline.
+    Only the drivers that changed since the last report are sent, unless 'forceReport'.
+    Returns True if a valid reply was applied.
+    '''
+    def processStatus(self, data, forceReport=False):
+        if data is None:
+            HOTPATH_LOG.info(('noReply', self.address), "\n\tNo devStatus reply from '%s' (%s) before the deadline.\n", self.address, self.ipAddress)
+            return False
+
+        try:
+            state = govee_local_codec.decodeStatus(data)
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            HOTPATH_LOG.error(('badReply', self.address), "\n\tMalformed devStatus reply from '%s': %s\n", self.address, e)
+            return False
+
+        previous = self.stateCache.state
+        for driver, value in self.stateCache.changedDrivers(state, forceReport):
+            self.queueDriver(driver, value, forceReport)
+        if self.stale:
+            self.stale = False
+            self.pushTextToDriver('GPV','State confirmed')
+            self.stateChanged()
+        elif previous != state:
+            self.stateChanged()
+
+        nowEpoch = int(time.time())
+        nowDT = datetime.datetime.fromtimestamp(nowEpoch)
+        self.pushTextToDriver('TIME',nowDT.strftime("%m/%d/%Y %I:%M:%S %p"),forceReport)
+        return True
+
+    '''
+    Called by the Controller's scheduler when this device has stopped answering:
+    ST goes to 101 (unknown) and the full state is re-reported once it answers again.
+    '''
+    def markOffline(self):
+        self.stateCache.invalidateState()
+        self.queueDriver('ST', 101)
+        self.stateChanged()
+
+    '''
+    Queue a control packet for this light and optimistically report the state it
+    should produce, so IoX reflects the change before the confirming poll.
+    '''
+    def sendCommand(self, kind, payload, **expectedFields):
+        if self.commandQueue is None:
+            LOGGER.warning("\n\tCOMMAND ERROR - no command queue for '" + self.address + "'; '" + kind + "' not sent.\n")
+            return
+        if self.transitions is not None:
+            self.transitions.cancel(self.address)
+        self.commandQueue.enqueue(self.address, self.ipAddress, kind, payload)
+        self.applyExpected(True, **expectedFields)
+
+    '''
+    Fade this light to the given target(s) over 'duration' seconds (see
+    GoveeLocalTransitionEngine.fade()); replaces any fade already running.
+    '''
+    def fadeTo(self, duration, **targets):
+        if self.transitions is None or self.commandQueue is None:
+            LOGGER.warning("\n\tCOMMAND ERROR - no fade engine for '" + self.address + "'; fade not started.\n")
+            return
+        self.transitions.fade(self, duration, **targets)
+
+    '''
+    Report the state a command sent to this light should produce (used by sendCommand()
+    and by groups, which send the packets themselves).
+    '''
+    def applyExpected(self, flush=True, **expectedFields):
+        changes = self.stateCache.updateFields(**expectedFields)
+        for driver, value in changes:
+            self.queueDriver(driver, value)
+        if flush and self.reporter is not None:
+            self.reporter.flush()
+        if len(changes) > 0:
+            self.stateChanged()
+
+    def stateChanged(self):
+        if self.changeHook is not None:
+            self.changeHook(self.address)
+
+    def cmdOn(self, command):
+        self.sendCommand('turn', govee_local_codec.encodeTurn(True), onOff=1)
+        value = command.get('value')
+        if value is not None and len(str(value)) > 0:
+            brightness = govee_local_commands.parseBrightness(value)
+            self.sendCommand('brightness', govee_local_codec.encodeBrightness(brightness), brightness=brightness)
+
+    def cmdOff(self, command):
+        self.sendCommand('turn', govee_local_codec.encodeTurn(False), onOff=0)
+
+    def cmdBrightness(self, command):
+        brightness = govee_local_commands.parseBrightness(command.get('value'))
+        self.sendCommand('brightness', govee_local_codec.encodeBrightness(brightness), brightness=brightness)
+
+    def cmdColorTemperature(self, command):
+        colorTemInKelvin = govee_local_commands.parseColorTemperature(command.get('value'))
+        self.sendCommand('colorwc', govee_local_codec.encodeColor(0, 0, 0, colorTemInKelvin), colorTemInKelvin=colorTemInKelvin)
+
+    def cmdRGB(self, command):
+        red, green, blue = govee_local_commands.parseRGB(command.get('query', {}))
+        self.sendCommand('colorwc', govee_local_codec.encodeColor(red, green, blue), colorTemInKelvin=0, red=red, green=green, blue=blue)
+
+    def cmdFade(self, command):
+        values = govee_local_commands.queryValues(command.get('query', {}))
+        brightness = max(0, min(100, int(float(values.get('OL', 0)))))
+        self.fadeTo(govee_local_commands.parseDuration(values.get('D', 0)), brightness=brightness)
+
+    def cmdFadeColorTemperature(self, command):
+        values = govee_local_commands.queryValues(command.get('query', {}))
+        colorTemInKelvin = govee_local_commands.parseColorTemperature(values.get('K', 2000))
+        self.fadeTo(govee_local_commands.parseDuration(values.get('D', 0)), colorTemInKelvin=colorTemInKelvin)
+
+    def cmdFadeRGB(self, command):
+        query = command.get('query', {})
+        values = govee_local_commands.queryValues(query)
+        rgb = govee_local_commands.parseRGB({key: query[key] for key in query if not(key.startswith('D.'))})
+        self.fadeTo(govee_local_commands.parseDuration(values.get('D', 0)), rgb=rgb)
+
+    def cmdQuery(self, command):
+        controller = self.poly.getNode(self.parent)
+        if controller is not None:
+            controller.scheduler.pollSoon(self.address, 0)
+
+    '''
+    Set a (numeric) driver and report it through the shared batching reporter,
+    or straight to Polyglot if there isn't one.
+    '''
+    def queueDriver(self, driver, value, force=False):
+        if self.reporter is None:
+            self.setDriver(driver, value, True, force)
+            return
+        self.setDriver(driver, value, False)
+        for d in self.drivers:
+            if d['driver'] == driver:
+                self.reporter.add(self.address, driver, value, d['uom'])
+                return
 
     '''
     Handling for <text /> attribute.
     Note that to be reported to IoX, the value has to change; this is why we flip from 0 to 1 or 1 to 0.
     -1 is reserved for initializing.
+    Text identical to what was last pushed to the driver is skipped, unless 'force' is set.
     '''
-    def pushTextToDriver(self,driver,stringToPublish):
+    def pushTextToDriver(self,driver,stringToPublish,force=False):
         if not(self._fullyCreated) or not(self._initialized):
-            LOGGER.warning("\n\tPUSHING REPORT ERROR - self._fullyCreated = " + format(self._fullyCreated) + "; self._initialized = " + format(self._initialized) + ".\n")
+            HOTPATH_LOG.warning(('notReady', self.address), "\n\tPUSHING REPORT ERROR on '%s' - self._fullyCreated = %s; self._initialized = %s.\n", self.address, self._fullyCreated, self._initialized)
             return
         stringToPublish = stringToPublish.replace('.','')
+        if not(self.stateCache.textChanged(driver, stringToPublish, force)):
+            return
         if len(str(self.getDriver(driver))) <= 0:
             LOGGER.warning("\n\tPUSHING REPORT ERROR - a (correct) Driver was not passed for '" + self.address + "' trying to update driver " + driver + ".\n")
             return
@@ -183,50 +353,26 @@ class GoveeLocalDevice(udi_interface.Node):
 
         if 'isPG3x' in self.poly.pg3init and self.poly.pg3init['isPG3x'] is True:
             #PG3x can use this, but PG3 doesn't have the necessary 'text' handling within message, set above, so we have the 'else' below
-            LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3x via self.poly.send('" + encodedStringToPublish + "','status') with a value of '" + str(newValue) + "'.\n")
-            self.poly.send(message, 'status')
-        elif not(self.ISY.unauthorized):
-            userpassword = self.ISY._isy_user + ":" + self.ISY._isy_pass
-            userpasswordAsBytes = userpassword.encode("ascii")
-            userpasswordAsBase64Bytes = base64.b64encode(userpasswordAsBytes)
-            userpasswordAsBase64String = userpasswordAsBase64Bytes.decode("ascii")
-
-            if len(self.ISY._isy_ip) > 0 and len(userpasswordAsBase64String) > 3:
-                localConnection = http.client.HTTPConnection(self.ISY._isy_ip, self.ISY._isy_port)
-                payload = ''
-                headers = {
-                    "Authorization": "Basic " + userpasswordAsBase64String
-                }
-                
-                LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3 via " + self.ISY._isy_ip + ":" + str(self.ISY._isy_port) + ", with a value of " + str(newValue) + ", and a text attribute (encoded) of '" + encodedStringToPublish + "'.\n")
-        
-                prefixN = str(self.poly.profileNum)
-                if len(prefixN) < 2:
-                    prefixN = 'n00' + prefixN + '_'
-                elif len(prefixN) < 3:
-                    prefixN = 'n0' + prefixN + '_'
-                
-                suffixURL = '/rest/ns/' + str(self.poly.profileNum) + '/nodes/' + prefixN + self.address + '/report/status/' + driver + '/' + str(newValue) + '/56/text/' + encodedStringToPublish
-                
-                LOGGER.debug("\n\t\tPUSHING REPORT Details - this is the 'suffixURL':\n\t\t\t" + suffixURL + "\n")
-
-                try:
-                    localConnection.request("GET", suffixURL, payload, headers)
-                    localResponse = localConnection.getresponse()
-
-                    localResponseData = localResponse.read()
-                    localResponseData = localResponseData.decode("utf-8")
-                
-                    if '<status>200</status>' not in localResponseData:
-                        LOGGER.warning("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + ": RESPONSE from report was not '<status>200</status>' as expected:\n\t\t\t" + localResponseData + "\n")
-                    else:
-                        LOGGER.debug("\n\t\tPUSHING REPORT on '" + self.address + "' for driver " + driver + ": RESPONSE from report:\n\t\t\t" + localResponseData + "\n")
-                except http.client.HTTPException:
-                    LOGGER.error("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + " had an ERROR.\n")
-                except:
-                    LOGGER.error("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + " had an ERROR.\n")
-                finally:
-                    localConnection.close()  
+            LOGGER.debug("\n\tPUSHING REPORT TO '%s' for driver %s, with PG3x via self.poly.send('%s','status') with a value of '%s'.\n", self.address, driver, encodedStringToPublish, newValue)
+            if self.reporter is not None:
+                self.reporter.add(self.address, driver, newValue, 56, encodedStringToPublish)
+            else:
+                self.poly.send(message, 'status')
+        elif self.isyReporter is not None:
+            # PG3: handed to the shared ISY REST reporter, so polling never waits on the ISY
+            LOGGER.debug("\n\tQUEUEING REPORT TO '%s' for driver %s, with PG3 via the ISY REST reporter, with a text attribute (encoded) of '%s'.\n", self.address, driver, encodedStringToPublish)
+            self.isyReporter.enqueue(self.address, driver, newValue, encodedStringToPublish)
         else:
-            LOGGER.warning("\n\t\PUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + ": looks like this is a PG3 install but the ISY authorization state seems to currently be 'Unauthorized': 'True'.\n")
+            LOGGER.warning("\n\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + ": this is a PG3 install but there is no ISY REST reporter.\n")
 
+    commands = {
+                'DON': cmdOn,
+                'DOF': cmdOff,
+                'SETBRI': cmdBrightness,
+                'SETCT': cmdColorTemperature,
+                'SETRGB': cmdRGB,
+                'FADE': cmdFade,
+                'FADECT': cmdFadeColorTemperature,
+                'FADERGB': cmdFadeRGB,
+                'QUERY': cmdQuery
+               }
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import ipaddress
+import time
+
+from nodes import govee_local_logging
+from nodes import govee_local_codec
+
+LOGGER = udi_interface.LOGGER
+HOTPATH_LOG = govee_local_logging.HOTPATH_LOG
+
+GOVEE_MULTICAST_ADDRESS = '239.255.255.250'
+GOVEE_SCAN_PORT = 4001
+
+# scan reply fields kept in the registry, besides the IP address
+REGISTRY_FIELDS = govee_local_codec.SCAN_FIELDS
+
+# key used for the registry inside the Polyglot custom data
+REGISTRY_KEY = 'deviceRegistry'
+
+# unicast sweep: default packet rate cap, largest range accepted, and how often
+# every address is swept (in between, only the hosts known to answer are)
+SWEEP_RATE = 200
+SWEEP_MAX_HOSTS = 65536
+FULL_SWEEP_INTERVAL = 3600
+
+'''
+GoveeLocalDiscovery
+Sends the Govee 'scan' request to the LAN multicast group and keeps a registry
+of every device that answers, keyed by MAC address (the 'device' field):
+
+    { mac: {'ip': ..., 'ipAliases': [...], 'sku': ..., 'bleVersionHard': ..., ...} }
+
+The registry is saved in the Polyglot custom data so nodes keep their binding
+across restarts and DHCP changes.  'onChange(mac, entry, previousIp)' is called
+whenever a device is first seen or its IP address moves.
+'''
+class GoveeLocalDiscovery:
+
+    def __init__(self, transport, customData, onChange=None):
+        self.transport = transport
+        self.customData = customData
+        self.onChange = onChange
+
+        self._lock = threading.Lock()
+        self._registry = {}
+        self._lastSeen = {}
+        self._lastScan: float = 0.0
+
+        transport.addListener('scan', self._handleScanReply)
+
+    '''
+    (Re)load the registry from the Polyglot custom data, keeping anything already
+    discovered during this run.  Returns how many devices were added.
+    '''
+    def loadRegistry(self):
+        stored = self.customData[REGISTRY_KEY]
+        if not(isinstance(stored, dict)):
+            return 0
+        loaded = 0
+        with self._lock:
+            for mac in stored:
+                if mac not in self._registry and isinstance(stored[mac], dict):
+                    self._registry[mac] = dict(stored[mac])
+                    loaded += 1
+        LOGGER.info('\n\tLoaded {} device(s) from the saved device registry.\n'.format(len(stored)))
+        return loaded
+
+    def saveRegistry(self):
+        with self._lock:
+            snapshot = {mac: dict(entry) for mac, entry in self._registry.items()}
+        self.customData[REGISTRY_KEY] = snapshot
+
+    '''
+    Multicast one 'scan' request; replies arrive asynchronously on the transport.
+    '''
+    def scan(self):
+        if not(self.transport.isRunning()):
+            return False
+        self._lastScan = time.monotonic()
+        LOGGER.info('\n\tSending LAN discovery scan to {}:{}.\n'.format(GOVEE_MULTICAST_ADDRESS, GOVEE_SCAN_PORT))
+        return self.transport.send(GOVEE_MULTICAST_ADDRESS, govee_local_codec.SCAN_REQUEST, GOVEE_SCAN_PORT)
+
+    '''
+    Rescan only if the last scan is older than 'interval' seconds.
+    '''
+    def scanIfDue(self, interval):
+        if time.monotonic() - self._lastScan >= interval:
+            return self.scan()
+        return False
+
+    '''
+    Seconds since the last scan was sent, or None if we haven't scanned yet.
+    '''
+    def lastScanAge(self):
+        if self._lastScan == 0.0:
+            return None
+        return time.monotonic() - self._lastScan
+
+    def devices(self):
+        with self._lock:
+            return {mac: dict(entry) for mac, entry in self._registry.items()}
+
+    def get(self, mac):
+        with self._lock:
+            entry = self._registry.get(mac)
+            return dict(entry) if entry is not None else None
+
+    def ipForMac(self, mac):
+        with self._lock:
+            entry = self._registry.get(mac)
+            return entry['ip'] if entry is not None else None
+
+    '''
+    Find the MAC for an IP address, including addresses a device has since moved away
+    from (so a hand-configured IP still finds its device after a DHCP change).
+    '''
+    def macForIp(self, ipAddress):
+        with self._lock:
+            for mac, entry in self._registry.items():
+                if entry['ip'] == ipAddress:
+                    return mac
+            for mac, entry in self._registry.items():
+                if ipAddress in entry.get('ipAliases', ()):
+                    return mac
+        return None
+
+    def lastSeen(self, mac):
+        return self._lastSeen.get(mac)
+
+    def _handleScanReply(self, sourceIp, cmd, data):
+        try:
+            mac, ipAddress, fields = govee_local_codec.decodeScan(data, sourceIp)
+        except govee_local_codec.CodecError as e:
+            HOTPATH_LOG.warning(('badScan', sourceIp), "\n\tDiscovery reply from '%s' ignored: %s\n", sourceIp, e)
+            return
+
+        with self._lock:
+            self._lastSeen[mac] = time.time()
+            entry = self._registry.get(mac)
+            previousIp = None if entry is None else entry['ip']
+
+            changed = entry is None or previousIp != ipAddress
+            newEntry = {'ip': ipAddress, 'ipAliases': [] if entry is None else list(entry.get('ipAliases', []))}
+            if previousIp is not None and previousIp != ipAddress and previousIp not in newEntry['ipAliases']:
+                newEntry['ipAliases'].append(previousIp)
+            for field in REGISTRY_FIELDS:
+                newEntry[field] = fields[field] if field in data or entry is None else entry.get(field, '')
+                if entry is not None and entry.get(field, '') != newEntry[field]:
+                    changed = True
+            self._registry[mac] = newEntry
+
+        if not(changed):
+            return
+
+        if previousIp is None:
+            LOGGER.warning('\n\tDiscovered new Govee device {} ({}) at {}.\n'.format(mac, newEntry['sku'], ipAddress))
+        elif previousIp != ipAddress:
+            LOGGER.warning('\n\tGovee device {} moved from {} to {}.\n'.format(mac, previousIp, ipAddress))
+
+        self.saveRegistry()
+        if self.onChange is not None and (previousIp is None or previousIp != ipAddress):
+            self.onChange(mac, dict(newEntry), previousIp)
+
+'''
+Parse ';' / ','-separated CIDR ranges (a bare IP address is a /32) into
+ipaddress networks, skipping (and logging) invalid or oversized entries.
+'''
+def parseSweepRanges(rangesParameter):
+    networks = []
+    if rangesParameter is None:
+        return networks
+    for spec in rangesParameter.replace(',', ';').split(';'):
+        spec = spec.strip()
+        if len(spec) == 0:
+            continue
+        try:
+            network = ipaddress.IPv4Network(spec, strict=False)
+        except ValueError as e:
+            LOGGER.warning('\n\tInvalid Sweep_Ranges entry {}: {}\n'.format(spec, e))
+            continue
+        if network.num_addresses > SWEEP_MAX_HOSTS:
+            LOGGER.warning('\n\tSweep_Ranges entry {} is larger than {} addresses; ignored.\n'.format(spec, SWEEP_MAX_HOSTS))
+            continue
+        networks.append(network)
+    return networks
+
+'''
+GoveeLocalSubnetSweep
+Finds lights that multicast can't reach (e.g. on another VLAN) by sending the
+'scan' request by unicast to every host in the configured CIDR ranges.  The
+requests go out on the transport's shared non-blocking socket at no more than
+'rate' packets per second; the replies come back through the same 'scan'
+listener as multicast discovery, so new devices and IP changes are merged into
+the discovery registry as they arrive.
+
+Sweeps are incremental: a quick sweep only probes the addresses in range that
+the registry already knows, while a full sweep probes those first and then
+every other host, and is due only every FULL_SWEEP_INTERVAL seconds.  Sweeps
+run on a background thread, one at a time.
+'''
+class GoveeLocalSubnetSweep:
+
+    def __init__(self, transport, discovery, rate=SWEEP_RATE):
+        self.transport = transport
+        self.discovery = discovery
+        self.rate = rate
+
+        self._lock = threading.Lock()
+        self._networks = []
+        self._thread = None
+        self._stopEvent = threading.Event()
+        self._lastQuick: float = 0.0
+        self._lastFull: float = 0.0
+
+        self.sent: int = 0
+        self.lastDuration: float = 0.0
+
+    '''
+    Set the ranges (see parseSweepRanges()) and packet rate; a change of ranges
+    makes a full sweep due right away.
+    '''
+    def configure(self, networks, rate=SWEEP_RATE):
+        with self._lock:
+            if networks != self._networks:
+                self._lastFull = 0.0
+            self._networks = list(networks)
+            self.rate = max(1, int(rate))
+
+    def isConfigured(self):
+        return len(self._networks) > 0
+
+    def isRunning(self):
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    '''
+    Start a full sweep if one is due, otherwise a quick one if 'interval' seconds
+    have passed since the last sweep.  Returns True if a sweep was started.
+    '''
+    def sweepIfDue(self, interval):
+        now = time.monotonic()
+        if self._lastFull == 0.0 or now - self._lastFull >= FULL_SWEEP_INTERVAL:
+            return self.sweep(True)
+        if now - max(self._lastQuick, self._lastFull) >= interval:
+            return self.sweep(False)
+        return False
+
+    def sweep(self, full=False):
+        with self._lock:
+            if len(self._networks) == 0 or not(self.transport.isRunning()) or self.isRunning():
+                return False
+            networks = list(self._networks)
+            if full:
+                self._lastFull = time.monotonic()
+            else:
+                self._lastQuick = time.monotonic()
+            self._stopEvent.clear()
+            self._thread = threading.Thread(target=self._sweep, args=(networks, full), name='GoveeLocalSweep', daemon=True)
+            self._thread.start()
+        return True
+
+    def stop(self):
+        self._stopEvent.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(2.0)
+
+    '''
+    Addresses to probe, in order: the registry's known addresses that fall in the
+    ranges, then (for a full sweep) every other host.
+    '''
+    def targets(self, networks, full):
+        known = []
+        for entry in self.discovery.devices().values():
+            try:
+                address = ipaddress.IPv4Address(entry['ip'])
+            except (ValueError, KeyError):
+                continue
+            if any([address in network for network in networks]) and str(address) not in known:
+                known.append(str(address))
+        if not(full):
+            return known
+
+        targets = list(known)
+        seen = set(known)
+        for network in networks:
+            hosts = network.hosts() if network.num_addresses > 2 else iter(network)
+            for host in hosts:
+                host = str(host)
+                if host not in seen:
+                    seen.add(host)
+                    targets.append(host)
+        return targets
+
+    def _sweep(self, networks, full):
+        targets = self.targets(networks, full)
+        started = time.monotonic()
+        LOGGER.info('\n\tSweeping {} address(es) ({} sweep) at up to {} packets/s.\n'.format(len(targets), 'full' if full else 'quick', self.rate))
+
+        interval = 1.0 / self.rate
+        for index, ipAddress in enumerate(targets):
+            # pace against the start time, so the rate cap holds without drifting
+            delay = started + index * interval - time.monotonic()
+            if delay > 0 and self._stopEvent.wait(delay):
+                break
+            if self.transport.send(ipAddress, govee_local_codec.SCAN_REQUEST, GOVEE_SCAN_PORT, False):
+                self.sent += 1
+
+        self.lastDuration = time.monotonic() - started
+        LOGGER.info('\n\tSweep of {} address(es) sent in {:.1f}s.\n'.format(len(targets), self.lastDuration))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import functools
+
+LOGGER = udi_interface.LOGGER
+
+'''
+GoveeLocalEventDispatcher
+The Polyglot interface starts one thread per subscriber for every event, so
+child nodes don't subscribe themselves: the dispatcher takes ADDNODEDONE once and
+routes it through an address -> node index to that node's node_queue(), and
+setting the completion event of anyone waiting on the node (see expect()).
+START is published per address by the interface, so each address gets a single
+subscription, made on its first register() and routed through the index, which
+then survives the node being removed and added again.
+'''
+class GoveeLocalEventDispatcher:
+
+    def __init__(self, polyglot):
+        self.poly = polyglot
+        self._lock = threading.Lock()
+        self._nodes = {}
+        self._events = {}
+        self._startSubscribed = set()
+
+        polyglot.subscribe(polyglot.ADDNODEDONE, self.addNodeDone)
+
+    '''
+    Route events for 'node.address' to 'node' (replacing any earlier node there).
+    '''
+    def register(self, node):
+        with self._lock:
+            self._nodes[node.address] = node
+            subscribe = node.address not in self._startSubscribed
+            self._startSubscribed.add(node.address)
+        if subscribe:
+            self.poly.subscribe(self.poly.START, functools.partial(self.startNode, node.address), node.address)
+
+    def unregister(self, address):
+        with self._lock:
+            self._nodes.pop(address, None)
+            self._events.pop(address, None)
+
+    def get(self, address):
+        return self._nodes.get(address)
+
+    '''
+    An Event that is set once Polyglot has finished adding 'address'.
+    '''
+    def expect(self, address):
+        event = threading.Event()
+        with self._lock:
+            self._events[address] = event
+        return event
+
+    def forget(self, address):
+        with self._lock:
+            self._events.pop(address, None)
+
+    def addNodeDone(self, data):
+        address = data.get('address')
+        with self._lock:
+            node = self._nodes.get(address)
+            event = self._events.pop(address, None)
+        if node is not None:
+            try:
+                node.node_queue(data)
+            except Exception as e:
+                LOGGER.error("\n\tADDNODEDONE handling for '{}' failed: {}\n".format(address, e))
+        if event is not None:
+            event.set()
+
+    def startNode(self, address):
+        node = self._nodes.get(address)
+        if node is not None:
+            node.start()
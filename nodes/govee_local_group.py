@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import zlib
+import time
+
+from nodes import govee_local_device
+from nodes import govee_local_commands
+from nodes import govee_local_codec
+from nodes import govee_local_logging
+
+LOGGER = udi_interface.LOGGER
+HOTPATH_LOG = govee_local_logging.HOTPATH_LOG
+
+# ST values of a group
+GROUP_ALL_OFF = 0
+GROUP_SOME_ON = 1
+GROUP_ALL_ON = 2
+
+'''
+Stable Polyglot node address for a group, derived from its name.
+'''
+def groupNodeAddress(name):
+    return 'gg{:08x}'.format(zlib.crc32(name.strip().lower().encode('utf-8')))
+
+'''
+Group node
+A set of lights (given by device node address, IP address or device name) that
+is controlled as one: a command is encoded once and sent to every member in one
+tight burst over the shared socket, and every member's state is updated together.
+ST reports all off / some on / all on, OL the average brightness of the members
+that are on, and GV0 the number of members found.
+'''
+class GoveeLocalGroup(udi_interface.Node):
+    id = 'goveeLocalGroup'
+    drivers = [
+            {'driver': 'ST', 'value': -1, 'uom': 25},
+            {'driver': 'OL', 'value': -1, 'uom': 51},
+            {'driver': 'GV0', 'value': -1, 'uom': 56}
+            ]
+
+    def __init__(self, polyglot, parent, address, name, memberSpecs, reporter=None, commandQueue=None, transitions=None):
+        super(GoveeLocalGroup, self).__init__(polyglot, parent, address, name)
+
+        self._initialized: bool = False
+        self._fullyCreated: bool = False
+
+        self.poly = polyglot
+        self.parent = parent
+        self.memberSpecs = list(memberSpecs)
+        self.reporter = reporter
+        self.commandQueue = commandQueue
+        self.transitions = transitions
+
+    '''
+    Called by the Controller's dispatcher once Polyglot has added this node.
+    '''
+    def node_queue(self, data):
+        self._fullyCreated = True
+        self.refresh()
+
+    def start(self):
+        self._initialized = True
+
+    '''
+    The member device nodes that currently exist, resolved from memberSpecs.
+    '''
+    def members(self):
+        nodes = self.poly.getNodes()
+        devices = [nodes[address] for address in nodes if isinstance(nodes[address], govee_local_device.GoveeLocalDevice)]
+        byName = {device.name.lower(): device for device in devices}
+        byIP = {device.ipAddress: device for device in devices}
+
+        members = []
+        for spec in self.memberSpecs:
+            device = nodes.get(spec)
+            if not(isinstance(device, govee_local_device.GoveeLocalDevice)):
+                device = byIP.get(spec) or byName.get(spec.lower())
+            if device is None:
+                HOTPATH_LOG.info(('missingMember', self.address, spec), "\n\tGroup '%s': member '%s' not found.\n", self.name, spec)
+            elif device not in members:
+                members.append(device)
+        return members
+
+    '''
+    Recompute the aggregate drivers from the members' cached state.
+    '''
+    def refresh(self):
+        members = self.members()
+        states = [member.stateCache.state for member in members if member.stateCache.state is not None]
+
+        onStates = [state for state in states if state.onOff]
+        if len(states) == 0:
+            aggregate = -1
+        elif len(onStates) == 0:
+            aggregate = GROUP_ALL_OFF
+        elif len(onStates) == len(states):
+            aggregate = GROUP_ALL_ON
+        else:
+            aggregate = GROUP_SOME_ON
+        brightness = int(round(sum([state.brightness for state in onStates]) / float(len(onStates)))) if len(onStates) > 0 else 0
+
+        self.setDriver('ST', aggregate, True, False)
+        self.setDriver('OL', brightness, True, False)
+        self.setDriver('GV0', len(members), True, False)
+
+    '''
+    Send one encoded command to every member at once, then apply the expected
+    state to all member caches and report it as one batch.
+    '''
+    def sendToMembers(self, kind, payload, **expectedFields):
+        members = self.members()
+        if len(members) == 0:
+            LOGGER.warning("\n\tGroup '" + self.name + "' has no members; '" + kind + "' not sent.\n")
+            return
+        if self.commandQueue is None:
+            LOGGER.warning("\n\tCOMMAND ERROR - no command queue for group '" + self.address + "'.\n")
+            return
+
+        if self.transitions is not None:
+            for member in members:
+                self.transitions.cancel(member.address)
+        self.commandQueue.sendNow([(member.address, member.ipAddress) for member in members], kind, payload)
+        for member in members:
+            member.applyExpected(False, **expectedFields)
+        if self.reporter is not None:
+            self.reporter.flush()
+        self.refresh()
+
+    '''
+    Start the same fade on every member; the fades share the engine's timer wheel,
+    so the members step together.
+    '''
+    def fadeMembers(self, duration, **targets):
+        members = self.members()
+        if len(members) == 0:
+            LOGGER.warning("\n\tGroup '" + self.name + "' has no members; fade not started.\n")
+            return
+        for member in members:
+            member.fadeTo(duration, **targets)
+        self.refresh()
+
+    '''
+    With a brightness, the members get it first and 'turn' one command gap later,
+    so they come on at the new level and no light gets two packets back to back.
+    '''
+    def cmdOn(self, command):
+        value = command.get('value')
+        if value is not None and len(str(value)) > 0:
+            brightness = govee_local_commands.parseBrightness(value)
+            self.sendToMembers('brightness', govee_local_codec.encodeBrightness(brightness), brightness=brightness)
+            if self.commandQueue is not None:
+                time.sleep(self.commandQueue.minGap)
+        self.sendToMembers('turn', govee_local_codec.encodeTurn(True), onOff=1)
+
+    def cmdOff(self, command):
+        self.sendToMembers('turn', govee_local_codec.encodeTurn(False), onOff=0)
+
+    def cmdBrightness(self, command):
+        brightness = govee_local_commands.parseBrightness(command.get('value'))
+        self.sendToMembers('brightness', govee_local_codec.encodeBrightness(brightness), brightness=brightness)
+
+    def cmdColorTemperature(self, command):
+        colorTemInKelvin = govee_local_commands.parseColorTemperature(command.get('value'))
+        self.sendToMembers('colorwc', govee_local_codec.encodeColor(0, 0, 0, colorTemInKelvin), colorTemInKelvin=colorTemInKelvin)
+
+    def cmdRGB(self, command):
+        red, green, blue = govee_local_commands.parseRGB(command.get('query', {}))
+        self.sendToMembers('colorwc', govee_local_codec.encodeColor(red, green, blue), colorTemInKelvin=0, red=red, green=green, blue=blue)
+
+    def cmdFade(self, command):
+        values = govee_local_commands.queryValues(command.get('query', {}))
+        brightness = max(0, min(100, int(float(values.get('OL', 0)))))
+        self.fadeMembers(govee_local_commands.parseDuration(values.get('D', 0)), brightness=brightness)
+
+    def cmdFadeColorTemperature(self, command):
+        values = govee_local_commands.queryValues(command.get('query', {}))
+        colorTemInKelvin = govee_local_commands.parseColorTemperature(values.get('K', 2000))
+        self.fadeMembers(govee_local_commands.parseDuration(values.get('D', 0)), colorTemInKelvin=colorTemInKelvin)
+
+    def cmdFadeRGB(self, command):
+        query = command.get('query', {})
+        values = govee_local_commands.queryValues(query)
+        rgb = govee_local_commands.parseRGB({key: query[key] for key in query if not(key.startswith('D.'))})
+        self.fadeMembers(govee_local_commands.parseDuration(values.get('D', 0)), rgb=rgb)
+
+    def cmdQuery(self, command):
+        controller = self.poly.getNode(self.parent)
+        if controller is not None:
+            for member in self.members():
+                controller.scheduler.pollSoon(member.address, 0)
+
+    commands = {
+                'DON': cmdOn,
+                'DOF': cmdOff,
+                'SETBRI': cmdBrightness,
+                'SETCT': cmdColorTemperature,
+                'SETRGB': cmdRGB,
+                'FADE': cmdFade,
+                'FADECT': cmdFadeColorTemperature,
+                'FADERGB': cmdFadeRGB,
+                'QUERY': cmdQuery
+               }
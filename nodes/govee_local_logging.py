@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import collections
+import datetime
+import logging
+import time
+
+LOGGER = udi_interface.LOGGER
+
+# a rate limited message is logged at most once per key in this many seconds
+LOG_INTERVAL = 300.0
+
+# UDP exchanges kept per device for dumpTrace()
+TRACE_DEPTH = 64
+
+'''
+RateLimitedLog
+For messages on the poll / report paths, which can repeat for every device on
+every cycle.  Messages use logging's deferred '%s' formatting, nothing at all is
+done when the level is disabled, and each message key ('key' is any hashable,
+e.g. ('noReply', address)) is logged at most once per 'interval' seconds, with a
+count of how many were suppressed in between.  sample() logs only every Nth
+message of a key instead.
+'''
+class RateLimitedLog:
+
+    def __init__(self, logger=LOGGER, interval=LOG_INTERVAL):
+        self.logger = logger
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._keys = {}
+
+    def log(self, level, key, message, *args):
+        if not(self.logger.isEnabledFor(level)):
+            return False
+        now = time.monotonic()
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is not None and now - entry[0] < self.interval:
+                entry[1] += 1
+                return False
+            suppressed = entry[1] if entry is not None else 0
+            self._keys[key] = [now, 0]
+        if suppressed > 0:
+            message = message.rstrip('\n') + ' (%d similar message(s) suppressed)\n'
+            args = args + (suppressed,)
+        self.logger.log(level, message, *args)
+        return True
+
+    '''
+    Log only the first, then every 'every'th, message of 'key'.
+    '''
+    def sample(self, level, key, every, message, *args):
+        if not(self.logger.isEnabledFor(level)):
+            return False
+        with self._lock:
+            entry = self._keys.setdefault(key, [0.0, 0])
+            entry[1] += 1
+            if (entry[1] - 1) % every != 0:
+                return False
+        self.logger.log(level, message, *args)
+        return True
+
+    def debug(self, key, message, *args):
+        return self.log(logging.DEBUG, key, message, *args)
+
+    def info(self, key, message, *args):
+        return self.log(logging.INFO, key, message, *args)
+
+    def warning(self, key, message, *args):
+        return self.log(logging.WARNING, key, message, *args)
+
+    def error(self, key, message, *args):
+        return self.log(logging.ERROR, key, message, *args)
+
+# shared by every module
+HOTPATH_LOG = RateLimitedLog()
+
+'''
+UdpTraceBuffer
+The last TRACE_DEPTH datagrams sent to / received from each device, kept raw (a
+timestamp, a direction and the bytes) so recording costs an append; nothing is
+formatted until dump() writes them out.
+'''
+class UdpTraceBuffer:
+
+    def __init__(self, depth=TRACE_DEPTH):
+        self.depth = depth
+        self.enabled: bool = True
+        self._rings = {}
+
+    def record(self, ipAddress, direction, payload):
+        if not(self.enabled):
+            return
+        ring = self._rings.get(ipAddress)
+        if ring is None:
+            ring = self._rings.setdefault(ipAddress, collections.deque(maxlen=self.depth))
+        ring.append((time.time(), direction, bytes(payload)))
+
+    def clear(self):
+        self._rings = {}
+
+    '''
+    Write every device's exchanges to 'path', oldest first; 'labels' optionally
+    maps IP addresses to node addresses.  Returns the number of datagrams written.
+    Safe to call while the receive thread records: it works on a snapshot.
+    '''
+    def dump(self, path, labels=None):
+        labels = labels or {}
+        count = 0
+        # record() can add a device's ring while we write, so iterate over a copy
+        rings = sorted(list(self._rings.items()))
+        with open(path, 'w') as traceFile:
+            for ipAddress, ring in rings:
+                traceFile.write('# {} {}\n'.format(ipAddress, labels.get(ipAddress, '')))
+                for sent, direction, payload in list(ring):
+                    timestamp = datetime.datetime.fromtimestamp(sent).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+                    traceFile.write('{} {} {}\n'.format(timestamp, direction, payload.decode('utf-8', 'replace')))
+                    count += 1
+        return count
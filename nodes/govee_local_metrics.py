@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import bisect
+import json
+import os
+import time
+
+LOGGER = udi_interface.LOGGER
+
+# upper bounds (milliseconds) of the latency histogram buckets; the last bucket is open ended
+BUCKET_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+'''
+LatencyHistogram
+Fixed, log-spaced buckets: recording is a bisect and an increment, and percentiles
+are approximated by the upper bound of the bucket they fall in.
+'''
+class LatencyHistogram:
+    __slots__ = ('counts', 'count', 'total')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds):
+        milliseconds = seconds * 1000.0
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_MS, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+
+    '''
+    Approximate percentile in milliseconds (0.0 if nothing was recorded).
+    '''
+    def percentile(self, fraction):
+        if self.count == 0:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for i in range(0, len(self.counts)):
+            seen += self.counts[i]
+            if seen >= target:
+                return float(BUCKET_BOUNDS_MS[i]) if i < len(BUCKET_BOUNDS_MS) else float(BUCKET_BOUNDS_MS[-1] * 2)
+        return float(BUCKET_BOUNDS_MS[-1] * 2)
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def merge(self, other):
+        for i in range(0, len(self.counts)):
+            self.counts[i] += other.counts[i]
+        self.count += other.count
+        self.total += other.total
+
+    def toDict(self):
+        return {
+            'count': self.count,
+            'meanMs': round(self.mean(), 2),
+            'p50Ms': self.percentile(0.5),
+            'p99Ms': self.percentile(0.99),
+            'buckets': dict(zip([str(bound) for bound in BUCKET_BOUNDS_MS] + ['inf'], self.counts))
+        }
+
+'''
+Counters for one device.  'roundTrip' covers the current window (see
+GoveeLocalMetrics.rotate()); the counters are lifetime totals.
+'''
+class DeviceMetrics:
+    __slots__ = ('roundTrip', 'commandConfirm', 'polls', 'replies', 'timeouts', 'malformed', 'commands', 'commandSentAt')
+
+    def __init__(self):
+        self.roundTrip = LatencyHistogram()
+        self.commandConfirm = LatencyHistogram()
+        self.polls = 0
+        self.replies = 0
+        self.timeouts = 0
+        self.malformed = 0
+        self.commands = 0
+        self.commandSentAt = None
+
+'''
+GoveeLocalMetrics
+Per-device and fleet-wide instrumentation: request/response round trips,
+timeouts and malformed replies, command-to-confirmation latency (command packet
+sent -> next good devStatus reply) and report pipeline latency to IoX.  The
+latency histograms cover one window (rotated with each snapshot), so the p99
+values reflect recent conditions; counters are totals since start.
+'''
+class GoveeLocalMetrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._devices = {}
+        self.reportLatency = LatencyHistogram()
+        self.windowStarted = time.time()
+        self.started = time.time()
+
+    def _device(self, address):
+        device = self._devices.get(address)
+        if device is None:
+            device = DeviceMetrics()
+            self._devices[address] = device
+        return device
+
+    def forget(self, address):
+        with self._lock:
+            self._devices.pop(address, None)
+
+    def recordRoundTrip(self, address, seconds):
+        with self._lock:
+            self._device(address).roundTrip.record(seconds)
+
+    '''
+    Result of one poll: 'replied' is False on a timeout, 'valid' False for a malformed reply.
+    '''
+    def recordPoll(self, address, replied, valid=True):
+        with self._lock:
+            device = self._device(address)
+            device.polls += 1
+            if not(replied):
+                device.timeouts += 1
+                return
+            device.replies += 1
+            if not(valid):
+                device.malformed += 1
+                return
+            if device.commandSentAt is not None:
+                device.commandConfirm.record(time.monotonic() - device.commandSentAt)
+                device.commandSentAt = None
+
+    '''
+    A reply that arrived after its poll was recorded as a timeout (the probe of an
+    offline light): count that poll as answered after all.
+    '''
+    def recordLateReply(self, address, valid=True):
+        with self._lock:
+            device = self._device(address)
+            if device.timeouts > 0:
+                device.timeouts -= 1
+            else:
+                device.polls += 1
+            device.replies += 1
+            if not(valid):
+                device.malformed += 1
+
+    def recordCommand(self, address):
+        with self._lock:
+            device = self._device(address)
+            device.commands += 1
+            device.commandSentAt = time.monotonic()
+
+    def recordReportLatency(self, seconds):
+        with self._lock:
+            self.reportLatency.record(seconds)
+
+    '''
+    Worst per-device p99 round trip (milliseconds) in the current window.
+    '''
+    def worstP99(self):
+        with self._lock:
+            return max([device.roundTrip.percentile(0.99) for device in self._devices.values()], default=0.0)
+
+    '''
+    Percentage of polls answered (valid or not) in the lifetime of the node server.
+    '''
+    def replyRate(self):
+        with self._lock:
+            polls = sum([device.polls for device in self._devices.values()])
+            replies = sum([device.replies for device in self._devices.values()])
+        return round(100.0 * replies / polls, 1) if polls > 0 else 0.0
+
+    def snapshot(self, extra=None):
+        with self._lock:
+            fleetRoundTrip = LatencyHistogram()
+            fleetConfirm = LatencyHistogram()
+            devices = {}
+            for address, device in self._devices.items():
+                fleetRoundTrip.merge(device.roundTrip)
+                fleetConfirm.merge(device.commandConfirm)
+                devices[address] = {
+                    'polls': device.polls,
+                    'replies': device.replies,
+                    'timeouts': device.timeouts,
+                    'malformed': device.malformed,
+                    'commands': device.commands,
+                    'roundTrip': device.roundTrip.toDict(),
+                    'commandConfirm': device.commandConfirm.toDict()
+                }
+            snapshot = {
+                'time': int(time.time()),
+                'uptime': int(time.time() - self.started),
+                'windowSeconds': int(time.time() - self.windowStarted),
+                'fleet': {
+                    'devices': len(devices),
+                    'polls': sum([d['polls'] for d in devices.values()]),
+                    'timeouts': sum([d['timeouts'] for d in devices.values()]),
+                    'malformed': sum([d['malformed'] for d in devices.values()]),
+                    'roundTrip': fleetRoundTrip.toDict(),
+                    'commandConfirm': fleetConfirm.toDict(),
+                    'reportLatency': self.reportLatency.toDict()
+                },
+                'devices': devices
+            }
+        if extra is not None:
+            snapshot['fleet'].update(extra)
+        return snapshot
+
+    '''
+    Start a new latency window.
+    '''
+    def rotate(self):
+        with self._lock:
+            for device in self._devices.values():
+                device.roundTrip = LatencyHistogram()
+                device.commandConfirm = LatencyHistogram()
+            self.reportLatency = LatencyHistogram()
+            self.windowStarted = time.time()
+
+    '''
+    Write snapshot() to 'path' as JSON (atomically, via a temporary file).
+    '''
+    def writeSnapshot(self, path, extra=None):
+        snapshot = self.snapshot(extra)
+        temporaryPath = path + '.tmp'
+        try:
+            with open(temporaryPath, 'w') as snapshotFile:
+                json.dump(snapshot, snapshotFile, separators=(',', ':'))
+            os.replace(temporaryPath, path)
+        except OSError as e:
+            LOGGER.error('\n\tUnable to write metrics snapshot to {}: {}\n'.format(path, e))
+        return snapshot
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import os
+
+'''
+The NodeServer's data directory: where Polyglot installed it (the directory of
+govee_local_root_nodeserver.py), whatever the current working directory is.
+Every file the NodeServer writes (warm-start journal, scenes, metrics snapshots,
+UDP traces and profiling results) goes under it.
+'''
+DATA_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+'''
+Absolute path of 'name' (one or more path components) in the data directory.
+'''
+def dataPath(*name):
+    return os.path.join(DATA_DIRECTORY, *name)
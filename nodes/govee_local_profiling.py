@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import collections
+import datetime
+import cProfile
+import pstats
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+from nodes import govee_local_paths
+
+LOGGER = udi_interface.LOGGER
+
+PROFILE_DIRECTORY = govee_local_paths.dataPath('profiles')
+
+PROFILE_MODES = ('cprofile', 'sample', 'memory')
+
+# sampling profiler period, in seconds
+SAMPLE_INTERVAL = 0.01
+# frames kept per tracemalloc traceback
+MEMORY_FRAMES = 10
+# lines in the text reports
+REPORT_LINES = 30
+
+'''
+Approximate memory held by one object graph (e.g. a node), counting every
+reachable object once and stopping at modules, classes and functions.
+'''
+def deepSize(root, seen=None):
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [root]
+    while len(stack) > 0:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, type(sys), type(deepSize))):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj, 0)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+            stack.extend(obj)
+        if hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+        for slot in getattr(type(obj), '__slots__', ()):
+            if hasattr(obj, slot):
+                stack.append(getattr(obj, slot))
+    return size
+
+'''
+GoveeLocalProfiler
+Runtime profiling of the poll, parse and report paths, started and stopped from
+the Controller.  Those paths call their 'profileHook' only while profiling is on
+(otherwise the hook is None and the cost is one attribute check); the hook is
+call().  Modes:
+
+    cprofile - deterministic cProfile of the hooked calls; cProfile can only be
+               enabled once at a time, so a call made while another is being
+               profiled runs unprofiled
+    sample   - a background thread samples every thread's stack each SAMPLE_INTERVAL
+               and counts the folded stacks (flame graph input)
+    memory   - tracemalloc, with a snapshot (and the growth since the previous one)
+               on every snapshotMemory() and at stop()
+
+Results are written as timestamped files under PROFILE_DIRECTORY; stop() and
+snapshotMemory() return a one-line summary for the controller's GPV driver.
+'''
+class GoveeLocalProfiler:
+
+    def __init__(self, directory=PROFILE_DIRECTORY):
+        self.directory = directory
+        self.mode = None
+        self.started: float = 0.0
+
+        self._lock = threading.Lock()
+        self._profile = None
+        self._profileLock = threading.Lock()
+        self._profiledCalls: int = 0
+        self._stacks = collections.Counter()
+        self._samples: int = 0
+        self._sampler = None
+        self._stopEvent = threading.Event()
+        self._lastSnapshot = None
+
+    def isActive(self):
+        return self.mode is not None
+
+    def start(self, mode):
+        if mode not in PROFILE_MODES:
+            raise ValueError('unknown profiling mode: {}'.format(mode))
+        if self.mode is not None:
+            self.stop()
+
+        with self._lock:
+            self._profile = cProfile.Profile() if mode == 'cprofile' else None
+            self._profiledCalls = 0
+            self._stacks = collections.Counter()
+            self._samples = 0
+        self.started = time.time()
+        self.mode = mode
+
+        if mode == 'sample':
+            self._stopEvent.clear()
+            self._sampler = threading.Thread(target=self._sample, name='GoveeLocalSampler', daemon=True)
+            self._sampler.start()
+        elif mode == 'memory':
+            if not(tracemalloc.is_tracing()):
+                tracemalloc.start(MEMORY_FRAMES)
+            self._lastSnapshot = None
+        LOGGER.warning('\n\tProfiling started ({}).\n'.format(mode))
+
+    '''
+    Stop profiling, write the results and return a short summary ('' if it wasn't on).
+    '''
+    def stop(self, nodes=None):
+        mode = self.mode
+        if mode is None:
+            return ''
+        self.mode = None
+
+        try:
+            if mode == 'cprofile':
+                return self._writeProfile()
+            if mode == 'sample':
+                self._stopEvent.set()
+                if self._sampler is not None:
+                    self._sampler.join(2.0)
+                    self._sampler = None
+                return self._writeSamples()
+            summary = self._writeMemory(nodes)
+            tracemalloc.stop()
+            self._lastSnapshot = None
+            return summary
+        except OSError as e:
+            LOGGER.error('\n\tUnable to write profiling results to {}: {}\n'.format(self.directory, e))
+            return 'Unable to write profile'
+
+    '''
+    The profileHook: run fn(*args), profiled if cProfile is on.
+    '''
+    def call(self, name, fn, *args):
+        profile = self._profile
+        if self.mode != 'cprofile' or profile is None or not(self._profileLock.acquire(False)):
+            return fn(*args)
+        try:
+            self._profiledCalls += 1
+            profile.enable()
+            try:
+                return fn(*args)
+            finally:
+                profile.disable()
+        finally:
+            self._profileLock.release()
+
+    '''
+    Write a tracemalloc snapshot while memory profiling is on (e.g. every long
+    poll); returns the summary, or '' if memory profiling is off.
+    '''
+    def snapshotMemory(self, nodes=None):
+        if self.mode != 'memory':
+            return ''
+        try:
+            return self._writeMemory(nodes)
+        except OSError as e:
+            LOGGER.error('\n\tUnable to write memory snapshot to {}: {}\n'.format(self.directory, e))
+            return 'Unable to write memory snapshot'
+
+    def _path(self, kind, extension):
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, '{}_{}.{}'.format(kind, datetime.datetime.now().strftime('%Y%m%d_%H%M%S'), extension))
+
+    def _writeProfile(self):
+        # wait for a call still being profiled
+        with self._profileLock:
+            profile = self._profile
+            self._profile = None
+        seconds = time.time() - self.started
+        if profile is None or self._profiledCalls == 0:
+            return 'cProfile {:.0f}s: no calls profiled'.format(seconds)
+
+        stats = pstats.Stats(profile)
+        statsPath = self._path('cprofile', 'pstats')
+        stats.dump_stats(statsPath)
+
+        text = io.StringIO()
+        stats.stream = text
+        stats.sort_stats('cumulative').print_stats(REPORT_LINES)
+        with open(statsPath[:-len('pstats')] + 'txt', 'w') as textFile:
+            textFile.write(text.getvalue())
+
+        # the hottest function of our own by total (self) time
+        top = None
+        for (filename, lineno, function), (primitive, calls, totalTime, cumulativeTime, callers) in stats.stats.items():
+            if 'nodes' in filename and (top is None or totalTime > top[1]):
+                top = (function, totalTime, calls)
+        LOGGER.warning('\n\tcProfile results written to {}.\n'.format(statsPath))
+        if top is None:
+            return 'cProfile {:.0f}s: {} calls'.format(seconds, stats.total_calls)
+        return 'cProfile {:.0f}s: {} calls, top {} {:.0f}us in {} calls'.format(seconds, stats.total_calls, top[0], top[1] * 1000000.0, top[2])
+
+    def _sample(self):
+        ownId = threading.get_ident()
+        while not(self._stopEvent.wait(SAMPLE_INTERVAL)):
+            for threadId, frame in sys._current_frames().items():
+                if threadId == ownId:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                stack.reverse()
+                self._stacks[';'.join(stack)] += 1
+            self._samples += 1
+
+    def _writeSamples(self):
+        seconds = time.time() - self.started
+        if self._samples == 0:
+            return 'Sampling {:.0f}s: no samples'.format(seconds)
+        path = self._path('samples', 'folded')
+        with open(path, 'w') as foldedFile:
+            for stack, count in self._stacks.most_common():
+                foldedFile.write('{} {}\n'.format(stack, count))
+
+        # busiest leaf function of our own, ignoring threads waiting in the standard library
+        leaves = collections.Counter()
+        for stack, count in self._stacks.items():
+            ours = [frame for frame in stack.split(';') if frame.startswith('govee_local_')]
+            if len(ours) > 0:
+                leaves[ours[-1]] += count
+        LOGGER.warning('\n\tSampling profile written to {}.\n'.format(path))
+        if len(leaves) == 0:
+            return 'Sampling {:.0f}s: {} samples'.format(seconds, self._samples)
+        leaf, count = leaves.most_common(1)[0]
+        return 'Sampling {:.0f}s: {} samples, top {} {:.0f}%'.format(seconds, self._samples, leaf, 100.0 * count / self._samples)
+
+    def _writeMemory(self, nodes):
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>')))
+        path = self._path('memory', 'txt')
+        traced = sum([statistic.size for statistic in snapshot.statistics('filename')])
+
+        # per node, without what the nodes share (polyglot, reporters, queues, ...)
+        nodeSizes = {}
+        if nodes is not None:
+            references = collections.Counter([id(value) for node in nodes for value in vars(node).values()])
+            shared = set([reference for reference, count in references.items() if count > 1])
+            for node in nodes:
+                nodeSizes[node.address] = deepSize(node, set(shared) | set([id(getattr(node, 'poly', None))]))
+
+        with open(path, 'w') as memoryFile:
+            memoryFile.write('traced: {} bytes\n\n# top allocations by line\n'.format(traced))
+            for statistic in snapshot.statistics('lineno')[:REPORT_LINES]:
+                memoryFile.write('{}\n'.format(statistic))
+            if self._lastSnapshot is not None:
+                memoryFile.write('\n# growth since the previous snapshot\n')
+                for difference in snapshot.compare_to(self._lastSnapshot, 'lineno')[:REPORT_LINES]:
+                    memoryFile.write('{}\n'.format(difference))
+            if len(nodeSizes) > 0:
+                memoryFile.write('\n# approximate size per node (bytes)\n')
+                for address in sorted(nodeSizes, key=nodeSizes.get, reverse=True):
+                    memoryFile.write('{} {}\n'.format(address, nodeSizes[address]))
+        self._lastSnapshot = snapshot
+
+        LOGGER.warning('\n\tMemory snapshot written to {}.\n'.format(path))
+        summary = 'Memory: {:.0f} KB traced'.format(traced / 1024.0)
+        if len(nodeSizes) > 0:
+            summary += ', {:.0f} bytes per node'.format(sum(nodeSizes.values()) / float(len(nodeSizes)))
+        return summary
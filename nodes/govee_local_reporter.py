@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import collections
+import time
+import http.client
+import base64
+
+from nodes import govee_local_logging
+
+LOGGER = udi_interface.LOGGER
+HOTPATH_LOG = govee_local_logging.HOTPATH_LOG
+
+# flush as soon as this many driver updates are waiting...
+REPORT_BATCH_SIZE = 100
+# ...or this many seconds after the first one was queued
+REPORT_BATCH_DELAY = 0.25
+
+# most reports waiting for the ISY before the oldest are dropped
+ISY_QUEUE_SIZE = 500
+# persistent keep-alive connections (one worker thread each)
+ISY_POOL_SIZE = 2
+ISY_TIMEOUT = 5.0
+
+'''
+GoveeLocalReportAggregator
+Collects the driver updates produced by every node during a poll cycle and sends
+them to Polyglot as a few batched {'set': [...]} 'status' messages instead of one
+message per driver per node.  A later update to the same address / driver replaces
+the queued one, so only the final value of a cycle is sent.
+'''
+class GoveeLocalReportAggregator:
+
+    def __init__(self, polyglot, batchSize=REPORT_BATCH_SIZE, batchDelay=REPORT_BATCH_DELAY):
+        self.poly = polyglot
+        self.batchSize = batchSize
+        self.batchDelay = batchDelay
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+        self._firstQueuedAt: float = 0.0
+
+        self.messagesSent: int = 0
+        self.updatesSent: int = 0
+        # optional callback(seconds) with how long each flushed batch waited
+        self.latencyHook = None
+        # set only while profiling: callback(name, fn, *args) that runs fn(*args)
+        self.profileHook = None
+
+    '''
+    Queue one driver update; 'text' is only included when given (PG3x).
+    '''
+    def add(self, address, driver, value, uom, text=None):
+        entry = {
+            'address': address,
+            'driver': driver,
+            'value': value,
+            'uom': uom
+        }
+        if text is not None:
+            entry['text'] = text
+
+        with self._lock:
+            if len(self._pending) == 0:
+                self._firstQueuedAt = time.monotonic()
+            self._pending[(address, driver)] = entry
+            full = len(self._pending) >= self.batchSize
+            if not(full) and self._timer is None:
+                self._timer = threading.Timer(self.batchDelay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if full:
+            self.flush()
+
+    '''
+    Send everything queued, at most 'batchSize' updates per message.
+    '''
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            entries = list(self._pending.values())
+            self._pending = {}
+            firstQueuedAt = self._firstQueuedAt
+
+        if len(entries) == 0:
+            return
+        if self.latencyHook is not None:
+            self.latencyHook(time.monotonic() - firstQueuedAt)
+
+        if self.profileHook is not None:
+            self.profileHook('report', self._send, entries)
+        else:
+            self._send(entries)
+
+    def _send(self, entries):
+        for start in range(0, len(entries), self.batchSize):
+            batch = entries[start:start + self.batchSize]
+            try:
+                self.poly.send({'set': batch}, 'status')
+                self.messagesSent += 1
+                self.updatesSent += len(batch)
+            except Exception as e:
+                LOGGER.error('\n\tPUSHING REPORT ERROR - batched status message of {} update(s) failed: {}\n'.format(len(batch), e))
+
+    def pendingCount(self):
+        with self._lock:
+            return len(self._pending)
+
+'''
+GoveeLocalISYReporter
+The PG3 (non-PG3x) fallback for <text /> drivers: reports go to the ISY's REST
+interface.  Instead of building the auth header and opening a new connection
+for every report on the poll thread, reports are put on a bounded queue and
+drained by a small pool of workers, each holding a keep-alive connection that is
+reopened automatically after an error.
+
+Queued reports for the same address / driver coalesce to the latest text.  Since
+IoX only takes a report when the value changes, the reporter alternates the 0/1
+value itself from the last value it actually sent.  A key is sent by one worker
+at a time: a report queued while the previous one for the same key is still in
+flight waits for it, so the ISY always gets them in order.
+'''
+class GoveeLocalISYReporter:
+
+    def __init__(self, polyglot, isy, poolSize=ISY_POOL_SIZE, queueSize=ISY_QUEUE_SIZE):
+        self.poly = polyglot
+        self.ISY = isy
+        self.poolSize = poolSize
+        self.queueSize = queueSize
+
+        self._cond = threading.Condition()
+        self._pending = collections.OrderedDict()
+        self._lastSent = {}
+        self._inFlight = set()
+        self._workers = []
+        self._running: bool = False
+
+        self._preparedFor = None
+        self._headers = None
+        self._urlPrefix = None
+
+        self.sent: int = 0
+        self.failed: int = 0
+        self.dropped: int = 0
+        self.coalesced: int = 0
+        self.lastLatency: float = 0.0
+        self.averageLatency: float = 0.0
+        self.maxLatency: float = 0.0
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            for i in range(0, self.poolSize):
+                worker = threading.Thread(target=self._worker, name='GoveeLocalISYReporter-{}'.format(i), daemon=True)
+                self._workers.append(worker)
+                worker.start()
+
+    '''
+    Stop the workers once the queue has been drained (or 'timeout' expires).
+    '''
+    def stop(self, timeout=5.0):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+    '''
+    Queue a text report; never blocks on the ISY.
+    '''
+    def enqueue(self, address, driver, value, encodedText):
+        key = (address, driver)
+        with self._cond:
+            if key in self._pending:
+                self.coalesced += 1
+                value = self._pending[key][0]
+            elif len(self._pending) >= self.queueSize:
+                self._pending.popitem(last=False)
+                self.dropped += 1
+            self._pending[key] = (value, encodedText, time.monotonic())
+            self._cond.notify()
+
+    def queueDepth(self):
+        with self._cond:
+            return len(self._pending)
+
+    '''
+    Counters for monitoring; latencies are in milliseconds.
+    '''
+    def stats(self):
+        return {
+            'queueDepth': self.queueDepth(),
+            'sent': self.sent,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'lastLatencyMs': round(self.lastLatency * 1000, 1),
+            'averageLatencyMs': round(self.averageLatency * 1000, 1),
+            'maxLatencyMs': round(self.maxLatency * 1000, 1)
+        }
+
+    '''
+    Compute the auth header and URL prefix once, and again only if the ISY details change.
+    '''
+    def _prepare(self):
+        isyDetails = (self.ISY._isy_ip, self.ISY._isy_port, self.ISY._isy_user, self.ISY._isy_pass, self.poly.profileNum)
+        if isyDetails == self._preparedFor:
+            return True
+        if len(self.ISY._isy_ip) <= 0:
+            return False
+
+        userpassword = self.ISY._isy_user + ":" + self.ISY._isy_pass
+        userpasswordAsBase64String = base64.b64encode(userpassword.encode("ascii")).decode("ascii")
+        self._headers = {
+            "Authorization": "Basic " + userpasswordAsBase64String,
+            "Connection": "keep-alive"
+        }
+        prefixN = 'n{:03d}_'.format(int(self.poly.profileNum))
+        self._urlPrefix = '/rest/ns/' + str(self.poly.profileNum) + '/nodes/' + prefixN
+        self._preparedFor = isyDetails
+        return True
+
+    '''
+    The oldest queued key no other worker is sending right now (None if there isn't one).
+    '''
+    def _nextKey(self):
+        for key in self._pending:
+            if key not in self._inFlight:
+                return key
+        return None
+
+    def _worker(self):
+        connection = None
+        while True:
+            with self._cond:
+                key = self._nextKey()
+                while key is None and (self._running or len(self._pending) > 0):
+                    self._cond.wait()
+                    key = self._nextKey()
+                if key is None:
+                    break
+                value, encodedText, queuedAt = self._pending.pop(key)
+                if key in self._lastSent:
+                    value = 1 - self._lastSent[key]
+                self._lastSent[key] = value
+                self._inFlight.add(key)
+
+            try:
+                connection = self._report(connection, key[0], key[1], value, encodedText, queuedAt)
+            finally:
+                with self._cond:
+                    self._inFlight.discard(key)
+                    self._cond.notify_all()
+
+        if connection is not None:
+            connection.close()
+
+    def _report(self, connection, address, driver, value, encodedText, queuedAt):
+        if self.ISY.unauthorized:
+            HOTPATH_LOG.warning('isyUnauthorized', "\n\tPUSHING REPORT ERROR on '%s' for driver %s: looks like this is a PG3 install but the ISY authorization state seems to currently be 'Unauthorized': 'True'.\n", address, driver)
+            self.failed += 1
+            return connection
+        if not(self._prepare()):
+            self.failed += 1
+            return connection
+
+        suffixURL = self._urlPrefix + address + '/report/status/' + driver + '/' + str(value) + '/56/text/' + encodedText
+
+        # one retry on a fresh connection, in case the keep-alive connection was dropped by the ISY
+        for attempt in range(0, 2):
+            if connection is None:
+                connection = http.client.HTTPConnection(self.ISY._isy_ip, self.ISY._isy_port, timeout=ISY_TIMEOUT)
+            try:
+                connection.request("GET", suffixURL, '', self._headers)
+                localResponseData = connection.getresponse().read().decode("utf-8")
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                connection = None
+                if attempt == 0:
+                    continue
+                HOTPATH_LOG.error(('isyError', address), "\n\t\tPUSHING REPORT ERROR on '%s' for driver %s had an ERROR: %s\n", address, driver, e)
+                self.failed += 1
+                return connection
+
+            latency = time.monotonic() - queuedAt
+            self.lastLatency = latency
+            self.averageLatency = latency if self.sent == 0 else (self.averageLatency * 0.9 + latency * 0.1)
+            self.maxLatency = max(self.maxLatency, latency)
+            self.sent += 1
+
+            if '<status>200</status>' not in localResponseData:
+                HOTPATH_LOG.warning(('isyStatus', address), "\n\t\tPUSHING REPORT ERROR on '%s' for driver %s: RESPONSE from report was not '<status>200</status>' as expected:\n\t\t\t%s\n", address, driver, localResponseData)
+            return connection
+
+        return connection
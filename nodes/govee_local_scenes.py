@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import json
+import os
+import time
+
+from nodes import govee_local_state
+from nodes import govee_local_codec
+from nodes import govee_local_paths
+
+LOGGER = udi_interface.LOGGER
+
+SCENES_FILE = govee_local_paths.dataPath('govee_local_scenes.json')
+SCENES_FORMAT = 1
+
+# send / verify rounds before a light is given up on
+RESTORE_ATTEMPTS = 3
+# deadline for the devStatus round that verifies a restore
+VERIFY_TIMEOUT = 1.5
+
+'''
+Snapshot of every light whose state is known: {address: GoveeDeviceState}.
+'devices' are device nodes (anything with 'address' and a 'stateCache').
+'''
+def captureSnapshot(devices):
+    snapshot = {}
+    for device in devices:
+        if device.stateCache.state is not None:
+            snapshot[device.address] = device.stateCache.state.copy()
+    return snapshot
+
+'''
+Compact on-disk form of a snapshot: {address: [onOff, brightness, kelvin, r, g, b]}.
+'''
+def encodeSnapshot(snapshot):
+    return {address: [state.onOff, state.brightness, state.colorTemInKelvin, state.red, state.green, state.blue] for address, state in snapshot.items()}
+
+def decodeSnapshot(lights):
+    return {address: govee_local_state.GoveeDeviceState(*[int(value) for value in values[0:6]]) for address, values in lights.items()}
+
+'''
+The (kind, payload) commands that take a light from 'current' (None if unknown)
+to 'target', in sending order; empty if nothing differs.  A light that should be
+off is only turned off - its color is left alone.
+'''
+def restoreCommands(target, current):
+    if not(target.onOff):
+        if current is None or current.onOff:
+            return [('turn', govee_local_codec.encodeTurn(False))]
+        return []
+
+    commands = []
+    if current is None or not(current.onOff):
+        commands.append(('turn', govee_local_codec.encodeTurn(True)))
+    if current is None or current.brightness != target.brightness:
+        commands.append(('brightness', govee_local_codec.encodeBrightness(target.brightness)))
+    if target.colorTemInKelvin > 0:
+        if current is None or current.colorTemInKelvin != target.colorTemInKelvin:
+            commands.append(('colorwc', govee_local_codec.encodeColor(0, 0, 0, target.colorTemInKelvin)))
+    elif current is None or current.colorTemInKelvin != 0 or (current.red, current.green, current.blue) != (target.red, target.green, target.blue):
+        commands.append(('colorwc', govee_local_codec.encodeColor(target.red, target.green, target.blue)))
+    return commands
+
+'''
+GoveeLocalSceneStore
+Named snapshots, kept in one small JSON file.
+'''
+class GoveeLocalSceneStore:
+
+    def __init__(self, path=SCENES_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._scenes = None
+
+    def _load(self):
+        if self._scenes is not None:
+            return self._scenes
+        self._scenes = {}
+        try:
+            with open(self.path) as scenesFile:
+                stored = json.load(scenesFile)
+            self._scenes = dict(stored.get('scenes', {}))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            LOGGER.error('\n\tUnable to read scenes from {}: {}\n'.format(self.path, e))
+        return self._scenes
+
+    def _save(self):
+        temporaryPath = self.path + '.tmp'
+        try:
+            with open(temporaryPath, 'w') as scenesFile:
+                json.dump({'format': SCENES_FORMAT, 'scenes': self._scenes}, scenesFile, separators=(',', ':'))
+            os.replace(temporaryPath, self.path)
+            return True
+        except OSError as e:
+            LOGGER.error('\n\tUnable to write scenes to {}: {}\n'.format(self.path, e))
+            return False
+
+    def names(self):
+        with self._lock:
+            return sorted(self._load())
+
+    def put(self, name, snapshot):
+        with self._lock:
+            self._load()[name] = {'saved': int(time.time()), 'lights': encodeSnapshot(snapshot)}
+            return self._save()
+
+    '''
+    The snapshot saved as 'name', or None.
+    '''
+    def get(self, name):
+        with self._lock:
+            scene = self._load().get(name)
+        if scene is None:
+            return None
+        try:
+            return decodeSnapshot(scene.get('lights', {}))
+        except (ValueError, TypeError, AttributeError) as e:
+            LOGGER.error("\n\tScene '{}' in {} is malformed: {}\n".format(name, self.path, e))
+            return None
+
+    def delete(self, name):
+        with self._lock:
+            if self._load().pop(name, None) is None:
+                return False
+            return self._save()
+
+'''
+GoveeLocalSceneRestorer
+Puts a snapshot back on the lights.  Each round sends only what differs, step by
+step ('turn', then 'brightness', then 'colorwc') to every light at once, with
+one command gap between steps; a devStatus round over the transport then checks
+the result, and only the lights that don't match are retried, from their freshly
+reported state.
+'''
+class GoveeLocalSceneRestorer:
+
+    def __init__(self, transport, commandQueue, attempts=RESTORE_ATTEMPTS, verifyTimeout=VERIFY_TIMEOUT):
+        self.transport = transport
+        self.commandQueue = commandQueue
+        self.attempts = attempts
+        self.verifyTimeout = verifyTimeout
+
+    '''
+    'lights' is [(address, ipAddress, target, current)], with 'current' the cached
+    state (or None).  'onStatus(address, data)', if given, receives every verify
+    reply (None on a timeout).  Returns the addresses that still don't match.
+    '''
+    def restore(self, lights, onStatus=None):
+        pending = {address: (ipAddress, target, current) for address, ipAddress, target, current in lights}
+        for attempt in range(0, self.attempts):
+            if len(pending) == 0:
+                break
+            self._send(pending)
+
+            replies = self.transport.queryStatus([ipAddress for ipAddress, target, current in pending.values()], self.verifyTimeout)
+            for address in list(pending):
+                ipAddress, target, current = pending[address]
+                data = replies.get(ipAddress)
+                if onStatus is not None:
+                    onStatus(address, data)
+                actual = None
+                if data is not None:
+                    try:
+                        actual = govee_local_codec.decodeStatus(data)
+                    except (KeyError, ValueError, TypeError, AttributeError):
+                        actual = None
+                if actual is not None and len(restoreCommands(target, actual)) == 0:
+                    del pending[address]
+                else:
+                    pending[address] = (ipAddress, target, actual)
+            if len(pending) > 0:
+                LOGGER.info('\n\tScene restore attempt {}: {} light(s) not yet matching.\n'.format(attempt + 1, len(pending)))
+        return list(pending)
+
+    def _send(self, pending):
+        steps = {}
+        for address, (ipAddress, target, current) in pending.items():
+            for step, (kind, payload) in enumerate(restoreCommands(target, current)):
+                steps.setdefault(step, {}).setdefault((kind, payload), []).append((address, ipAddress))
+
+        for step in sorted(steps):
+            if step > 0:
+                time.sleep(self.commandQueue.minGap)
+            for (kind, payload), targets in steps[step].items():
+                self.commandQueue.sendNow(targets, kind, payload)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import random
+import time
+
+LOGGER = udi_interface.LOGGER
+
+# +/- fraction of the interval added to every next-due time, so polls don't burst
+POLL_JITTER = 0.2
+# devices due within this many seconds of each other are polled as one batch
+BATCH_WINDOW = 0.1
+# consecutive missed polls before a device is reported offline
+OFFLINE_AFTER = 3
+# upper bound on the backoff between polls of an unresponsive device
+MAX_BACKOFF = 300.0
+# delay before the confirming poll that follows a command
+FOLLOW_UP_DELAY = 0.5
+
+'''
+Schedule state for one device.
+'''
+class _ScheduleEntry:
+    __slots__ = ('nextDue', 'soon', 'failures', 'offline')
+
+    def __init__(self, nextDue):
+        self.nextDue = nextDue
+        self.soon = None
+        self.failures = 0
+        self.offline = False
+
+'''
+GoveeLocalPollScheduler
+Gives every device its own next-due time instead of polling the whole fleet on
+the same shortPoll tick.  Healthy devices are polled every 'interval' seconds
+(with jitter); a device that keeps missing its replies backs off exponentially
+up to MAX_BACKOFF (a simple circuit breaker) and is reported offline after
+OFFLINE_AFTER misses.  pollSoon() brings a poll forward, e.g. to confirm a command.
+
+'pollBatch(addresses)' is called on the scheduler thread with every address that
+is due; it must call recordResult() for each of them, and must not wait on the
+devices isOffline() reports - those are only probed, and recordResult(address,
+True) may come later from another thread when one answers.  'onOffline(address)'
+is called once when a device is first considered offline.
+'''
+class GoveeLocalPollScheduler:
+
+    def __init__(self, pollBatch, onOffline=None, interval=10.0):
+        self.pollBatch = pollBatch
+        self.onOffline = onOffline
+        self.interval: float = float(interval)
+
+        self._cond = threading.Condition()
+        self._entries = {}
+        self._thread = None
+        self._running: bool = False
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='GoveeLocalPollScheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(5.0)
+            self._thread = None
+
+    def setInterval(self, seconds):
+        with self._cond:
+            self.interval = max(1.0, float(seconds))
+            self._cond.notify_all()
+
+    '''
+    Track exactly these addresses; new ones get a random first due time within one interval.
+    '''
+    def sync(self, addresses):
+        now = time.monotonic()
+        with self._cond:
+            for address in list(self._entries):
+                if address not in addresses:
+                    del self._entries[address]
+            for address in addresses:
+                if address not in self._entries:
+                    self._entries[address] = _ScheduleEntry(now + random.uniform(0, self.interval))
+            self._cond.notify_all()
+
+    def remove(self, address):
+        with self._cond:
+            self._entries.pop(address, None)
+
+    def pollSoon(self, address, delay=FOLLOW_UP_DELAY):
+        with self._cond:
+            entry = self._entries.get(address)
+            if entry is None:
+                return
+            entry.soon = time.monotonic() + delay
+            entry.nextDue = min(entry.nextDue, entry.soon)
+            self._cond.notify_all()
+
+    def isOffline(self, address):
+        with self._cond:
+            entry = self._entries.get(address)
+            return entry is not None and entry.offline
+
+    def onlineCount(self):
+        with self._cond:
+            return len([entry for entry in self._entries.values() if not(entry.offline)])
+
+    '''
+    Record a poll result and schedule the device's next poll from it.
+    '''
+    def recordResult(self, address, success):
+        wentOffline = False
+        with self._cond:
+            entry = self._entries.get(address)
+            if entry is None:
+                return
+            now = time.monotonic()
+            if success:
+                if entry.offline:
+                    LOGGER.warning("\n\tDevice '" + address + "' is answering again after " + str(entry.failures) + " missed poll(s).\n")
+                entry.failures = 0
+                entry.offline = False
+                delay = self.interval
+            else:
+                entry.failures += 1
+                delay = min(self.interval * (2 ** min(entry.failures - 1, 16)), max(MAX_BACKOFF, self.interval))
+                if entry.failures >= OFFLINE_AFTER and not(entry.offline):
+                    entry.offline = True
+                    wentOffline = True
+            entry.nextDue = now + delay * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+            # a pollSoon() that arrived while this poll was in flight still applies
+            if entry.soon is not None:
+                entry.nextDue = min(entry.nextDue, entry.soon)
+
+        if wentOffline:
+            LOGGER.warning("\n\tDevice '" + address + "' missed " + str(OFFLINE_AFTER) + " polls; marking offline and backing off.\n")
+            if self.onOffline is not None:
+                self.onOffline(address)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not(self._running):
+                    return
+                now = time.monotonic()
+                due = [address for address, entry in self._entries.items() if entry.nextDue <= now + BATCH_WINDOW]
+                if len(due) == 0:
+                    nextDue = min([entry.nextDue for entry in self._entries.values()], default=now + 1.0)
+                    self._cond.wait(min(max(nextDue - now, BATCH_WINDOW), 1.0))
+                    continue
+                # provisional next-due time, replaced by recordResult()
+                for address in due:
+                    self._entries[address].nextDue = now + self.interval
+                    self._entries[address].soon = None
+
+            try:
+                self.pollBatch(due)
+            except Exception as e:
+                LOGGER.error('\n\tScheduled poll of {} device(s) failed: {}\n'.format(len(due), e))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+from nodes import govee_local_color
+
+# the drivers populated from a devStatus reply, in GoveeDeviceState.driverValues() order
+STATUS_DRIVERS = ('ST', 'OL', 'GV0', 'GV1', 'GV2', 'GV3')
+
+# GoveeDeviceState field -> the driver it is reported on
+FIELD_DRIVERS = {
+    'onOff': 'ST',
+    'brightness': 'OL',
+    'colorTemInKelvin': 'GV0',
+    'red': 'GV1',
+    'green': 'GV2',
+    'blue': 'GV3'
+}
+
+'''
+GoveeDeviceState
+Compact record of one light's state, as decoded from a devStatus reply (see
+govee_local_codec.decodeStatus()).
+'''
+class GoveeDeviceState:
+    __slots__ = ('onOff', 'brightness', 'colorTemInKelvin', 'red', 'green', 'blue')
+
+    def __init__(self, onOff=0, brightness=0, colorTemInKelvin=0, red=0, green=0, blue=0):
+        self.onOff = onOff
+        self.brightness = brightness
+        self.colorTemInKelvin = colorTemInKelvin
+        self.red = red
+        self.green = green
+        self.blue = blue
+
+    '''
+    Values for STATUS_DRIVERS, in the same order.  The color drivers are kept
+    consistent with each other: in RGB mode (colorTemInKelvin 0) GV0 shows the
+    approximate color temperature of the RGB color, and in color temperature mode
+    with no RGB reported GV1 - GV3 show the RGB of that temperature.
+    '''
+    def driverValues(self):
+        colorTemInKelvin, red, green, blue = self.colorTemInKelvin, self.red, self.green, self.blue
+        if colorTemInKelvin > 0:
+            if red == 0 and green == 0 and blue == 0:
+                red, green, blue = govee_local_color.kelvinToRGB(colorTemInKelvin)
+        else:
+            colorTemInKelvin = govee_local_color.approximateKelvin(red, green, blue)
+        return (100 if self.onOff else 0, self.brightness, colorTemInKelvin, red, green, blue)
+
+    def copy(self):
+        return GoveeDeviceState(self.onOff, self.brightness, self.colorTemInKelvin, self.red, self.green, self.blue)
+
+    def __eq__(self, other):
+        if not(isinstance(other, GoveeDeviceState)):
+            return NotImplemented
+        return (self.onOff, self.brightness, self.colorTemInKelvin, self.red, self.green, self.blue) == \
+            (other.onOff, other.brightness, other.colorTemInKelvin, other.red, other.green, other.blue)
+
+    def __repr__(self):
+        return 'GoveeDeviceState(onOff={}, brightness={}, colorTemInKelvin={}, rgb=({},{},{}))'.format(
+            self.onOff, self.brightness, self.colorTemInKelvin, self.red, self.green, self.blue)
+
+'''
+GoveeStateCache
+What was last reported to Polyglot / IoX for one node, so each new reply (or text
+push) only reports what actually changed.
+'''
+class GoveeStateCache:
+    __slots__ = ('state', 'reported', 'texts')
+
+    def __init__(self):
+        self.state = None
+        self.reported = None
+        self.texts = {}
+
+    '''
+    Forget everything reported, so the next update is sent in full.
+    '''
+    def invalidate(self):
+        self.state = None
+        self.reported = None
+        self.texts = {}
+
+    '''
+    Forget the reported device state (but not the texts), e.g. after marking the device offline.
+    '''
+    def invalidateState(self):
+        self.state = None
+        self.reported = None
+
+    '''
+    Record 'state' as the latest state and return the [(driver, value), ...] that
+    differ from what was last reported (all of them if 'force').
+    '''
+    def changedDrivers(self, state, force=False):
+        values = state.driverValues()
+        previous = self.reported
+        self.state = state
+        self.reported = values
+
+        if force or previous is None:
+            return list(zip(STATUS_DRIVERS, values))
+        return [(STATUS_DRIVERS[i], values[i]) for i in range(len(values)) if values[i] != previous[i]]
+
+    '''
+    Apply a partial update (e.g. the expected result of a command) on top of the
+    latest state and return the drivers that changed.  If nothing has been reported
+    yet, only the updated fields are returned and the next full state is still
+    reported in full.
+    '''
+    def updateFields(self, **fields):
+        state = self.state.copy() if self.state is not None else GoveeDeviceState()
+        for name in fields:
+            setattr(state, name, fields[name])
+
+        if self.reported is None:
+            self.state = state
+            values = dict(zip(STATUS_DRIVERS, state.driverValues()))
+            return [(FIELD_DRIVERS[name], values[FIELD_DRIVERS[name]]) for name in fields]
+        return self.changedDrivers(state)
+
+    '''
+    True (and remembered) if 'text' differs from the last text pushed to 'driver'.
+    '''
+    def textChanged(self, driver, text, force=False):
+        if not(force) and self.texts.get(driver) == text:
+            return False
+        self.texts[driver] = text
+        return True
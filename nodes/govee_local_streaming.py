@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import functools
+import operator
+import binascii
+import socket
+import time
+
+LOGGER = udi_interface.LOGGER
+
+# Govee LAN real-time ("razer") binary packets, sent base64 encoded in {"cmd":"razer","data":{"pt":...}}:
+#   BB 00 <length> <command> <payload...> <checksum>
+# where <length> counts the payload bytes and <checksum> is the XOR of every byte before it.
+RAZER_HEADER = 0xBB
+RAZER_MODE = 0xB1
+RAZER_COLORS = 0xB0
+
+# most segments one color packet can carry (its <length> byte holds 2 + 3 * segments)
+MAX_SEGMENTS = (0xFF - 2) // 3
+
+RAZER_PREFIX = b'{"msg":{"cmd":"razer","data":{"pt":"'
+RAZER_SUFFIX = b'"}}}'
+
+DEFAULT_FPS = 30
+# streams are re-activated this often, in case a light dropped out of real-time mode
+KEEPALIVE_INTERVAL = 5.0
+
+def _wrap(binary):
+    return RAZER_PREFIX + binascii.b2a_base64(bytes(binary), newline=False) + RAZER_SUFFIX
+
+def _mode(enable):
+    packet = bytearray([RAZER_HEADER, 0x00, 0x01, RAZER_MODE, 0x01 if enable else 0x00, 0x00])
+    packet[5] = functools.reduce(operator.xor, packet[0:5])
+    return _wrap(packet)
+
+# precomputed real-time mode switches
+RAZER_ENABLE = _mode(True)
+RAZER_DISABLE = _mode(False)
+
+'''
+RazerFrameEncoder
+Encodes color frames for 'segments' segments into one preallocated binary buffer
+and one preallocated JSON packet, so a frame costs a copy, a checksum and a
+base64 pass - no per-frame object building.  The one allocation left per frame
+is the bytes object binascii.b2a_base64() returns (the standard library can't
+encode into an existing buffer), which is copied into the packet and freed at
+once; encoding it in Python instead would be slower and allocate more.  Frames
+must be 3 * segments bytes of R, G, B values.
+'''
+class RazerFrameEncoder:
+
+    def __init__(self, segments, gradient=False):
+        if segments < 1 or segments > MAX_SEGMENTS:
+            raise ValueError('segments must be between 1 and {}'.format(MAX_SEGMENTS))
+        self.segments = segments
+        self.frameSize = 3 * segments
+
+        self._binary = bytearray(6 + self.frameSize + 1)
+        self._binary[0:6] = bytes([RAZER_HEADER, 0x00, 2 + self.frameSize, RAZER_COLORS, 0x01 if gradient else 0x00, segments])
+        self._headerChecksum = functools.reduce(operator.xor, self._binary[0:6])
+        self._colors = memoryview(self._binary)[6:6 + self.frameSize]
+
+        encodedSize = len(binascii.b2a_base64(bytes(self._binary), newline=False))
+        self._packet = bytearray(RAZER_PREFIX + b'A' * encodedSize + RAZER_SUFFIX)
+        self._encoded = memoryview(self._packet)[len(RAZER_PREFIX):len(RAZER_PREFIX) + encodedSize]
+
+    '''
+    Encode one frame and return the (reused) packet buffer - send it before the next encode().
+    '''
+    def encode(self, colors):
+        if len(colors) != self.frameSize:
+            raise ValueError('expected {} color bytes, got {}'.format(self.frameSize, len(colors)))
+        self._colors[:] = colors
+        self._binary[-1] = self._headerChecksum ^ functools.reduce(operator.xor, self._colors, 0)
+        # the only per-frame allocation: b2a_base64() has no encode-into-buffer form
+        self._encoded[:] = binascii.b2a_base64(self._binary, newline=False)
+        return self._packet
+
+'''
+GoveeLocalStreamSession
+Streams color frames to one or more lights (a group) at up to 'fps' frames per
+second.  Producers submit() frames whenever they like; a pacing thread sends only
+the newest frame on each tick, so a slow consumer never builds a backlog and
+latency stays bounded (stale frames are dropped, not queued).  A 'producer'
+callable, if given, is instead asked for a frame on every tick.
+'''
+class GoveeLocalStreamSession:
+
+    def __init__(self, transport, ipAddresses, segments=1, fps=DEFAULT_FPS, producer=None, name='stream'):
+        self.transport = transport
+        self.ipAddresses = list(ipAddresses)
+        self.fps = max(1, min(60, int(fps)))
+        self.producer = producer
+        self.name = name
+        self.encoder = RazerFrameEncoder(segments)
+
+        self._lock = threading.Lock()
+        self._latest = bytearray(self.encoder.frameSize)
+        self._fresh: bool = False
+        self._stopEvent = threading.Event()
+        self._thread = None
+        self._inputs = []
+
+        self.framesSent: int = 0
+        self.framesDropped: int = 0
+        self.framesRejected: int = 0
+        self.ticksLate: int = 0
+
+    def start(self):
+        self._stopEvent.clear()
+        self._activate()
+        self._thread = threading.Thread(target=self._run, name='GoveeLocalStream-' + self.name, daemon=True)
+        self._thread.start()
+        LOGGER.warning('\n\tStreaming to {} light(s) at {} fps ({}).\n'.format(len(self.ipAddresses), self.fps, self.name))
+
+    '''
+    Stop the pacing thread and any inputs, and take the lights out of real-time mode.
+    '''
+    def stop(self):
+        self._stopEvent.set()
+        for stream in self._inputs:
+            try:
+                stream.close()
+            except OSError:
+                pass
+        self._inputs = []
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+        for ipAddress in self.ipAddresses:
+            self.transport.send(ipAddress, RAZER_DISABLE, None, False)
+        LOGGER.warning('\n\tStream {} stopped: {} frame(s) sent, {} dropped.\n'.format(self.name, self.framesSent, self.framesDropped))
+
+    def isRunning(self):
+        return self._thread is not None and not(self._stopEvent.is_set())
+
+    '''
+    Offer a frame (3 * segments bytes of R, G, B); it replaces any frame not yet sent.
+    '''
+    def submit(self, colors):
+        if len(colors) != self.encoder.frameSize:
+            return False
+        with self._lock:
+            if self._fresh:
+                self.framesDropped += 1
+            self._latest[:] = colors
+            self._fresh = True
+        return True
+
+    '''
+    Read fixed-size frames from a pipe / file object (e.g. a FIFO) on a reader thread.
+    '''
+    def attachPipe(self, stream):
+        self._inputs.append(stream)
+        threading.Thread(target=self._readPipe, args=(stream,), name='GoveeLocalStreamPipe-' + self.name, daemon=True).start()
+
+    '''
+    Take frames from UDP datagrams on 'port' (each datagram is one frame).
+    '''
+    def attachUdpPort(self, port, bindAddress='127.0.0.1'):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((bindAddress, port))
+        sock.settimeout(0.5)
+        self._inputs.append(sock)
+        threading.Thread(target=self._readUdp, args=(sock,), name='GoveeLocalStreamUdp-' + self.name, daemon=True).start()
+
+    def _activate(self):
+        for ipAddress in self.ipAddresses:
+            self.transport.send(ipAddress, RAZER_ENABLE, None, False)
+
+    def _readPipe(self, stream):
+        frame = bytearray(self.encoder.frameSize)
+        view = memoryview(frame)
+        while not(self._stopEvent.is_set()):
+            filled = 0
+            while filled < len(frame):
+                try:
+                    count = stream.readinto(view[filled:])
+                except (OSError, ValueError):
+                    return
+                if not(count):
+                    return
+                filled += count
+            self.submit(frame)
+
+    def _readUdp(self, sock):
+        # one spare byte, so a datagram longer than a frame shows up as too long instead of being truncated
+        buffer = bytearray(self.encoder.frameSize + 1)
+        frame = memoryview(buffer)[:self.encoder.frameSize]
+        while not(self._stopEvent.is_set()):
+            try:
+                count = sock.recv_into(buffer)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if count == len(frame):
+                self.submit(frame)
+            else:
+                self.framesRejected += 1
+
+    def _run(self):
+        period = 1.0 / self.fps
+        nextTick = time.monotonic()
+        lastActivation = nextTick
+        while not(self._stopEvent.is_set()):
+            now = time.monotonic()
+            if now < nextTick:
+                self._stopEvent.wait(nextTick - now)
+                continue
+
+            # running behind: skip the missed ticks rather than bursting to catch up
+            if now - nextTick > period:
+                self.ticksLate += 1
+                nextTick = now
+            nextTick += period
+
+            if now - lastActivation >= KEEPALIVE_INTERVAL:
+                lastActivation = now
+                self._activate()
+
+            packet = None
+            if self.producer is not None:
+                try:
+                    colors = self.producer(self.framesSent)
+                except Exception as e:
+                    LOGGER.error('\n\tStream {} producer failed: {}\n'.format(self.name, e))
+                    colors = None
+                if colors is not None and len(colors) == self.encoder.frameSize:
+                    packet = self.encoder.encode(colors)
+            else:
+                with self._lock:
+                    if self._fresh:
+                        self._fresh = False
+                        packet = self.encoder.encode(self._latest)
+
+            if packet is None:
+                continue
+            for ipAddress in self.ipAddresses:
+                self.transport.send(ipAddress, packet, None, False)
+            self.framesSent += 1
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import math
+import time
+
+from nodes import govee_local_codec
+from nodes import govee_local_color
+
+LOGGER = udi_interface.LOGGER
+
+# timer wheel resolution (seconds) and size; later deadlines wrap around the wheel
+WHEEL_TICK = 0.05
+WHEEL_SLOTS = 256
+# fade steps per second across every light, so a whole-house fade can't flood the LAN
+MAX_STEPS_PER_SECOND = 40.0
+# fastest step rate for one light (the command queue keeps packets 0.1 s apart anyway)
+MIN_STEP_INTERVAL = 0.2
+# longest fade accepted (seconds)
+MAX_DURATION = 86400
+
+'''
+One running fade.  Brightness moves along the perceptual curve (see
+govee_local_color), color temperature in Kelvin, and RGB per channel; a fade
+between color temperature and RGB runs in RGB and lands on the exact target.
+'''
+class _Transition:
+    __slots__ = ('device', 'started', 'duration', 'fromLevel', 'toLevel', 'toBrightness', 'turnOff',
+                 'fromKelvin', 'toKelvin', 'fromRGB', 'toRGB', 'lastBrightness', 'lastColor', 'tick', 'cancelled')
+
+    def __init__(self, device, started, duration):
+        self.device = device
+        self.started = started
+        self.duration = duration
+        self.fromLevel = None
+        self.toLevel = None
+        self.toBrightness = None
+        self.turnOff = False
+        self.fromKelvin = 0
+        self.toKelvin = None
+        self.fromRGB = None
+        self.toRGB = None
+        self.lastBrightness = None
+        self.lastColor = None
+        self.tick = 0
+        self.cancelled = False
+
+'''
+GoveeLocalTransitionEngine
+Smooth fades for the Govee LAN API, which has no transition time of its own.  Every
+running fade lives on one timer wheel served by a single thread.  On each step a
+fade computes its current value and queues a packet only if the value changed.
+The step interval grows with the number of lights fading at once, so together
+they stay under MAX_STEPS_PER_SECOND.  A light whose previous step is still
+waiting in the command queue skips a step, so it never has more than one step in
+flight.  Any other command to the light cancels its fade (cancel()).
+
+'device' is a device node: the engine reads its address, ipAddress and
+stateCache.state, and reports every step through applyExpected().
+'onDone(address)' is called when a fade completes (not when it is cancelled).
+'''
+class GoveeLocalTransitionEngine:
+
+    def __init__(self, commandQueue, onDone=None, maxStepsPerSecond=MAX_STEPS_PER_SECOND):
+        self.commandQueue = commandQueue
+        self.onDone = onDone
+        self.maxStepsPerSecond = float(maxStepsPerSecond)
+
+        self._cond = threading.Condition()
+        self._active = {}
+        self._slots = [[] for i in range(0, WHEEL_SLOTS)]
+        self._epoch = time.monotonic()
+        self._nextTick: int = 0
+        self._thread = None
+        self._running: bool = False
+
+        self.stepsSent: int = 0
+        self.stepsSkipped: int = 0
+        self.completed: int = 0
+        self.cancelled: int = 0
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='GoveeLocalTransitions', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            for transition in self._active.values():
+                transition.cancelled = True
+            self._active = {}
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+
+    '''
+    Fade 'device' over 'duration' seconds to any of: 'brightness' (0-100, 0 fades
+    down and then turns the light off), 'colorTemInKelvin', or 'rgb' (r, g, b).
+    Replaces any fade already running on the light.  A light that is off is turned
+    on at the lowest brightness first; a light whose state isn't known yet just
+    gets the target.
+    '''
+    def fade(self, device, duration, brightness=None, colorTemInKelvin=None, rgb=None):
+        now = time.monotonic()
+        duration = max(0.0, min(float(MAX_DURATION), float(duration)))
+        transition = _Transition(device, now, duration)
+        current = device.stateCache.state
+        if current is None:
+            transition.duration = 0.0
+
+        if brightness is not None:
+            brightness = max(0, min(100, int(brightness)))
+            isOn = current is not None and current.onOff
+            fromBrightness = current.brightness if isOn else 0
+            transition.fromLevel = govee_local_color.brightnessLevel(fromBrightness)
+            transition.toLevel = govee_local_color.brightnessLevel(brightness)
+            transition.toBrightness = max(1, brightness)
+            transition.turnOff = brightness == 0
+            transition.lastBrightness = fromBrightness if isOn else None
+            if not(isOn) and not(transition.turnOff):
+                # brightness first (the queue keeps the order), so the light never comes on at its old level
+                self.commandQueue.enqueue(device.address, device.ipAddress, 'brightness', govee_local_codec.encodeBrightness(1))
+                self.commandQueue.enqueue(device.address, device.ipAddress, 'turn', govee_local_codec.encodeTurn(True))
+                transition.lastBrightness = 1
+                device.applyExpected(False, onOff=1, brightness=1)
+
+        if colorTemInKelvin is not None or rgb is not None:
+            if current is not None and current.colorTemInKelvin > 0:
+                transition.fromKelvin = current.colorTemInKelvin
+                transition.fromRGB = govee_local_color.kelvinToRGB(current.colorTemInKelvin)
+            elif current is not None:
+                transition.fromRGB = (current.red, current.green, current.blue)
+            if colorTemInKelvin is not None:
+                transition.toKelvin = int(colorTemInKelvin)
+                transition.toRGB = govee_local_color.kelvinToRGB(transition.toKelvin)
+            else:
+                transition.toKelvin = 0
+                transition.toRGB = tuple([max(0, min(255, int(channel))) for channel in rgb])
+            if transition.fromRGB is None:
+                transition.fromRGB = transition.toRGB
+
+        with self._cond:
+            previous = self._active.pop(device.address, None)
+            if previous is not None:
+                previous.cancelled = True
+                self.cancelled += 1
+            self._active[device.address] = transition
+            self._schedule(transition, now, 0.0)
+            self._cond.notify()
+
+    '''
+    Stop the fade running on 'address' (if any) where it is.
+    '''
+    def cancel(self, address):
+        with self._cond:
+            transition = self._active.pop(address, None)
+            if transition is not None:
+                transition.cancelled = True
+                self.cancelled += 1
+
+    def isActive(self, address):
+        with self._cond:
+            return address in self._active
+
+    def activeCount(self):
+        with self._cond:
+            return len(self._active)
+
+    '''
+    Seconds between the steps of one light, for the number of lights fading now.
+    '''
+    def stepInterval(self):
+        return max(MIN_STEP_INTERVAL, len(self._active) / self.maxStepsPerSecond)
+
+    def _schedule(self, transition, now, delay):
+        tick = max(self._nextTick, int(math.ceil((now + delay - self._epoch) / WHEEL_TICK)))
+        transition.tick = tick
+        self._slots[tick % WHEEL_SLOTS].append(transition)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not(self._running):
+                    return
+                if len(self._active) == 0:
+                    # idle: restart the wheel, so nothing is left to sweep
+                    self._slots = [[] for i in range(0, WHEEL_SLOTS)]
+                    self._epoch = time.monotonic()
+                    self._nextTick = 0
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                currentTick = int((now - self._epoch) / WHEEL_TICK)
+                if currentTick < self._nextTick:
+                    self._cond.wait(self._epoch + self._nextTick * WHEEL_TICK - now)
+                    continue
+
+                due = []
+                for tick in range(self._nextTick, self._nextTick + min(currentTick - self._nextTick + 1, WHEEL_SLOTS)):
+                    slot = self._slots[tick % WHEEL_SLOTS]
+                    if len(slot) == 0:
+                        continue
+                    waiting = []
+                    for transition in slot:
+                        if transition.cancelled:
+                            continue
+                        if transition.tick <= currentTick:
+                            due.append(transition)
+                        else:
+                            waiting.append(transition)
+                    self._slots[tick % WHEEL_SLOTS] = waiting
+                self._nextTick = currentTick + 1
+                interval = self.stepInterval()
+
+            for transition in due:
+                try:
+                    done = self._step(transition, now, interval)
+                except Exception as e:
+                    LOGGER.error("\n\tFade step for '{}' failed: {}\n".format(transition.device.address, e))
+                    self.cancel(transition.device.address)
+                    continue
+                if done and self.onDone is not None:
+                    self.onDone(transition.device.address)
+
+    '''
+    Send the next step of one fade; True once the fade has completed.  Runs under
+    the lock, so a command that cancels the fade can't be overtaken by a step.
+    '''
+    def _step(self, transition, now, interval):
+        with self._cond:
+            if transition.cancelled:
+                return False
+            device = transition.device
+            remaining = transition.duration - (now - transition.started)
+            final = remaining <= 0
+
+            if self.commandQueue.isPending(device.address):
+                self.stepsSkipped += 1
+                self._schedule(transition, now, WHEEL_TICK)
+                return False
+
+            fraction = 1.0 if final else (now - transition.started) / transition.duration
+            fields = {}
+
+            if transition.toLevel is not None:
+                if final:
+                    brightness = transition.toBrightness
+                else:
+                    level = int(round(transition.fromLevel + (transition.toLevel - transition.fromLevel) * fraction))
+                    brightness = max(1, govee_local_color.perceivedBrightness(level))
+                if brightness != transition.lastBrightness:
+                    transition.lastBrightness = brightness
+                    self.commandQueue.enqueue(device.address, device.ipAddress, 'brightness', govee_local_codec.encodeBrightness(brightness))
+                    fields['brightness'] = brightness
+
+            if transition.toRGB is not None:
+                if final and transition.toKelvin > 0:
+                    color = (0, 0, 0, transition.toKelvin)
+                elif transition.toKelvin > 0 and transition.fromKelvin > 0:
+                    kelvin = transition.fromKelvin + (transition.toKelvin - transition.fromKelvin) * fraction
+                    color = (0, 0, 0, int(round(kelvin / govee_local_color.KELVIN_STEP)) * govee_local_color.KELVIN_STEP)
+                else:
+                    color = tuple([int(round(start + (end - start) * fraction)) for start, end in zip(transition.fromRGB, transition.toRGB)]) + (0,)
+                if color != transition.lastColor:
+                    transition.lastColor = color
+                    self.commandQueue.enqueue(device.address, device.ipAddress, 'colorwc', govee_local_codec.encodeColor(*color))
+                    if color[3] > 0:
+                        fields['colorTemInKelvin'] = color[3]
+                    else:
+                        fields.update(colorTemInKelvin=0, red=color[0], green=color[1], blue=color[2])
+
+            if final and transition.turnOff:
+                self.commandQueue.enqueue(device.address, device.ipAddress, 'turn', govee_local_codec.encodeTurn(False))
+                fields['onOff'] = 0
+
+            if len(fields) > 0:
+                self.stepsSent += 1
+                device.applyExpected(False, **fields)
+
+            if not(final):
+                self._schedule(transition, now, min(interval, remaining))
+                return False
+            self._active.pop(device.address, None)
+            self.completed += 1
+            return True
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import socket
+import selectors
+import threading
+import time
+
+from nodes import govee_local_logging
+from nodes import govee_local_codec
+
+LOGGER = udi_interface.LOGGER
+HOTPATH_LOG = govee_local_logging.HOTPATH_LOG
+
+# Govee LAN API ports: requests go to the device on 4003 (4001 multicast for scan)
+# and every device answers on 4002 of the requesting host.
+GOVEE_LISTEN_PORT = 4002
+GOVEE_DEVICE_PORT = 4003
+
+# room for a whole fleet's replies arriving in the same instant
+RECEIVE_BUFFER_SIZE = 1024 * 1024
+
+'''
+A single outstanding request, waiting for the reply from one IP address.
+'''
+class _PendingReply:
+    __slots__ = ('data', 'event', 'sentAt')
+
+    def __init__(self):
+        self.data = None
+        self.event = threading.Event()
+        self.sentAt = 0.0
+
+'''
+GoveeLocalTransport
+One long-lived, non-blocking UDP socket (bound to 4002) shared by every device node.
+Requests to the whole fleet are sent back to back and the replies are matched
+to the requesting IP address by a background selector thread, so a full poll
+cycle costs about one network round trip instead of one round trip per device.
+'''
+class GoveeLocalTransport:
+
+    def __init__(self, listenPort=GOVEE_LISTEN_PORT, devicePort=GOVEE_DEVICE_PORT, bindAddress=''):
+        self.listenPort = listenPort
+        self.devicePort = devicePort
+        self.bindAddress = bindAddress
+
+        self._sock = None
+        self._selector = None
+        self._thread = None
+        self._running: bool = False
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._listeners = {}
+
+        # optional callback(ipAddress, cmd, seconds) for every answered request
+        self.roundTripHook = None
+        # datagrams that weren't a Govee JSON message
+        self.malformed: int = 0
+        # only touched by the receive thread
+        self.decoder = govee_local_codec.GoveeLocalDecoder()
+        # recent datagrams per device, for the controller's trace dump
+        self.trace = govee_local_logging.UdpTraceBuffer()
+        # set only while profiling: callback(name, fn, *args) that runs fn(*args)
+        self.profileHook = None
+
+    '''
+    Open the shared socket and start the receive thread.  Safe to call more than once.
+    '''
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+            sock.bind((self.bindAddress, self.listenPort))
+            sock.setblocking(False)
+
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(sock, selectors.EVENT_READ)
+            self._sock = sock
+            self._running = True
+
+            self._thread = threading.Thread(target=self._receiveLoop, name='GoveeLocalTransport', daemon=True)
+            self._thread.start()
+
+        LOGGER.info('\n\tUDP transport listening on port {}.\n'.format(self.listenPort))
+
+    def stop(self):
+        with self._lock:
+            if not(self._running):
+                return
+            self._running = False
+            thread = self._thread
+
+        if thread is not None:
+            thread.join(2.0)
+
+        self._selector.close()
+        self._sock.close()
+        self._sock = None
+
+    def isRunning(self):
+        return self._running
+
+    '''
+    Register a callback(ipAddress, cmd, data) for every reply carrying 'cmd', whether
+    or not it was matched to an outstanding request (e.g. 'scan' replies).
+    '''
+    def addListener(self, cmd, callback):
+        with self._lock:
+            self._listeners.setdefault(cmd, []).append(callback)
+
+    '''
+    Fire-and-forget datagram to one device.  'trace=False' keeps high rate
+    traffic (real-time frames) out of the trace buffer.
+    '''
+    def send(self, ipAddress, payload, port=None, trace=True):
+        if port is None:
+            port = self.devicePort
+        if trace:
+            self.trace.record(ipAddress, 'tx', payload)
+        try:
+            self._sock.sendto(payload, (ipAddress, port))
+            return True
+        except (OSError, AttributeError) as e:
+            HOTPATH_LOG.error(('sendError', ipAddress), "\n\tUDP Send error to '%s': %s\n", ipAddress, e)
+            return False
+
+    '''
+    Send 'payload' to every address at once and wait (at most 'timeout' seconds overall)
+    for each one's 'replyCmd' reply.  Returns {ipAddress: data or None}.
+    '''
+    def request(self, ipAddresses, payload, replyCmd, timeout):
+        slots = {}
+        with self._lock:
+            for ipAddress in ipAddresses:
+                key = (ipAddress, replyCmd)
+                slot = self._pending.get(key)
+                if slot is None:
+                    slot = _PendingReply()
+                    self._pending[key] = slot
+                slots[ipAddress] = slot
+
+        for ipAddress in slots:
+            slots[ipAddress].sentAt = time.monotonic()
+            self.send(ipAddress, payload)
+
+        deadline = time.monotonic() + timeout
+        results = {}
+        for ipAddress, slot in slots.items():
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                slot.event.wait(remaining)
+            results[ipAddress] = slot.data
+
+        with self._lock:
+            for ipAddress, slot in slots.items():
+                key = (ipAddress, replyCmd)
+                if self._pending.get(key) is slot:
+                    del self._pending[key]
+
+        return results
+
+    def queryStatus(self, ipAddresses, timeout):
+        return self.request(ipAddresses, govee_local_codec.STATUS_QUERY, 'devStatus', timeout)
+
+    '''
+    devStatus query nobody waits for: the replies only reach the 'devStatus' listeners.
+    '''
+    def probeStatus(self, ipAddresses):
+        for ipAddress in ipAddresses:
+            self.send(ipAddress, govee_local_codec.STATUS_QUERY)
+
+    def _receiveLoop(self):
+        while self._running:
+            try:
+                events = self._selector.select(timeout=0.5)
+            except (OSError, ValueError):
+                break
+            if events:
+                self._drainSocket()
+
+    def _drainSocket(self):
+        while True:
+            try:
+                datagram, source = self._sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except (OSError, AttributeError):
+                return
+            if self.profileHook is not None:
+                self.profileHook('parse', self._handleDatagram, source[0], datagram)
+            else:
+                self._handleDatagram(source[0], datagram)
+
+    def _handleDatagram(self, ipAddress, datagram):
+        self.trace.record(ipAddress, 'rx', datagram)
+        try:
+            cmd, data = self.decoder.decode(ipAddress, datagram)
+        except govee_local_codec.CodecError:
+            self.malformed += 1
+            HOTPATH_LOG.warning(('malformed', ipAddress), "\n\tUDP Reply from '%s' could not be parsed; ignoring.\n", ipAddress)
+            return
+
+        with self._lock:
+            slot = self._pending.pop((ipAddress, cmd), None)
+            listeners = list(self._listeners.get(cmd, ()))
+
+        if slot is not None:
+            slot.data = data
+            slot.event.set()
+            if self.roundTripHook is not None:
+                self.roundTripHook(ipAddress, cmd, time.monotonic() - slot.sentAt)
+
+        for callback in listeners:
+            try:
+                callback(ipAddress, cmd, data)
+            except Exception as e:
+                LOGGER.error("\n\tUDP listener for '" + cmd + "' failed: %s\n", str(e))
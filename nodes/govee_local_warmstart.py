@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import json
+import os
+import time
+
+from nodes import govee_local_state
+from nodes import govee_local_paths
+
+LOGGER = udi_interface.LOGGER
+
+STATE_FILE = govee_local_paths.dataPath('govee_local_state.jsonl')
+
+# the journal is rewritten once it holds this many lines per device
+COMPACT_FACTOR = 4
+COMPACT_MINIMUM = 64
+# confirmations that changed nothing are saved (by compacting) at most this often
+CONFIRM_SAVE_INTERVAL = 600.0
+
+'''
+GoveeLocalStateStore
+Last confirmed state of every light, with its IP, MAC and SKU, kept so the
+nodes can show something useful right after a restart.  The file is a journal of
+one compact JSON line per change:
+
+    {"a": address, "ip": ..., "mac": ..., "sku": ..., "s": [onOff, brightness, kelvin, r, g, b], "t": epoch, "c": epoch}
+
+where "t" is when the state last changed and "c" when it was last confirmed (or
+{"a": address, "del": 1} for a removed light).  record() only queues a line
+when something differs from the last one for that light, flush() appends the
+queued lines in one write, and the journal is compacted to one line per light
+once it has grown to COMPACT_FACTOR lines per light.  A confirmation that
+changes nothing only moves "c" in memory; those are saved by compacting, at
+most every CONFIRM_SAVE_INTERVAL seconds and on flush(final=True).
+'''
+class GoveeLocalStateStore:
+
+    def __init__(self, path=STATE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._pending = []
+        self._lines: int = 0
+        # monotonic time of the oldest confirmation not yet saved (None = all saved)
+        self._unsavedSince = None
+
+    def load(self):
+        entries = {}
+        lines = 0
+        try:
+            with open(self.path) as journal:
+                for line in journal:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                        address = entry['a']
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    if entry.get('del'):
+                        entries.pop(address, None)
+                    else:
+                        entries[address] = entry
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            LOGGER.error('\n\tUnable to read saved device states from {}: {}\n'.format(self.path, e))
+        with self._lock:
+            self._entries = entries
+            self._lines = lines
+        LOGGER.info('\n\tLoaded the last known state of {} device(s).\n'.format(len(entries)))
+        return len(entries)
+
+    '''
+    (GoveeDeviceState, last confirmed epoch) saved for 'address', or None if there is
+    none or it was saved for a different light (MAC, or IP if the MAC is unknown).
+    '''
+    def warmState(self, address, ipAddress, macAddress):
+        with self._lock:
+            entry = self._entries.get(address)
+        if entry is None:
+            return None
+        if macAddress is not None and entry.get('mac') is not None:
+            if entry['mac'] != macAddress:
+                return None
+        elif entry.get('ip') != ipAddress:
+            return None
+        try:
+            return govee_local_state.GoveeDeviceState(*[int(value) for value in entry['s'][0:6]]), int(entry.get('c', entry.get('t', 0)))
+        except (KeyError, ValueError, TypeError):
+            return None
+
+    '''
+    Queue the confirmed 'state' of a light for the next flush(), unless nothing
+    about it changed (then only its confirmation time moves).  Returns True if queued.
+    '''
+    def record(self, address, ipAddress, macAddress, sku, state):
+        values = [state.onOff, state.brightness, state.colorTemInKelvin, state.red, state.green, state.blue]
+        now = int(time.time())
+        with self._lock:
+            previous = self._entries.get(address)
+            if previous is not None and previous.get('s') == values and previous.get('ip') == ipAddress and previous.get('mac') == macAddress and previous.get('sku') == sku:
+                previous['c'] = now
+                if self._unsavedSince is None:
+                    self._unsavedSince = time.monotonic()
+                return False
+            entry = {'a': address, 'ip': ipAddress, 'mac': macAddress, 'sku': sku, 's': values, 't': now, 'c': now}
+            self._entries[address] = entry
+            self._pending.append(entry)
+            return True
+
+    def forget(self, address):
+        with self._lock:
+            if self._entries.pop(address, None) is not None:
+                self._pending.append({'a': address, 'del': 1})
+
+    '''
+    Write the queued changes (appended, or as a compacted journal).  With 'final'
+    (at shutdown), confirmation times not saved yet are written too.
+    '''
+    def flush(self, final=False):
+        with self._lock:
+            confirmationsDue = self._unsavedSince is not None and (final or time.monotonic() - self._unsavedSince >= CONFIRM_SAVE_INTERVAL)
+            if len(self._pending) == 0 and not(confirmationsDue):
+                return
+            pending = self._pending
+            self._pending = []
+            compact = confirmationsDue or self._lines + len(pending) > max(COMPACT_MINIMUM, COMPACT_FACTOR * len(self._entries))
+            entries = list(self._entries.values()) if compact else None
+
+            try:
+                if compact:
+                    temporaryPath = self.path + '.tmp'
+                    with open(temporaryPath, 'w') as journal:
+                        journal.write(''.join([json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries]))
+                    os.replace(temporaryPath, self.path)
+                    self._lines = len(entries)
+                    self._unsavedSince = None
+                else:
+                    with open(self.path, 'a') as journal:
+                        journal.write(''.join([json.dumps(entry, separators=(',', ':')) + '\n' for entry in pending]))
+                    self._lines += len(pending)
+            except OSError as e:
+                LOGGER.error('\n\tUnable to save device states to {}: {}\n'.format(self.path, e))
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+
+Benchmark for the poll and command paths, run against simulated lights (see
+govee_local_simulator.py) and a stubbed udi_interface, so no Polyglot, IoX or
+real hardware is needed.  Reports poll cycle time, p50 / p99 round-trip latency,
+command-to-device latency, Polyglot messages per cycle, and CPU / memory per device.
+
+    python3 tools/govee_local_benchmark.py --devices 10 100 500 --cycles 20
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+
+'''
+Minimal stand-in for udi_interface: just enough of Node / Custom / ISY for the
+node server's classes to run outside of Polyglot.
+'''
+def installStubInterface():
+    if 'udi_interface' in sys.modules:
+        return sys.modules['udi_interface']
+
+    stub = types.ModuleType('udi_interface')
+    stub.LOGGER = logging.getLogger('govee_local_benchmark')
+
+    class Node:
+        def __init__(self, polyglot, primary, address, name):
+            self.poly = polyglot
+            self.primary = primary
+            self.address = address
+            self.name = name
+            self.drivers = [dict(driver) for driver in self.drivers]
+
+        def setDriver(self, driver, value, report=True, force=False, uom=None, text=None):
+            for d in self.drivers:
+                if d['driver'] == driver:
+                    changed = d['value'] != value
+                    d['value'] = value
+                    if report and (changed or force):
+                        self.poly.send({'set': [{'address': self.address, 'driver': driver, 'value': value, 'uom': d['uom']}]}, 'status')
+                    return
+
+        def getDriver(self, driver):
+            for d in self.drivers:
+                if d['driver'] == driver:
+                    return d['value']
+            return None
+
+    class Custom(dict):
+        def __init__(self, polyglot, name):
+            super().__init__()
+
+        def load(self, data, save=False):
+            self.update(data)
+
+        def __getitem__(self, key):
+            return self.get(key)
+
+    class ISY:
+        def __init__(self, polyglot):
+            self.unauthorized = True
+            self._isy_ip = ''
+            self._isy_port = 80
+            self._isy_user = ''
+            self._isy_pass = ''
+
+    stub.Node = Node
+    stub.Custom = Custom
+    stub.ISY = ISY
+    stub.Interface = object
+    sys.modules['udi_interface'] = stub
+    return stub
+
+'''
+Stand-in for the Polyglot Interface: records what would be sent to Polyglot and
+completes addNode() asynchronously, like the real one.
+'''
+class StubPolyglot:
+    CUSTOMPARAMS = 'customparams'
+    CUSTOMDATA = 'customdata'
+    CONFIG = 'config'
+    STOP = 'stop'
+    START = 'start'
+    ADDNODEDONE = 'addnodedone'
+    POLL = 'poll'
+
+    class _Notices(dict):
+        def clear(self):
+            dict.clear(self)
+
+    def __init__(self):
+        self.nodes = {}
+        self.subscriptions = {}
+        self.pg3init = {'isPG3x': True}
+        self.profileNum = 1
+        self.Notices = StubPolyglot._Notices()
+        self.messages = 0
+        self.updates = 0
+
+    def subscribe(self, event, callback, address=None):
+        self.subscriptions.setdefault(event, []).append((callback, address))
+
+    def publish(self, event, *args):
+        for callback, address in list(self.subscriptions.get(event, [])):
+            callback(*args)
+
+    def ready(self):
+        pass
+
+    def addNode(self, node):
+        self.nodes[node.address] = node
+        threading.Timer(0.001, self.publish, (self.ADDNODEDONE, {'address': node.address})).start()
+
+    def getNodes(self):
+        return self.nodes
+
+    def getNode(self, address):
+        return self.nodes.get(address)
+
+    def getNodesFromDb(self):
+        return []
+
+    def delNode(self, address):
+        self.nodes.pop(address, None)
+
+    def renameNode(self, address, name):
+        pass
+
+    def send(self, message, topic):
+        self.messages += 1
+        self.updates += len(message.get('set', []))
+
+    def setCustomParamsDoc(self):
+        pass
+
+    def updateProfile(self):
+        pass
+
+def percentile(values, fraction):
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+'''
+One benchmark run: 'count' simulated lights, 'cycles' full poll cycles, then one
+brightness command to every light.
+'''
+def runBenchmark(count, cycles, latency, jitter, loss, dead, listenPort, devicePort, baseAddress):
+    installStubInterface()
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from nodes import govee_local_controller
+    from nodes import govee_local_warmstart
+    from govee_local_simulator import GoveeLocalSimulator
+
+    simulator = GoveeLocalSimulator(count, baseAddress, latency, jitter, loss, dead,
+                                    scanPort=devicePort + 1, devicePort=devicePort, replyPort=listenPort, multicast=False, seed=1)
+    simulator.start()
+
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+
+    poly = StubPolyglot()
+    controller = govee_local_controller.Controller(poly, 'controller', 'controller', 'Govee Local IP - NodeServer')
+    # keep the simulated lights out of the real warm-start journal
+    dataDirectory = tempfile.TemporaryDirectory(prefix='govee_local_benchmark_')
+    controller.stateStore = govee_local_warmstart.GoveeLocalStateStore(os.path.join(dataDirectory.name, 'govee_local_state.jsonl'))
+    controller.transport.listenPort = listenPort
+    controller.transport.devicePort = devicePort
+    controller.transport.bindAddress = '127.0.0.1'
+    controller.transport.start()
+    controller.commandQueue.start()
+    controller._initialized = True
+
+    roundTrips = []
+    controller.transport.roundTripHook = lambda ipAddress, cmd, seconds: roundTrips.append(seconds)
+
+    ipAddresses = ';'.join([device.ipAddress for device in simulator.devices])
+    names = ';'.join(['Light {}'.format(i) for i in range(0, count)])
+    controller.parameterHandler({'IP_Addresses': ipAddresses, 'Device_Names': names})
+    for device in controller.getDeviceNodes():
+        device._initialized = True
+
+    afterSetup = tracemalloc.take_snapshot()
+    nodeMemory = sum([stat.size_diff for stat in afterSetup.compare_to(baseline, 'filename')])
+
+    cycleTimes = []
+    messagesBefore = poly.messages
+    cpuBefore = time.process_time()
+    for cycle in range(0, cycles):
+        start = time.perf_counter()
+        controller.pollDevices(cycle == 0)
+        cycleTimes.append(time.perf_counter() - start)
+    cpu = time.process_time() - cpuBefore
+    messagesPerCycle = (poly.messages - messagesBefore) / float(max(1, cycles))
+
+    # command path: enqueue -> packet applied by the simulated light
+    devices = controller.getDeviceNodes()
+    sentAt = time.monotonic()
+    for device in devices:
+        device.cmdBrightness({'cmd': 'SETBRI', 'value': '42'})
+    waitUntil = time.monotonic() + 5.0
+    live = [device for device in simulator.devices if not(device.dead)]
+    while time.monotonic() < waitUntil and any([device.brightness != 42 for device in live]):
+        time.sleep(0.005)
+    commandLatencies = [device.lastCommandAt - sentAt for device in live if device.brightness == 42]
+
+    controller.commandQueue.stop()
+    controller.transport.stop()
+    simulator.stop()
+    tracemalloc.stop()
+    dataDirectory.cleanup()
+
+    return {
+        'devices': count,
+        'cycles': cycles,
+        'cycleTimeMs': {'p50': round(percentile(cycleTimes, 0.5) * 1000, 2), 'max': round(max(cycleTimes) * 1000, 2)},
+        'roundTripMs': {'p50': round(percentile(roundTrips, 0.5) * 1000, 2), 'p99': round(percentile(roundTrips, 0.99) * 1000, 2)},
+        'answered': '{}/{}'.format(len(roundTrips), count * cycles),
+        'commandLatencyMs': {'p50': round(percentile(commandLatencies, 0.5) * 1000, 2), 'p99': round(percentile(commandLatencies, 0.99) * 1000, 2)},
+        'polyglotMessagesPerCycle': round(messagesPerCycle, 2),
+        'cpuMsPerDevicePerCycle': round(cpu * 1000 / float(count * cycles), 4),
+        'memoryBytesPerDevice': int(nodeMemory / count)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the node server poll / command paths against simulated lights.')
+    parser.add_argument('--devices', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--cycles', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--jitter', type=float, default=0.002)
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--dead', type=float, default=0.0)
+    parser.add_argument('--listen-port', type=int, default=14002)
+    parser.add_argument('--device-port', type=int, default=14003)
+    parser.add_argument('--base-ip', default='127.0.1.1')
+    parser.add_argument('--json', action='store_true', help='print one JSON object per run')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    for count in args.devices:
+        result = runBenchmark(count, args.cycles, args.latency, args.jitter, args.loss, args.dead,
+                              args.listen_port, args.device_port, args.base_ip)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print('{devices:>5} devices: cycle p50 {cycleTimeMs[p50]:>8} ms, rtt p50/p99 {roundTripMs[p50]}/{roundTripMs[p99]} ms, '
+                  'answered {answered}, command p50/p99 {commandLatencyMs[p50]}/{commandLatencyMs[p99]} ms, '
+                  '{polyglotMessagesPerCycle} msgs/cycle, {cpuMsPerDevicePerCycle} cpu ms/device/cycle, '
+                  '{memoryBytesPerDevice} B/device'.format(**result))
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+
+Micro-benchmark and fuzzer for the Govee LAN codec (nodes/govee_local_codec.py).
+The benchmark times the encoders and decoders against the generic json.dumps /
+json.loads approach they replace; the fuzzer feeds the decoders mutated and
+random datagrams and fails if anything but a CodecError escapes, or if a
+decoded state is out of range.
+
+    python3 tools/govee_local_codec_benchmark.py --iterations 100000 --fuzz 200000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from nodes import govee_local_codec
+
+STATUS_REPLY = b'{"msg":{"cmd":"devStatus","data":{"onOff":1,"brightness":100,"color":{"r":255,"g":0,"b":0},"colorTemInKelvin":7200}}}'
+SCAN_REPLY = b'{"msg":{"cmd":"scan","data":{"ip":"192.168.1.23","device":"1F:80:C5:32:32:36:72:4E","sku":"H618A","bleVersionHard":"3.01.01","bleVersionSoft":"1.03.01","wifiVersionHard":"1.00.10","wifiVersionSoft":"1.02.03"}}}'
+
+def _jsonEncode(cmd, data):
+    return json.dumps({'msg': {'cmd': cmd, 'data': data}}, separators=(',', ':')).encode()
+
+def _jsonDecodeStatus(datagram):
+    data = json.loads(datagram)['msg']['data']
+    color = data.get('color', {})
+    return (int(data['onOff']), int(data['brightness']), int(data.get('colorTemInKelvin', 0)), int(color.get('r', 0)), int(color.get('g', 0)), int(color.get('b', 0)))
+
+def _decodeStatus(datagram):
+    cmd, data = govee_local_codec.decodeDatagram(datagram)
+    return govee_local_codec.decodeStatus(data)
+
+def runBenchmark(iterations):
+    decoder = govee_local_codec.GoveeLocalDecoder()
+    cases = [
+        ('devStatus request', lambda: _jsonEncode('devStatus', {}), lambda: govee_local_codec.STATUS_QUERY),
+        ('brightness', lambda: _jsonEncode('brightness', {'value': 42}), lambda: govee_local_codec.encodeBrightness(42)),
+        ('colorwc', lambda: _jsonEncode('colorwc', {'color': {'r': 10, 'g': 20, 'b': 30}, 'colorTemInKelvin': 0}), lambda: govee_local_codec.encodeColor(10, 20, 30)),
+        ('devStatus reply', lambda: _jsonDecodeStatus(STATUS_REPLY), lambda: _decodeStatus(STATUS_REPLY)),
+        ('devStatus reply (unchanged)', lambda: _jsonDecodeStatus(STATUS_REPLY), lambda: govee_local_codec.decodeStatus(decoder.decode('10.0.0.1', STATUS_REPLY)[1])),
+        ('scan reply', lambda: json.loads(SCAN_REPLY)['msg']['data'], lambda: govee_local_codec.decodeScan(govee_local_codec.decodeDatagram(SCAN_REPLY)[1], '192.168.1.23')),
+        ('scan reply (relayed)', lambda: json.loads(SCAN_REPLY)['msg']['data'], lambda: govee_local_codec.decodeScan(govee_local_codec.decodeDatagram(SCAN_REPLY)[1], '10.0.0.1')),
+    ]
+    for name, baseline, codec in cases:
+        baselineTime = min(timeit.repeat(baseline, number=iterations, repeat=3)) / iterations
+        codecTime = min(timeit.repeat(codec, number=iterations, repeat=3)) / iterations
+        print('{:<30} json {:>8.3f} us   codec {:>8.3f} us   x{:.1f}'.format(name, baselineTime * 1e6, codecTime * 1e6, baselineTime / codecTime))
+
+'''
+A malformed variant of a valid datagram: byte flips, truncation, insertion,
+type-swapped fields, deep nesting, or plain random bytes.
+'''
+def mutate(rng, seeds):
+    datagram = bytearray(rng.choice(seeds))
+    kind = rng.randrange(0, 7)
+    if kind == 0:
+        for i in range(0, rng.randint(1, 8)):
+            datagram[rng.randrange(0, len(datagram))] = rng.randrange(0, 256)
+    elif kind == 1:
+        del datagram[rng.randrange(0, len(datagram)):]
+    elif kind == 2:
+        position = rng.randrange(0, len(datagram))
+        datagram[position:position] = bytes([rng.randrange(0, 256) for i in range(0, rng.randint(1, 16))])
+    elif kind == 3:
+        value = rng.choice([b'"1"', b'-1', b'256', b'1.5', b'null', b'true', b'[]', b'{}', b'1e400', b'99999999999999999999'])
+        for field in (b'"onOff":1', b'"brightness":100', b'"r":255', b'"colorTemInKelvin":7200', b'"device":"1F:80:C5:32:32:36:72:4E"', b'"ip":"192.168.1.23"'):
+            if field in datagram and rng.random() < 0.5:
+                datagram = datagram.replace(field, field.split(b':')[0] + b':' + value)
+    elif kind == 4:
+        depth = rng.randint(100, 1100)
+        datagram = bytearray(b'{"msg":' * depth + b'1' + b'}' * depth)
+    elif kind == 5:
+        datagram = bytearray(rng.getrandbits(8) for i in range(0, rng.randint(0, 64)))
+    else:
+        datagram = datagram * rng.randint(2, 20)
+    return bytes(datagram)
+
+def runFuzz(count, seed):
+    rng = random.Random(seed)
+    seeds = [STATUS_REPLY, SCAN_REPLY, govee_local_codec.STATUS_QUERY]
+    decoder = govee_local_codec.GoveeLocalDecoder()
+    accepted = 0
+    for i in range(0, count):
+        datagram = mutate(rng, seeds)
+        try:
+            cmd, data = decoder.decode('10.0.0.{}'.format(i % 4), datagram)
+            try:
+                state = govee_local_codec.decodeStatus(data)
+                values = (state.onOff, state.brightness, state.colorTemInKelvin, state.red, state.green, state.blue)
+                if not(0 <= values[0] <= 1 and 0 <= values[1] <= 100 and 0 <= values[2] <= govee_local_codec.MAX_KELVIN and all([0 <= value <= 255 for value in values[3:]])):
+                    raise AssertionError('out of range state {} from {!r}'.format(values, datagram))
+                accepted += 1
+            except govee_local_codec.CodecError:
+                pass
+            try:
+                govee_local_codec.decodeScan(data, '10.0.0.1')
+            except govee_local_codec.CodecError:
+                pass
+        except govee_local_codec.CodecError:
+            pass
+        except Exception as e:
+            print('FAIL: {}: {} for datagram {!r}'.format(type(e).__name__, e, datagram))
+            return False
+    print('fuzz: {} datagrams, {} decoded to a valid state, no unexpected exceptions'.format(count, accepted))
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark and fuzz the Govee LAN codec.')
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--fuzz', type=int, default=100000, help='number of fuzzed datagrams (0 to skip)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.iterations > 0:
+        runBenchmark(args.iterations)
+    if args.fuzz > 0 and not(runFuzz(args.fuzz, args.seed)):
+        sys.exit(1)
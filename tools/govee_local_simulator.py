@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Govee Local Network Polyglot v3 node server
+Copyright (C) 2023 Matt Burke
+
+MIT License
+
+Govee LAN device simulator: emulates N lights on loopback addresses (127.x.y.z),
+answering 'scan' on 4001 (unicast, and multicast on the loopback interface) and
+'devStatus' / 'turn' / 'brightness' / 'colorwc' on 4003, with replies sent to port
+4002 of the requester - just like real lights.  Latency, jitter, packet loss and
+dead (never answering) devices are configurable.
+
+    python3 tools/govee_local_simulator.py --devices 100 --latency 0.02 --jitter 0.01 --loss 0.01 --dead 0.05
+"""
+import argparse
+import heapq
+import json
+import random
+import selectors
+import socket
+import struct
+import threading
+import time
+
+GOVEE_MULTICAST_ADDRESS = '239.255.255.250'
+SCAN_PORT = 4001
+REPLY_PORT = 4002
+DEVICE_PORT = 4003
+
+'''
+One simulated light.
+'''
+class SimulatedDevice:
+    __slots__ = ('ipAddress', 'mac', 'sku', 'dead', 'onOff', 'brightness', 'colorTemInKelvin', 'red', 'green', 'blue',
+                 'requests', 'commands', 'lastCommandAt', 'lastCommand')
+
+    def __init__(self, ipAddress, mac, sku='H6008', dead=False):
+        self.ipAddress = ipAddress
+        self.mac = mac
+        self.sku = sku
+        self.dead = dead
+
+        self.onOff = 1
+        self.brightness = 100
+        self.colorTemInKelvin = 4000
+        self.red = 255
+        self.green = 255
+        self.blue = 255
+
+        self.requests = 0
+        self.commands = 0
+        self.lastCommandAt = 0.0
+        self.lastCommand = None
+
+    def statusReply(self):
+        return {'msg': {'cmd': 'devStatus', 'data': {
+            'onOff': self.onOff,
+            'brightness': self.brightness,
+            'color': {'r': self.red, 'g': self.green, 'b': self.blue},
+            'colorTemInKelvin': self.colorTemInKelvin
+        }}}
+
+    def scanReply(self):
+        return {'msg': {'cmd': 'scan', 'data': {
+            'ip': self.ipAddress,
+            'device': self.mac,
+            'sku': self.sku,
+            'bleVersionHard': '3.01.01',
+            'bleVersionSoft': '1.03.01',
+            'wifiVersionHard': '1.00.10',
+            'wifiVersionSoft': '1.02.03'
+        }}}
+
+    '''
+    Apply a control message; returns True if it was one we understand.
+    '''
+    def apply(self, cmd, data):
+        if cmd == 'turn':
+            self.onOff = 1 if int(data['value']) else 0
+        elif cmd == 'brightness':
+            self.brightness = int(data['value'])
+        elif cmd == 'colorwc':
+            color = data.get('color', {})
+            self.red = int(color.get('r', 0))
+            self.green = int(color.get('g', 0))
+            self.blue = int(color.get('b', 0))
+            self.colorTemInKelvin = int(data.get('colorTemInKelvin', 0))
+        elif cmd == 'razer':
+            pass
+        else:
+            return False
+        self.commands += 1
+        self.lastCommandAt = time.monotonic()
+        self.lastCommand = cmd
+        return True
+
+'''
+GoveeLocalSimulator
+All the simulated lights, served from one selector thread.  Replies are delayed
+by 'latency' +/- 'jitter' seconds and dropped with probability 'loss'.
+'''
+class GoveeLocalSimulator:
+
+    def __init__(self, count, baseAddress='127.0.1.1', latency=0.0, jitter=0.0, loss=0.0, dead=0.0,
+                 scanPort=SCAN_PORT, devicePort=DEVICE_PORT, replyPort=REPLY_PORT, multicast=True, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.scanPort = scanPort
+        self.devicePort = devicePort
+        self.replyPort = replyPort
+        self.multicast = multicast
+        self._random = random.Random(seed)
+
+        self.devices = []
+        first = struct.unpack('!I', socket.inet_aton(baseAddress))[0]
+        for i in range(0, count):
+            ipAddress = socket.inet_ntoa(struct.pack('!I', first + i))
+            mac = ':'.join(['{:02X}'.format(b) for b in struct.pack('!Q', 0x1F80C50000000000 + i)])
+            self.devices.append(SimulatedDevice(ipAddress, mac, dead=self._random.random() < dead))
+        self.byAddress = {device.ipAddress: device for device in self.devices}
+
+        self._selector = None
+        self._sockets = []
+        self._outbox = []
+        self._outboxLock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+        self.received = 0
+        self.replied = 0
+        self.dropped = 0
+
+    def start(self):
+        self._selector = selectors.DefaultSelector()
+        for device in self.devices:
+            for port in (self.devicePort, self.scanPort):
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind((device.ipAddress, port))
+                sock.setblocking(False)
+                self._selector.register(sock, selectors.EVENT_READ, device)
+                self._sockets.append(sock)
+
+        if self.multicast:
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind((GOVEE_MULTICAST_ADDRESS, self.scanPort))
+                membership = socket.inet_aton(GOVEE_MULTICAST_ADDRESS) + socket.inet_aton('127.0.0.1')
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+                sock.setblocking(False)
+                self._selector.register(sock, selectors.EVENT_READ, None)
+                self._sockets.append(sock)
+            except OSError as e:
+                print('Multicast scan not available on loopback ({}); unicast scan still works.'.format(e))
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='GoveeLocalSimulator', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(2.0)
+        for sock in self._sockets:
+            self._selector.unregister(sock)
+            sock.close()
+        self._sockets = []
+        self._selector.close()
+
+    def _queueReply(self, sock, device, message, destination):
+        if device.dead:
+            return
+        if self._random.random() < self.loss:
+            self.dropped += 1
+            return
+        delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+        payload = json.dumps(message, separators=(',', ':')).encode()
+        with self._outboxLock:
+            heapq.heappush(self._outbox, (time.monotonic() + delay, id(payload), sock, payload, destination))
+
+    def _handle(self, sock, device, datagram, source):
+        self.received += 1
+        try:
+            msg = json.loads(datagram)['msg']
+            cmd = msg['cmd']
+            data = msg.get('data', {})
+        except (ValueError, KeyError, TypeError):
+            return
+        destination = (source[0], self.replyPort)
+
+        if cmd == 'scan':
+            targets = self.devices if device is None else [device]
+            for target in targets:
+                self._queueReply(sock, target, target.scanReply(), destination)
+        elif device is None:
+            return
+        elif cmd == 'devStatus':
+            device.requests += 1
+            self._queueReply(sock, device, device.statusReply(), destination)
+        elif not(device.dead):
+            device.apply(cmd, data)
+
+    def _flushOutbox(self, now):
+        while True:
+            with self._outboxLock:
+                if len(self._outbox) == 0 or self._outbox[0][0] > now:
+                    return
+                due, key, sock, payload, destination = heapq.heappop(self._outbox)
+            try:
+                sock.sendto(payload, destination)
+                self.replied += 1
+            except OSError:
+                self.dropped += 1
+
+    def _run(self):
+        while self._running:
+            now = time.monotonic()
+            self._flushOutbox(now)
+            with self._outboxLock:
+                timeout = 0.05 if len(self._outbox) == 0 else max(0.0, min(0.05, self._outbox[0][0] - now))
+            for key, mask in self._selector.select(timeout):
+                while True:
+                    try:
+                        datagram, source = key.fileobj.recvfrom(2048)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except OSError:
+                        break
+                    self._handle(key.fileobj, key.data, datagram, source)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Simulate Govee LAN API lights on loopback addresses.')
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--base-ip', default='127.0.1.1')
+    parser.add_argument('--latency', type=float, default=0.01, help='reply delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.005, help='+/- random delay in seconds')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability of dropping a reply')
+    parser.add_argument('--dead', type=float, default=0.0, help='fraction of devices that never answer')
+    parser.add_argument('--scan-port', type=int, default=SCAN_PORT)
+    parser.add_argument('--device-port', type=int, default=DEVICE_PORT)
+    parser.add_argument('--reply-port', type=int, default=REPLY_PORT)
+    args = parser.parse_args()
+
+    simulator = GoveeLocalSimulator(args.devices, args.base_ip, args.latency, args.jitter, args.loss, args.dead,
+                                    args.scan_port, args.device_port, args.reply_port)
+    simulator.start()
+    print('Simulating {} Govee lights from {} (devStatus on {}, scan on {}, replies to {}). Ctrl-C to stop.'.format(
+        args.devices, args.base_ip, args.device_port, args.scan_port, args.reply_port))
+    try:
+        while True:
+            time.sleep(10)
+            print('received {}, replied {}, dropped {}'.format(simulator.received, simulator.replied, simulator.dropped))
+    except KeyboardInterrupt:
+        simulator.stop()